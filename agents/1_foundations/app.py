@@ -1,23 +1,15 @@
 from dotenv import load_dotenv
 from openai import OpenAI
 import json
-import os
-import requests
 from pypdf import PdfReader
 import gradio as gr
+from notifications import notifier
 
 
 load_dotenv(override=True)
 
 def push(text):
-    requests.post(
-        "https://api.pushover.net/1/messages.json",
-        data={
-            "token": os.getenv("PUSHOVER_TOKEN"),
-            "user": os.getenv("PUSHOVER_USER"),
-            "message": text,
-        }
-    )
+    notifier.notify(text)
 
 
 def record_user_details(email, name="Name not provided", notes="not provided"):
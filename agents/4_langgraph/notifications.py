@@ -0,0 +1,144 @@
+"""
+Push notifications sent from a background thread, so a caller never waits on Pushover.
+
+Messages that arrive within PUSH_COALESCE_SECONDS of each other are joined into one notification, and failed
+sends are retried with backoff; failures are logged, since nobody is waiting for the result. The queue is
+bounded: when it is full, the oldest message is dropped. PUSH_BACKEND=file appends each notification to
+PUSH_FILE instead of sending it, for running without Pushover.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+import requests
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+logger = logging.getLogger(__name__)
+
+pushover_user = os.getenv("PUSHOVER_USER")
+pushover_token = os.getenv("PUSHOVER_TOKEN")
+pushover_url = "https://api.pushover.net/1/messages.json"
+
+PUSH_BACKEND = os.getenv("PUSH_BACKEND", "pushover").strip().lower()
+PUSH_FILE = os.getenv("PUSH_FILE", "notifications.jsonl")
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "100"))
+PUSH_COALESCE_SECONDS = float(os.getenv("PUSH_COALESCE_SECONDS", "2"))
+PUSH_MAX_RETRIES = 5
+PUSH_TIMEOUT_SECONDS = 10
+PUSHOVER_MAX_LENGTH = 1024
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, OSError))
+
+
+def combine(batch: list[str]) -> list[str]:
+    """Join a batch into as few notifications as fit within Pushover's message length"""
+    messages = []
+    for text in batch:
+        text = text[:PUSHOVER_MAX_LENGTH]
+        if messages and len(messages[-1]) + 1 + len(text) <= PUSHOVER_MAX_LENGTH:
+            messages[-1] += "\n" + text
+        else:
+            messages.append(text)
+    return messages
+
+
+class Notifier:
+    """Queues notifications and sends them from a daemon thread, through one pooled HTTP session"""
+
+    def __init__(self, queue_size: int = PUSH_QUEUE_SIZE, coalesce_seconds: float = PUSH_COALESCE_SECONDS):
+        self.queue = queue.Queue(queue_size)
+        self.coalesce_seconds = coalesce_seconds
+        self.lock = threading.Lock()
+        self.thread = None
+        self.session = None
+        self.dropped = 0
+
+    def notify(self, message: str) -> None:
+        """Queue a message and return at once"""
+        self._start()
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                    logger.warning("Dropped a notification because the queue was full")
+                except queue.Empty:
+                    pass
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="notifications", daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def _next_batch(self) -> list[str]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.coalesce_seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, message: str) -> None:
+        if PUSH_BACKEND == "file":
+            line = json.dumps({"datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "message": message})
+            with open(PUSH_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            return
+        self.session = self.session or requests.Session()
+        payload = {"user": pushover_user, "token": pushover_token, "message": message}
+        response = self.session.post(pushover_url, data=payload, timeout=PUSH_TIMEOUT_SECONDS)
+        response.raise_for_status()
+
+    def _send_with_retries(self, message: str) -> None:
+        for attempt in range(PUSH_MAX_RETRIES + 1):
+            try:
+                self._send(message)
+                return
+            except Exception as e:
+                if attempt == PUSH_MAX_RETRIES or not is_retryable(e):
+                    logger.error(f"Unable to send notification: {e}")
+                    return
+                time.sleep(min(2**attempt, 30) * random.uniform(0.5, 1.5))
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                for message in combine(batch):
+                    self._send_with_retries(message)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self, timeout: float = PUSH_TIMEOUT_SECONDS) -> None:
+        """Wait, for at most timeout seconds, until everything queued so far has been sent or has failed"""
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self.queue.all_tasks_done.wait(remaining)
+
+
+notifier = Notifier()
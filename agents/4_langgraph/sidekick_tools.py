@@ -1,21 +1,17 @@
 from playwright.async_api import async_playwright
 from langchain_community.agent_toolkits import PlayWrightBrowserToolkit
 from dotenv import load_dotenv
-import os
-import requests
 from langchain.agents import Tool
 from langchain_community.agent_toolkits import FileManagementToolkit
 from langchain_community.tools.wikipedia.tool import WikipediaQueryRun
 from langchain_experimental.tools import PythonREPLTool
 from langchain_community.utilities import GoogleSerperAPIWrapper
 from langchain_community.utilities.wikipedia import WikipediaAPIWrapper
+from notifications import notifier
 
 
 
 load_dotenv(override=True)
-pushover_token = os.getenv("PUSHOVER_TOKEN")
-pushover_user = os.getenv("PUSHOVER_USER")
-pushover_url = "https://api.pushover.net/1/messages.json"
 serper = GoogleSerperAPIWrapper()
 
 async def playwright_tools():
@@ -28,17 +24,8 @@ async def playwright_tools():
 def push(text: str):
     """Send a push notification to the user"""
     print(f"🔔 [PUSH] Sending push notification: {text[:50]}...")
-    try:
-        response = requests.post(pushover_url, data = {"token": pushover_token, "user": pushover_user, "message": text})
-        if response.status_code == 200:
-            print(f"✅ [PUSH] Notification sent successfully")
-            return "Push notification sent successfully"
-        else:
-            print(f"❌ [PUSH] Failed to send notification: {response.status_code}")
-            return f"Failed to send push notification: {response.status_code}"
-    except Exception as e:
-        print(f"❌ [PUSH] Error sending notification: {e}")
-        return f"Error sending push notification: {e}"
+    notifier.notify(text)
+    return "Push notification queued"
 
 
 def get_file_tools():
@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 import logging
 from message_tracker import message_tracker
 from message_visualizer import message_visualizer
+from llm_executor import generate_reply
 
 load_dotenv(override=True)
 
@@ -28,6 +29,7 @@ class Agent:
     """
 
     CHANCES_THAT_I_BOUNCE_IDEA_OFF_ANOTHER = 0.5
+    LLM_TIMEOUT_SECONDS = None  # None uses LLM_TIMEOUT_SECONDS from the environment
 
     def __init__(self, name) -> None:
         self.name = name
@@ -91,7 +93,8 @@ class Agent:
         logger.info(f"📤 {self.name} sending message to {agent_id.type}_{agent_id.key}")
         
         try:
-            response = await self.runtime.send_message(message, agent_id)
+            with message_tracker.handling(exchange_id):
+                response = await self.runtime.send_message(message, agent_id)
             
             # Complete message exchange tracking
             message_tracker.complete_message_exchange(
@@ -121,7 +124,7 @@ class Agent:
         logger.info(f"📨 {self.name} received message: {message.content[:50]}...")
         
         # Generate initial idea
-        response = self._delegate.generate_reply([{"role": "user", "content": message.content}])
+        response = await generate_reply(self._delegate, [{"role": "user", "content": message.content}], self.LLM_TIMEOUT_SECONDS)
         idea = response
         
         logger.info(f"💡 {self.name} generated idea: {idea[:50]}...")
@@ -6,6 +6,7 @@ import os
 from dotenv import load_dotenv
 from message_tracker import message_tracker
 from message_visualizer import message_visualizer
+from llm_executor import generate_reply
 
 load_dotenv(override=True)
 
@@ -30,6 +31,9 @@ class Creator:
     Respond only with the python code, no other text, and no markdown code blocks.
     """
 
+    # Writing a whole agent takes longer than a reply, so the creator gets a longer timeout
+    LLM_TIMEOUT_SECONDS = 300
+
     def __init__(self, name) -> None:
         self.name = name
         self.id = messages.AgentId("creator", name)
@@ -94,6 +98,7 @@ IMPORTANT REQUIREMENTS:
 3. Keep the same method signatures: __init__(self, name), register(), send_message(), handle_message()
 4. Use the same logging and message handling patterns
 5. Be creative about the system message and business focus, but keep the technical structure identical
+6. Call the LLM only through 'await generate_reply(self._delegate, ...)' from llm_executor, never self._delegate.generate_reply directly
 
 Respond only with the python code, no other text, and no markdown code blocks.
 
@@ -113,7 +118,10 @@ Here is the template:
         
         # Generate new agent code
         prompt = self.get_user_prompt()
-        response = self._delegate.generate_reply([{"role": "user", "content": prompt}])
+        try:
+            response = await generate_reply(self._delegate, [{"role": "user", "content": prompt}], self.LLM_TIMEOUT_SECONDS)
+        except TimeoutError as e:
+            return messages.Message(content=f"Failed to create agent {agent_name}: {e}")
         
         # Write the new agent file
         with open(filename, "w", encoding="utf-8") as f:
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+A multi-process agent runtime for one machine: a host process routes messages over a Unix or TCP socket
+to worker processes, each of which hosts a shard of the agents.
+
+- Placement: an agent lives on the worker chosen by a stable hash of its (type, key), so agents with the
+  same type but different keys spread across workers and cores.
+- Registration: registering an agent type (including a new agent written by the Creator on a worker)
+  is sent to every worker, which builds its instances on demand from the type's module and class.
+- Correlation: every request carries an id, and the reply carries it back, so many requests share a connection.
+- Backpressure: the host lets only WORLD_MAX_INFLIGHT of its own requests run on each worker at once,
+  and every socket write waits for the peer to drain. Requests that agents send each other are not
+  limited, since a handler waiting on one while holding a slot could deadlock its worker.
+- Restart: a worker that dies is started again, with delays that grow while it keeps dying and start over
+  once it has stayed up for WORLD_HEALTHY_SECONDS; requests it was handling fail, and requests for its
+  agents wait until it is back.
+- Deadlines: a request with no reply within WORLD_REQUEST_TIMEOUT fails with RemoteAgentError, and the
+  bookkeeping for it is dropped, so a hung handler cannot hold its caller or the host's memory forever.
+- LLM calls: LLM_MAX_CONCURRENCY is shared out between the workers, so there are never more workers than it.
+
+Frames are a 4-byte big-endian length followed by a JSON object.
+
+    python distributed_runtime.py worker --address unix:/tmp/world.sock --index 0 --workers 4 \
+        --llm-max-concurrency 5 --exchange-log message_exchanges.worker0.json   # started by the host
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib
+import itertools
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+from llm_executor import LLM_MAX_CONCURRENCY
+import messages
+
+load_dotenv(override=True)
+
+logger = logging.getLogger(__name__)
+
+WORLD_WORKERS = int(os.getenv("WORLD_WORKERS") or os.cpu_count() or 1)
+# "unix:/path/to.sock" or "host:port"; empty means a Unix socket in the temp directory
+WORLD_ADDRESS = os.getenv("WORLD_ADDRESS", "")
+WORLD_MAX_INFLIGHT = int(os.getenv("WORLD_MAX_INFLIGHT", "4"))
+WORLD_START_TIMEOUT = float(os.getenv("WORLD_START_TIMEOUT", "60"))
+WORLD_MAX_RESTART_DELAY = float(os.getenv("WORLD_MAX_RESTART_DELAY", "30"))
+# A worker that has stayed up this long counts as healthy, and its next restart is immediate again
+WORLD_HEALTHY_SECONDS = float(os.getenv("WORLD_HEALTHY_SECONDS", "60"))
+WORLD_REQUEST_TIMEOUT = float(os.getenv("WORLD_REQUEST_TIMEOUT", "600"))
+
+HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+class RemoteAgentError(RuntimeError):
+    """A request failed on the worker that handled it, or that worker went away"""
+
+
+def placement(agent_type: str, key: str, workers: int) -> int:
+    """The worker that hosts an agent; the same in every process, unlike hash()"""
+    digest = hashlib.blake2b(f"{agent_type}/{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % workers
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """The next frame, or None when the connection has closed"""
+    try:
+        (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if size > MAX_FRAME_BYTES:
+            raise ValueError(f"Frame of {size} bytes is too large")
+        return json.loads(await reader.readexactly(size))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def send_frame(writer: asyncio.StreamWriter, frame: Dict[str, Any]) -> None:
+    """Queue a frame on the connection; each frame is a single write, so concurrent senders never interleave"""
+    data = json.dumps(frame, ensure_ascii=False).encode()
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+async def write_frame(writer: asyncio.StreamWriter, frame: Dict[str, Any]) -> None:
+    """Send a frame, waiting while the peer is behind"""
+    send_frame(writer, frame)
+    await writer.drain()
+
+
+def default_address() -> str:
+    return WORLD_ADDRESS or f"unix:{os.path.join(tempfile.gettempdir(), f'world-{os.getpid()}.sock')}"
+
+
+async def open_connection(address: str):
+    if address.startswith("unix:"):
+        return await asyncio.open_unix_connection(address[len("unix:"):])
+    host, port = address.rsplit(":", 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+async def deliver(agent, message: messages.Message) -> messages.Message:
+    """Call whichever handler the agent has, as the in-process runtimes in world.py do"""
+    ctx = messages.MessageContext() if hasattr(messages, 'MessageContext') else None
+    if hasattr(agent, 'handle_my_message_type'):
+        return await agent.handle_my_message_type(message, ctx)
+    if hasattr(agent, 'handle_message'):
+        return await agent.handle_message(message, ctx)
+    return messages.Message(content=f"Agent {agent.name} received: {message.content}")
+
+
+def agent_spec(agent_type: str, agent) -> Dict[str, str]:
+    """How another process can build this agent: its module, class and constructor name"""
+    cls = type(agent)
+    return {"type": agent_type, "module": cls.__module__, "cls": cls.__qualname__, "name": agent.name}
+
+
+@dataclass
+class WorkerConnection:
+    """The host's view of one worker process"""
+    index: int
+    semaphore: asyncio.Semaphore
+    process: Optional[asyncio.subprocess.Process] = None
+    writer: Optional[asyncio.StreamWriter] = None
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    restarts: int = 0
+
+
+class DistributedRuntimeHost:
+    """Starts the workers, keeps the registry of agent types, and routes every request to the worker that owns it"""
+
+    def __init__(self, workers: int = WORLD_WORKERS, address: str = None, max_inflight: int = WORLD_MAX_INFLIGHT):
+        # Each worker needs at least one of the LLM_MAX_CONCURRENCY slots
+        workers = max(1, min(workers, LLM_MAX_CONCURRENCY))
+        self.workers = [WorkerConnection(i, asyncio.Semaphore(max_inflight)) for i in range(workers)]
+        self.address = address or default_address()
+        self.registry: Dict[str, Dict[str, str]] = {}  # agent type -> spec
+        self.pending: Dict[int, tuple] = {}  # request id -> (reply future, target worker), for the host's own requests
+        self.routes: Dict[int, tuple] = {}  # forwarded request id -> (origin worker, origin id, target worker)
+        self.ids = itertools.count(1)
+        self.server = None
+        self.supervisors = []
+        self.connections = set()
+        self.running = False
+
+    @property
+    def agents(self) -> Dict[str, Dict[str, str]]:
+        return self.registry
+
+    async def start(self) -> None:
+        """Listen, start every worker, and wait until all of them have connected"""
+        if self.address.startswith("unix:"):
+            path = self.address[len("unix:"):]
+            if os.path.exists(path):
+                os.unlink(path)
+            self.server = await asyncio.start_unix_server(self._serve, path)
+        else:
+            host, port = self.address.rsplit(":", 1)
+            self.server = await asyncio.start_server(self._serve, host, int(port))
+        self.running = True
+        self.supervisors = [asyncio.create_task(self._supervise(worker)) for worker in self.workers]
+        await asyncio.wait_for(asyncio.gather(*(w.ready.wait() for w in self.workers)), WORLD_START_TIMEOUT)
+        logger.info(f"🌐 Distributed runtime host at {self.address} with {len(self.workers)} workers")
+
+    def _worker_args(self, index: int) -> list[str]:
+        """
+        Settings of a worker's own, passed as arguments: every module calls load_dotenv(override=True)
+        when imported, which would replace them if .env set them and they came through the environment
+        """
+        # Keep the total number of concurrent LLM calls where it was with one process; the first workers take the remainder
+        base, extra = divmod(LLM_MAX_CONCURRENCY, len(self.workers))
+        return [
+            "--llm-max-concurrency", str(base + (index < extra)),
+            # Each process logs its exchanges to its own file; exchange_log.log_files() picks them all up
+            "--exchange-log", f"message_exchanges.worker{index}.json",
+        ]
+
+    async def _supervise(self, worker: WorkerConnection) -> None:
+        """Run a worker process, and start it again whenever it exits while the host is running"""
+        loop = asyncio.get_running_loop()
+        while self.running:
+            started = loop.time()
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "worker", "--address", self.address,
+                "--index", str(worker.index), "--workers", str(len(self.workers)), *self._worker_args(worker.index),
+            )
+            code = await worker.process.wait()
+            if not self.running:
+                return
+            if loop.time() - started >= WORLD_HEALTHY_SECONDS:
+                worker.restarts = 0
+            worker.restarts += 1
+            delay = min(WORLD_MAX_RESTART_DELAY, 2 ** (worker.restarts - 1))
+            logger.error(f"💥 Worker {worker.index} exited with code {code}; restarting in {delay:g}s")
+            await asyncio.sleep(delay)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        hello = await read_frame(reader)
+        if not hello or hello.get("kind") != "hello":
+            writer.close()
+            return
+        worker = self.workers[hello["worker"]]
+        worker.writer = writer
+        self.connections.add(asyncio.current_task())
+        for spec in list(self.registry.values()):
+            send_frame(writer, {"kind": "register", **spec})
+        worker.ready.set()
+        logger.info(f"🔌 Worker {worker.index} connected (pid {worker.process.pid if worker.process else '?'})")
+        try:
+            # Frames from one worker are handled in order, so a type it registers is known everywhere
+            # before any request it sends to that type
+            while (frame := await read_frame(reader)) is not None:
+                await self._handle(worker, frame)
+        finally:
+            if worker.writer is writer:
+                worker.ready.clear()
+                worker.writer = None
+                self._fail_routes(worker.index)
+            writer.close()
+            self.connections.discard(asyncio.current_task())
+
+    async def _handle(self, origin: WorkerConnection, frame: Dict[str, Any]) -> None:
+        kind = frame.get("kind")
+        if kind == "register":
+            spec = {k: frame[k] for k in ("type", "module", "cls", "name")}
+            self.registry[spec["type"]] = spec
+            for worker in self.workers:
+                if worker is not origin and worker.writer:
+                    send_frame(worker.writer, {"kind": "register", **spec})
+            logger.info(f"✅ Host registered agent type {spec['type']} from worker {origin.index}")
+        elif kind == "request":
+            target = self.workers[placement(frame["type"], frame["key"], len(self.workers))]
+            request_id = next(self.ids)
+            self.routes[request_id] = (origin, frame["id"], target.index)
+            # By then the requesting worker has given up on the reply, and would drop it anyway
+            asyncio.get_running_loop().call_later(WORLD_REQUEST_TIMEOUT, self.routes.pop, request_id, None)
+            asyncio.create_task(self._forward(target, {**frame, "id": request_id}))
+        elif kind == "response":
+            request_id = frame["id"]
+            if request_id in self.routes:
+                requester, origin_id, _ = self.routes.pop(request_id)
+                if requester.writer:
+                    await write_frame(requester.writer, {**frame, "id": origin_id})
+            elif request_id in self.pending:
+                future, _ = self.pending.pop(request_id)
+                if not future.done():
+                    future.set_result(frame)
+
+    async def _forward(self, target: WorkerConnection, frame: Dict[str, Any]) -> None:
+        """Pass a worker's request on to the worker that owns the agent, once that worker is connected"""
+        try:
+            await asyncio.wait_for(target.ready.wait(), WORLD_START_TIMEOUT)
+            await write_frame(target.writer, frame)
+        except Exception as e:
+            await self._handle(target, {"kind": "response", "id": frame["id"], "error": f"Worker {target.index} unavailable: {e}"})
+
+    def _fail_routes(self, index: int) -> None:
+        """Answer every request in flight on a worker that went away with an error"""
+        error = f"Worker {index} stopped while handling the request"
+        for request_id, (requester, origin_id, target) in list(self.routes.items()):
+            if target == index:
+                del self.routes[request_id]
+                if requester.writer:
+                    send_frame(requester.writer, {"kind": "response", "id": origin_id, "error": error})
+            elif requester.index == index:
+                del self.routes[request_id]
+        for request_id, (future, target) in list(self.pending.items()):
+            if target == index:
+                del self.pending[request_id]
+                if not future.done():
+                    future.set_exception(RemoteAgentError(error))
+
+    async def register(self, agent_type: str, module: str, cls: str, name: str = None) -> None:
+        """Register an agent type by where its class lives; every worker can then build its instances"""
+        spec = {"type": agent_type, "module": module, "cls": cls, "name": name or agent_type}
+        self.registry[agent_type] = spec
+        for worker in self.workers:
+            if worker.writer:
+                send_frame(worker.writer, {"kind": "register", **spec})
+        logger.info(f"✅ Registered agent type {agent_type} ({module}.{cls})")
+
+    async def send_message(self, message: messages.Message, agent_id: messages.AgentId) -> messages.Message:
+        """Send a message to an agent on whichever worker hosts it, and wait for its reply"""
+        worker = self.workers[placement(agent_id.type, agent_id.key, len(self.workers))]
+        async with worker.semaphore:
+            await asyncio.wait_for(worker.ready.wait(), WORLD_START_TIMEOUT)
+            request_id = next(self.ids)
+            future = asyncio.get_running_loop().create_future()
+            self.pending[request_id] = (future, worker.index)
+            logger.info(f"📨 Host routing message for {agent_id} to worker {worker.index}")
+            try:
+                await write_frame(worker.writer, {
+                    "kind": "request", "id": request_id, "type": agent_id.type, "key": agent_id.key,
+                    "content": message.content,
+                })
+                reply = await asyncio.wait_for(future, WORLD_REQUEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise RemoteAgentError(f"{agent_id} did not reply within {WORLD_REQUEST_TIMEOUT:g} seconds")
+            finally:
+                self.pending.pop(request_id, None)
+        if "error" in reply:
+            raise RemoteAgentError(reply["error"])
+        return messages.Message(content=reply["content"])
+
+    async def stop(self) -> None:
+        """Ask the workers to finish, and kill any that have not within ten seconds"""
+        self.running = False
+        for worker in self.workers:
+            if worker.writer:
+                send_frame(worker.writer, {"kind": "stop"})
+        for worker in self.workers:
+            if worker.process and worker.process.returncode is None:
+                try:
+                    await asyncio.wait_for(worker.process.wait(), 10)
+                except asyncio.TimeoutError:
+                    worker.process.kill()
+        for task in self.supervisors:
+            task.cancel()
+        if self.connections:
+            await asyncio.wait(self.connections, timeout=10)
+        self.server.close()
+        await self.server.wait_closed()
+        if self.address.startswith("unix:") and os.path.exists(self.address[len("unix:"):]):
+            os.unlink(self.address[len("unix:"):])
+        logger.info("⏹️ Distributed runtime host stopped")
+
+
+class AgentDirectory(dict):
+    """
+    The agent types a worker knows about, mapped to their specs.
+    Agents register themselves with `runtime.agents[agent_type] = agent`, so setting an item registers the type.
+    """
+
+    def __init__(self, runtime: "WorkerRuntime"):
+        super().__init__()
+        self.runtime = runtime
+
+    def __setitem__(self, agent_type: str, agent) -> None:
+        if isinstance(agent, dict):
+            super().__setitem__(agent_type, agent)
+        else:
+            self.runtime.register_local(agent_type, agent)
+
+
+class WorkerRuntime:
+    """The runtime inside a worker process: builds and runs its shard of agents, and sends everything else via the host"""
+
+    def __init__(self, address: str, index: int, workers: int):
+        self.address = address
+        self.index = index
+        self.workers = workers
+        self.agents = AgentDirectory(self)
+        self.instances: Dict[tuple, Any] = {}  # (type, key) -> agent
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.ids = itertools.count(1)
+        self.reader = self.writer = None
+        self.tasks = set()
+
+    def register_local(self, agent_type: str, agent) -> None:
+        """An agent registered in this process: share its type with the host, and keep the instance if it lives here"""
+        spec = agent_spec(agent_type, agent)
+        dict.__setitem__(self.agents, agent_type, spec)
+        if placement(agent_type, "default", self.workers) == self.index:
+            self.instances[(agent_type, "default")] = agent
+        # Sent straight away, so it reaches the host ahead of any message for the new type
+        send_frame(self.writer, {"kind": "register", **spec})
+        logger.info(f"✅ Worker {self.index} registered agent type {agent_type}")
+
+    def _instance(self, agent_type: str, key: str):
+        agent = self.instances.get((agent_type, key))
+        if agent is None:
+            spec = self.agents.get(agent_type)
+            if spec is None:
+                raise KeyError(f"Agent type {agent_type} is not registered")
+            if spec["module"] not in sys.modules:
+                importlib.invalidate_caches()  # The module may be a file another worker has just written
+            agent = getattr(importlib.import_module(spec["module"]), spec["cls"])(spec["name"])
+            agent.runtime = self
+            self.instances[(agent_type, key)] = agent
+        return agent
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def send_message(self, message: messages.Message, agent_id: messages.AgentId) -> messages.Message:
+        """Deliver directly when this worker hosts the agent, otherwise through the host"""
+        if placement(agent_id.type, agent_id.key, self.workers) == self.index:
+            return await deliver(self._instance(agent_id.type, agent_id.key), message)
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await write_frame(self.writer, {
+                "kind": "request", "id": request_id, "type": agent_id.type, "key": agent_id.key,
+                "content": message.content,
+            })
+            reply = await asyncio.wait_for(future, WORLD_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RemoteAgentError(f"{agent_id} did not reply within {WORLD_REQUEST_TIMEOUT:g} seconds")
+        finally:
+            self.pending.pop(request_id, None)
+        if "error" in reply:
+            raise RemoteAgentError(reply["error"])
+        return messages.Message(content=reply["content"])
+
+    async def _answer(self, frame: Dict[str, Any]) -> None:
+        try:
+            agent = self._instance(frame["type"], frame["key"])
+            response = await deliver(agent, messages.Message(content=frame["content"]))
+            reply = {"kind": "response", "id": frame["id"], "content": response.content}
+        except Exception as e:
+            logger.error(f"❌ Worker {self.index} failed to handle a message for {frame['type']}_{frame['key']}: {e}")
+            reply = {"kind": "response", "id": frame["id"], "error": f"{type(e).__name__}: {e}"}
+        await write_frame(self.writer, reply)
+
+    async def run(self) -> None:
+        """Connect to the host and serve requests until told to stop, or until the host goes away"""
+        self.reader, self.writer = await open_connection(self.address)
+        await write_frame(self.writer, {"kind": "hello", "worker": self.index})
+        logger.info(f"🔧 Worker {self.index} connected to {self.address} (pid {os.getpid()})")
+        while (frame := await read_frame(self.reader)) is not None:
+            kind = frame.get("kind")
+            if kind == "register":
+                dict.__setitem__(self.agents, frame["type"], {k: frame[k] for k in ("type", "module", "cls", "name")})
+            elif kind == "request":
+                self._spawn(self._answer(frame))
+            elif kind == "response":
+                future = self.pending.pop(frame["id"], None)
+                if future and not future.done():
+                    future.set_result(frame)
+            elif kind == "stop":
+                break
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(RemoteAgentError("The host closed the connection"))
+        self.writer.close()
+        from message_tracker import message_tracker
+        message_tracker.flush()
+        logger.info(f"⏹️ Worker {self.index} stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a worker of the distributed agent runtime")
+    parser.add_argument("role", choices=["worker"])
+    parser.add_argument("--address", required=True, help="The host's address, unix:/path or host:port")
+    parser.add_argument("--index", type=int, required=True, help="Which worker this is")
+    parser.add_argument("--workers", type=int, required=True, help="How many workers there are")
+    parser.add_argument("--llm-max-concurrency", type=int, required=True, help="This worker's share of LLM_MAX_CONCURRENCY")
+    parser.add_argument("--exchange-log", required=True, help="The file this worker logs its message exchanges to")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - worker{args.index} - %(levelname)s - %(message)s')
+    # Agents the Creator writes land in the working directory, which a script's sys.path does not include
+    sys.path.insert(0, os.getcwd())
+    import llm_executor
+    from message_tracker import message_tracker
+    llm_executor.set_max_concurrency(args.llm_max_concurrency)
+    message_tracker.set_log_file(args.exchange_log)
+    asyncio.run(WorkerRuntime(args.address, args.index, args.workers).run())
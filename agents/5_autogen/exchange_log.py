@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Background JSONL writer for message exchange records, and an offline reader that merges them.
+
+The tracker logs each exchange twice, when it starts and when it completes. Records are queued in memory
+and written in batches by a background thread, so the event loop never waits on the disk. The file is
+rotated once it reaches a size or an age, and rotated files are optionally compressed with gzip or zstd.
+
+    python exchange_log.py                                 # summarise message_exchanges.json and its rotations
+    python exchange_log.py message_exchanges.json -o merged.jsonl   # one merged row per exchange
+"""
+
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_LOG_BATCH = int(os.getenv("EXCHANGE_LOG_BATCH", "100"))
+EXCHANGE_LOG_FLUSH_SECONDS = float(os.getenv("EXCHANGE_LOG_FLUSH_SECONDS", "1.0"))
+EXCHANGE_LOG_BUFFER_SIZE = int(os.getenv("EXCHANGE_LOG_BUFFER_SIZE", "100000"))
+EXCHANGE_LOG_MAX_BYTES = int(os.getenv("EXCHANGE_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+EXCHANGE_LOG_MAX_AGE_HOURS = float(os.getenv("EXCHANGE_LOG_MAX_AGE_HOURS", "24"))
+# "none", "gzip" or "zstd" (zstd needs the zstandard package, and falls back to gzip without it)
+EXCHANGE_LOG_COMPRESSION = os.getenv("EXCHANGE_LOG_COMPRESSION", "gzip").strip().lower()
+# "always" syncs after every batch, "rotate" only when a file is rotated, "never" leaves it to the OS
+EXCHANGE_LOG_FSYNC = os.getenv("EXCHANGE_LOG_FSYNC", "rotate").strip().lower()
+
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _compressor(compression: str) -> str:
+    if compression == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ zstandard is not installed, compressing rotated exchange logs with gzip")
+            return "gzip"
+    return compression if compression in COMPRESSED_SUFFIXES else "none"
+
+
+def _compress(path: Path, compression: str) -> Path:
+    """Compress a rotated file alongside itself and remove the original"""
+    if compression == "none":
+        return path
+    target = path.with_name(path.name + COMPRESSED_SUFFIXES[compression])
+    with open(path, "rb") as source:
+        if compression == "zstd":
+            import zstandard
+            with open(target, "wb") as f:
+                zstandard.ZstdCompressor().copy_stream(source, f)
+        else:
+            with gzip.open(target, "wb") as f:
+                while chunk := source.read(1024 * 1024):
+                    f.write(chunk)
+    path.unlink()
+    return target
+
+
+class ExchangeLogWriter:
+    """Queues records and appends them to a JSONL file from a background thread, rotating as it goes"""
+
+    def __init__(self, path: str, batch_size: int = EXCHANGE_LOG_BATCH, interval: float = EXCHANGE_LOG_FLUSH_SECONDS,
+                 capacity: int = EXCHANGE_LOG_BUFFER_SIZE, max_bytes: int = EXCHANGE_LOG_MAX_BYTES,
+                 max_age_hours: float = EXCHANGE_LOG_MAX_AGE_HOURS, compression: str = EXCHANGE_LOG_COMPRESSION,
+                 fsync: str = EXCHANGE_LOG_FSYNC):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_hours * 3600
+        self.compression = _compressor(compression)
+        self.fsync = fsync
+        self.buffer = deque(maxlen=capacity)
+        self.dropped = 0
+        self.pending = 0
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.flushed = threading.Condition(self.condition)
+        self.file = None
+        self.opened_at = 0.0
+        self.thread = threading.Thread(target=self._run, name="exchange-log", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Queue a record; it must not be changed afterwards, as it is serialised on the writer thread"""
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(record)
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    def _open(self):
+        if self.file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, "a", encoding="utf-8")
+            # A file left from an earlier run keeps its age, so it still rotates on time
+            self.opened_at = self.path.stat().st_mtime if self.file.tell() else time.time()
+        return self.file
+
+    def _should_rotate(self) -> bool:
+        if self.file is None or not self.file.tell():
+            return False
+        too_big = self.max_bytes and self.file.tell() >= self.max_bytes
+        too_old = self.max_age_seconds and time.time() - self.opened_at >= self.max_age_seconds
+        return bool(too_big or too_old)
+
+    def _rotate(self) -> None:
+        self.file.flush()
+        if self.fsync != "never":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}")
+        os.replace(self.path, rotated)
+        rotated = _compress(rotated, self.compression)
+        logger.info(f"🗜️ Rotated exchange log to {rotated}")
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        f = self._open()
+        f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch))
+        f.flush()
+        if self.fsync == "always":
+            os.fsync(f.fileno())
+        if self._should_rotate():
+            self._rotate()
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                if not self.stopping and len(self.buffer) < self.batch_size:
+                    self.condition.wait(self.interval)
+                batch = list(self.buffer)
+                self.buffer.clear()
+                self.pending = len(batch)
+                stopping = self.stopping
+            try:
+                if batch:
+                    self._write_batch(batch)
+                elif self._should_rotate():
+                    self._rotate()
+            except Exception as e:
+                logger.error(f"❌ Unable to write {len(batch)} exchange records: {e}")
+            with self.condition:
+                self.pending = 0
+                self.flushed.notify_all()
+                if stopping and not self.buffer:
+                    if self.file is not None:
+                        self.file.close()
+                        self.file = None
+                    return
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """Block until everything written so far is in the file"""
+        with self.condition:
+            self.condition.notify()
+            self.flushed.wait_for(lambda: not self.buffer and not self.pending, timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+
+def log_files(path: str) -> List[Path]:
+    """The rotated files for a log, oldest first, followed by the current file"""
+    path = Path(path)
+    rotated = sorted(glob.glob(str(path.with_name(f"{glob.escape(path.stem)}.*{path.suffix}*"))))
+    files = [Path(f) for f in rotated if Path(f) != path]
+    return files + ([path] if path.exists() else [])
+
+
+def _open_log(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.suffix == ".zst":
+        import io
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Every record in the log and its rotations, in the order written; unreadable lines are skipped"""
+    for file in log_files(path):
+        with _open_log(file) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def read_exchanges(path: str = "message_exchanges.json") -> List[Dict[str, Any]]:
+    """Merge the start and completion records into one row per exchange, in the order the exchanges started"""
+    exchanges: Dict[str, Dict[str, Any]] = {}
+    for record in read_records(path):
+        exchange_id = record.get("exchange_id")
+        if not exchange_id:
+            continue
+        row = exchanges.setdefault(exchange_id, {})
+        metadata = {**row.get("metadata", {}), **record.get("metadata", {})}
+        row.update(record)
+        row["metadata"] = metadata
+        row.pop("event", None)
+    return list(exchanges.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the message exchange log into one row per exchange")
+    parser.add_argument("path", nargs="?", default="message_exchanges.json", help="The current log file")
+    parser.add_argument("-o", "--output", help="Write the merged rows here as JSONL")
+    args = parser.parse_args()
+    rows = read_exchanges(args.path)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        print(f"📁 Wrote {len(rows)} exchanges to {args.output}")
+    else:
+        statuses = {}
+        for row in rows:
+            statuses[row.get("status")] = statuses.get(row.get("status"), 0) + 1
+        print(f"📊 {len(rows)} exchanges in {len(log_files(args.path))} files: {statuses}")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+SQLite store for message exchanges, one row per exchange, indexed for the questions the dashboards ask:
+who sent what to whom, in which conversation, and when.
+
+    python exchange_store.py                               # import message_exchanges.json and its rotations
+    python exchange_store.py message_exchanges.json --db message_exchanges.db
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, Iterable
+from dotenv import load_dotenv
+from exchange_log import read_exchanges
+
+load_dotenv(override=True)
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_DB = os.getenv("EXCHANGE_DB", "message_exchanges.db")
+
+COLUMNS = [
+    "exchange_id", "timestamp", "originator_id", "originator_name", "originator_type", "target_id", "target_name",
+    "target_type", "message_type", "content", "content_length", "response_time_ms", "response_length", "status",
+    "conversation_id", "parent_exchange_id",
+]
+
+
+def to_row(exchange: Dict[str, Any]) -> tuple:
+    """Flatten an exchange record, as logged by the tracker, into a row of COLUMNS"""
+    originator = exchange.get("originator") or {}
+    target = exchange.get("target") or {}
+    metadata = exchange.get("metadata") or {}
+    return (
+        exchange["exchange_id"], exchange.get("timestamp"),
+        originator.get("id"), originator.get("name"), originator.get("type"),
+        target.get("id"), target.get("name"), target.get("type"),
+        exchange.get("message_type"), exchange.get("content"), exchange.get("content_length"),
+        exchange.get("response_time_ms"), metadata.get("response_length"), exchange.get("status"),
+        exchange.get("conversation_id"), exchange.get("parent_exchange_id"),
+    )
+
+
+class ExchangeStore:
+    """Exchanges in SQLite; writing an exchange again replaces it, so partial and completed records can both be saved"""
+
+    def __init__(self, path: str = EXCHANGE_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS exchanges (
+                    exchange_id TEXT PRIMARY KEY,
+                    timestamp TEXT,
+                    originator_id TEXT,
+                    originator_name TEXT,
+                    originator_type TEXT,
+                    target_id TEXT,
+                    target_name TEXT,
+                    target_type TEXT,
+                    message_type TEXT,
+                    content TEXT,
+                    content_length INTEGER,
+                    response_time_ms REAL,
+                    response_length INTEGER,
+                    status TEXT,
+                    conversation_id TEXT,
+                    parent_exchange_id TEXT
+                )
+            ''')
+            # Each index also orders by time, so "this agent's exchanges yesterday" is a single range scan
+            for column in ("originator_id", "target_id", "conversation_id"):
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_exchanges_{column} ON exchanges ({column}, timestamp)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_exchanges_timestamp ON exchanges (timestamp)')
+
+    def write(self, exchanges: Iterable[Dict[str, Any]]) -> int:
+        """Save exchange records in one transaction; returns how many were written"""
+        rows = [to_row(exchange) for exchange in exchanges]
+        placeholders = ", ".join("?" * len(COLUMNS))
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO exchanges ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows
+            )
+        return len(rows)
+
+    def import_log(self, log_file: str = "message_exchanges.json") -> int:
+        """Load a tracker log, with its rotations, merging start and completion records"""
+        count = self.write(read_exchanges(log_file))
+        logger.info(f"📥 Imported {count} exchanges from {log_file} into {self.path}")
+        return count
+
+    def read_frame(self, start: str = None, end: str = None, columns: Iterable[str] = None):
+        """The exchanges between two ISO timestamps (inclusive start, exclusive end) as a pandas DataFrame"""
+        import pandas as pd
+        conditions, params = [], []
+        if start:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        selected = ", ".join(columns or [c for c in COLUMNS if c != "content"])
+        return pd.read_sql_query(f"SELECT {selected} FROM exchanges {where} ORDER BY timestamp", self.conn, params=params)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import the message exchange log into SQLite")
+    parser.add_argument("log_file", nargs="?", default="message_exchanges.json", help="The tracker's log file")
+    parser.add_argument("--db", default=EXCHANGE_DB, help="The SQLite database to import into")
+    args = parser.parse_args()
+    store = ExchangeStore(args.db)
+    print(f"📥 Imported {store.import_log(args.log_file)} exchanges into {args.db}")
+    store.close()
@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+logger = logging.getLogger(__name__)
+
+# How many LLM calls may be in flight at once across all agents, and how long one may take
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+_semaphore = None
+
+
+def set_max_concurrency(limit: int) -> None:
+    """Change how many LLM calls may be in flight at once in this process; call it before any call is made"""
+    global LLM_MAX_CONCURRENCY, _executor, _semaphore
+    LLM_MAX_CONCURRENCY = limit
+    _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix="llm")
+    _semaphore = None
+
+
+def _release(loop: asyncio.AbstractEventLoop, semaphore: asyncio.Semaphore, _future):
+    """Hand a slot back from the LLM thread once its call is over, even if nobody is still waiting for it"""
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        pass  # The loop has closed, and the semaphore with it
+
+
+async def generate_reply(delegate, messages: list[dict], timeout: float | None = None):
+    """
+    Run an AssistantAgent's blocking generate_reply on the LLM thread pool, so the event loop keeps
+    running other agents' handlers while this one waits for the model.
+
+    At most LLM_MAX_CONCURRENCY calls run at once. A slot is held until its thread finishes, even after a timeout,
+    so calls queue here rather than in the thread pool, and the timeout only starts once the call has a slot.
+    Raises TimeoutError if the reply takes longer than timeout seconds (LLM_TIMEOUT_SECONDS by default);
+    the abandoned request still finishes in its thread, but its reply is discarded.
+    """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    timeout = timeout or LLM_TIMEOUT_SECONDS
+    loop = asyncio.get_running_loop()
+    await _semaphore.acquire()
+    try:
+        future = _executor.submit(delegate.generate_reply, messages)
+    except BaseException:
+        _semaphore.release()
+        raise
+    future.add_done_callback(functools.partial(_release, loop, _semaphore))
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"⏱️ {delegate.name} did not reply within {timeout:g} seconds")
+        raise TimeoutError(f"{delegate.name} did not reply within {timeout:g} seconds")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Analytics over the exchange store: response-time percentiles, who talks to whom, and how deep conversations go.
+Everything is computed column-wise with pandas and NumPy over one DataFrame, so a day of world runs takes seconds.
+
+    python exchange_store.py                      # import the tracker's log first
+    python message_analytics.py
+    python message_analytics.py --since 2025-09-15 --until 2025-09-16
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from exchange_store import ExchangeStore, EXCHANGE_DB
+
+PERCENTILES = [50, 95, 99]
+
+
+def load_exchanges(path: str = EXCHANGE_DB, start: str = None, end: str = None) -> pd.DataFrame:
+    store = ExchangeStore(path)
+    try:
+        return store.read_frame(start, end)
+    finally:
+        store.close()
+
+
+def response_time_percentiles(exchanges: pd.DataFrame, by: str = "originator_id") -> pd.DataFrame:
+    """p50/p95/p99, mean and count of response time per group, over the exchanges that completed"""
+    completed = exchanges[exchanges["response_time_ms"] > 0]
+    columns = [f"p{p}" for p in PERCENTILES] + ["mean", "count"]
+    if completed.empty:
+        return pd.DataFrame(columns=columns)
+    grouped = completed.groupby(by)["response_time_ms"]
+    result = grouped.quantile([p / 100 for p in PERCENTILES]).unstack()
+    result.columns = columns[:len(PERCENTILES)]
+    result["mean"] = grouped.mean()
+    result["count"] = grouped.size()
+    return result.sort_values("p95", ascending=False)
+
+
+def overall_percentiles(exchanges: pd.DataFrame) -> dict:
+    times = exchanges.loc[exchanges["response_time_ms"] > 0, "response_time_ms"].to_numpy()
+    if not len(times):
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    return dict(zip((f"p{p}" for p in PERCENTILES), np.percentile(times, PERCENTILES)))
+
+
+def message_graph(exchanges: pd.DataFrame) -> pd.DataFrame:
+    """The edges of the agent graph: one row per (originator, target) pair, with message and failure counts"""
+    return (
+        exchanges.assign(failed=exchanges["status"].eq("failed"))
+        .groupby(["originator_id", "target_id"])
+        .agg(messages=("exchange_id", "size"), failed=("failed", "sum"), mean_response_ms=("response_time_ms", "mean"))
+        .sort_values("messages", ascending=False)
+    )
+
+
+def fan_in_out(exchanges: pd.DataFrame) -> pd.DataFrame:
+    """Per agent: how many distinct agents it sent to (fan-out) and heard from (fan-in), and its message counts"""
+    edges = exchanges[["originator_id", "target_id"]].drop_duplicates()
+    result = pd.DataFrame({
+        "fan_out": edges.groupby("originator_id").size(),
+        "fan_in": edges.groupby("target_id").size(),
+        "sent": exchanges["originator_id"].value_counts(),
+        "received": exchanges["target_id"].value_counts(),
+    })
+    return result.fillna(0).astype(int).sort_values(["fan_in", "fan_out"], ascending=False)
+
+
+def exchange_depths(exchanges: pd.DataFrame) -> np.ndarray:
+    """
+    How many exchanges each exchange is nested inside, following parent_exchange_id.
+    Every exchange steps to its parent at the same time, so this takes one pass per level of nesting.
+    """
+    parent = pd.Index(exchanges["exchange_id"]).get_indexer(exchanges["parent_exchange_id"].fillna(""))
+    depth = np.zeros(len(parent), dtype=np.int64)
+    ancestor = parent.copy()
+    for _ in range(len(parent)):
+        active = ancestor >= 0
+        if not active.any():
+            break
+        depth[active] += 1
+        ancestor[active] = parent[ancestor[active]]
+    return depth
+
+
+def conversation_depth(exchanges: pd.DataFrame) -> pd.DataFrame:
+    """Per conversation: exchanges, deepest nesting, distinct agents taking part, and duration in seconds"""
+    frame = exchanges.assign(depth=exchange_depths(exchanges) + 1, time=pd.to_datetime(exchanges["timestamp"]))
+    grouped = frame.groupby("conversation_id")
+    participants = pd.concat([
+        frame[["conversation_id", "originator_id"]].rename(columns={"originator_id": "agent"}),
+        frame[["conversation_id", "target_id"]].rename(columns={"target_id": "agent"}),
+    ]).groupby("conversation_id")["agent"].nunique()
+    return pd.DataFrame({
+        "exchanges": grouped.size(),
+        "depth": grouped["depth"].max(),
+        "agents": participants,
+        "seconds": (grouped["time"].max() - grouped["time"].min()).dt.total_seconds(),
+    }).sort_values(["depth", "exchanges"], ascending=False)
+
+
+def report(exchanges: pd.DataFrame, top: int = 10) -> str:
+    lines = [f"📊 {len(exchanges)} exchanges, {exchanges['conversation_id'].nunique()} conversations"]
+    if exchanges.empty:
+        return lines[0]
+    overall = overall_percentiles(exchanges)
+    lines.append("⏱️ Response time " + "  ".join(f"{k} {v:.1f}ms" for k, v in overall.items()))
+    lines += ["", "🤖 RESPONSE TIME BY ORIGINATOR (ms)", response_time_percentiles(exchanges).head(top).round(1).to_string()]
+    lines += ["", "🕸️ FAN-IN / FAN-OUT", fan_in_out(exchanges).head(top).to_string()]
+    lines += ["", "🔗 BUSIEST LINKS", message_graph(exchanges).head(top).round(1).to_string()]
+    depths = conversation_depth(exchanges)
+    lines += ["", "💬 CONVERSATION DEPTH", depths["depth"].value_counts().sort_index().rename("conversations").to_string()]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse message exchanges from the exchange store")
+    parser.add_argument("--db", default=EXCHANGE_DB, help="The SQLite exchange store")
+    parser.add_argument("--since", help="Only exchanges at or after this ISO time")
+    parser.add_argument("--until", help="Only exchanges before this ISO time")
+    parser.add_argument("--top", type=int, default=10, help="Rows to show per table")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    frame = load_exchanges(args.db, args.since, args.until)
+    print(report(frame, args.top))
+    print(f"\n⚡ Analysed in {time.perf_counter() - start:.2f}s")
@@ -103,16 +103,16 @@ class MessageDashboard:
         print("📨 RECENT MESSAGE EXCHANGES")
         print("=" * 80)
         
-        recent_exchanges = sorted(message_tracker.exchanges, key=lambda x: x.timestamp, reverse=True)
+        recent_exchanges = message_tracker.recent_exchanges(10)
         
         if not recent_exchanges:
             print("❌ No message exchanges found")
             return
         
-        print(f"📊 Total Exchanges: {len(recent_exchanges)}")
+        print(f"📊 Total Exchanges: {message_tracker.message_stats['total_exchanges']}")
         print(f"🔍 Showing last 10 exchanges:\n")
         
-        for i, exchange in enumerate(recent_exchanges[:10], 1):
+        for i, exchange in enumerate(recent_exchanges, 1):
             status_emoji = "✅" if exchange.status == "processed" else "⏳" if exchange.status == "sent" else "❌"
             print(f"{i:2d}. {status_emoji} {exchange.originator.name} → {exchange.target.name}")
             print(f"    🏷️ {exchange.message_type} | {exchange.content_length} chars | {exchange.response_time_ms:.2f}ms")
@@ -199,6 +199,10 @@ class MessageDashboard:
             viz_file = message_visualizer.export_visualization_data()
             print(f"✅ Visualization data exported to: {viz_file}")
             
+            # Save to the queryable store, for message_analytics.py
+            store_file = message_tracker.export_message_store()
+            print(f"✅ Exchange store updated: {store_file}")
+            
             print(f"\n📊 Export Summary:")
             print(f"   📈 Total Exchanges: {message_tracker.message_stats['total_exchanges']}")
             print(f"   👥 Total Agents: {len(message_tracker.agents)}")
@@ -213,12 +217,12 @@ class MessageDashboard:
         print("🎨 MESSAGE FLOW VISUALIZATION")
         print("=" * 80)
         
-        if not message_tracker.exchanges:
+        if not message_tracker.recent_exchanges(1):
             print("❌ No message exchanges to visualize")
             return
         
         # Show recent exchanges with full visualization
-        recent_exchanges = sorted(message_tracker.exchanges, key=lambda x: x.timestamp, reverse=True)[:5]
+        recent_exchanges = message_tracker.recent_exchanges(5)
         
         print("🎬 RECENT MESSAGE FLOWS:")
         print("-" * 40)
@@ -5,16 +5,30 @@ Provides detailed visibility into message exchanges with originator and target a
 """
 
 import json
+import os
 import time
 import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from dataclasses import dataclass, asdict
-from typing import Dict, List, Optional, Any
+from typing import Deque, Dict, Iterator, List, Optional, Any
 import logging
+from itertools import islice
 from pathlib import Path
+from exchange_log import ExchangeLogWriter
 
 logger = logging.getLogger(__name__)
 
+# How many exchanges are kept in memory before the oldest are spilled to disk
+MAX_EXCHANGES_IN_MEMORY = int(os.getenv("MAX_EXCHANGES_IN_MEMORY", "10000"))
+# Where exchanges are logged; each worker of the distributed runtime is given a file of its own
+MESSAGE_EXCHANGE_LOG = os.getenv("MESSAGE_EXCHANGE_LOG", "message_exchanges.json")
+
+# The exchange whose handler is running in this task, so that the messages it sends are recorded as replies to it
+_current_exchange: ContextVar[Optional[str]] = ContextVar("current_exchange", default=None)
+
 @dataclass
 class AgentInfo:
     """Detailed information about an agent"""
@@ -52,28 +66,83 @@ class MessageExchange:
         if self.metadata is None:
             self.metadata = {}
 
+@dataclass
+class AgentStats:
+    """Running per-agent aggregates, updated as each exchange starts and completes"""
+    sent: int = 0
+    received: int = 0
+    response_time_total: float = 0.0
+    responses: int = 0
+    conversations: int = 0
+
+    @property
+    def average_response_time(self) -> float:
+        return self.response_time_total / self.responses if self.responses else 0.0
+
 class MessageTracker:
-    """Advanced message tracking and visualization system"""
+    """Advanced message tracking and visualization system
+
+    Exchanges are indexed by id, and statistics are kept as running counters, so tracking one exchange
+    costs the same however many came before it. Only the most recent max_exchanges are kept in memory;
+    older ones are appended to a spill file and dropped, along with any conversation they closed out.
+    An exchange spilled while still in flight is held aside until it completes, so its statistics still count,
+    and the agents taking part in the max_exchanges most recently active conversations are remembered
+    after a spill, so a conversation that carries on does not count them again.
+    """
     
-    def __init__(self, log_file: str = "message_exchanges.json"):
-        self.log_file = Path(log_file)
-        self.exchanges: List[MessageExchange] = []
+    # Weight of the latest response in the moving average of response time
+    RESPONSE_TIME_EWMA_ALPHA = 0.1
+    
+    def __init__(self, log_file: str = MESSAGE_EXCHANGE_LOG, max_exchanges: int = MAX_EXCHANGES_IN_MEMORY,
+                 spill_file: str = None):
+        self._open_logs(log_file, spill_file)
+        self.max_exchanges = max_exchanges
+        self._exchanges: "OrderedDict[str, MessageExchange]" = OrderedDict()  # exchange_id -> exchange, oldest first
         self.agents: Dict[str, AgentInfo] = {}
-        self.conversations: Dict[str, List[str]] = {}  # conversation_id -> exchange_ids
+        self.agent_stats: Dict[str, AgentStats] = {}
+        self.conversations: Dict[str, Deque[str]] = {}  # conversation_id -> exchange_ids, oldest first
+        # conversation_id -> ids of the agents taking part, least recently active first
+        self._conversation_agents: "OrderedDict[str, set]" = OrderedDict()
+        self._spilled_in_flight: Dict[str, MessageExchange] = {}  # spilled exchanges that have not completed yet
+        self._response_time_total = 0.0
+        self._responses = 0
+        self._most_active_count = 0
         self.message_stats = {
             "total_exchanges": 0,
             "successful_exchanges": 0,
             "failed_exchanges": 0,
             "average_response_time": 0.0,
+            "recent_response_time": 0.0,
             "most_active_agent": "",
-            "longest_conversation": 0
+            "longest_conversation": 0,
+            "spilled_exchanges": 0
         }
         
-        # Create log directory if it doesn't exist
-        self.log_file.parent.mkdir(parents=True, exist_ok=True)
-        
         logger.info("🔍 Message Tracker initialized")
     
+    def _open_logs(self, log_file: str, spill_file: str = None):
+        self.log_file = Path(log_file)
+        self.spill_file = Path(spill_file) if spill_file else self.log_file.with_name(self.log_file.stem + "_spill.jsonl")
+        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+        self._log_writer = ExchangeLogWriter(self.log_file)
+        self._spill_writer = ExchangeLogWriter(self.spill_file)
+    
+    def set_log_file(self, log_file: str, spill_file: str = None):
+        """Log to another file from now on, as each worker of the distributed runtime does; call it before tracking"""
+        self.flush()
+        self._log_writer.close()
+        self._spill_writer.close()
+        self._open_logs(log_file, spill_file)
+    
+    @property
+    def exchanges(self) -> List[MessageExchange]:
+        """The exchanges still held in memory, oldest first"""
+        return list(self._exchanges.values())
+    
+    def recent_exchanges(self, limit: int = 10) -> List[MessageExchange]:
+        """The most recently started exchanges, newest first"""
+        return list(islice(reversed(self._exchanges.values()), limit))
+    
     def register_agent(self, agent_id: str, name: str, agent_type: str) -> AgentInfo:
         """Register a new agent in the tracking system"""
         agent_info = AgentInfo(
@@ -83,15 +152,18 @@ class MessageTracker:
             status="active"
         )
         self.agents[agent_id] = agent_info
+        self.agent_stats.setdefault(agent_id, AgentStats())
         logger.info(f"📝 Registered agent: {name} ({agent_id})")
         return agent_info
     
     def start_message_exchange(self, originator_id: str, target_id: str, 
                              message_type: str, content: str, 
                              conversation_id: str = None) -> str:
-        """Start tracking a new message exchange"""
+        """Start tracking a new message exchange; one started while handling another joins its conversation"""
+        parent_exchange_id = _current_exchange.get()
+        parent = self._find_exchange(parent_exchange_id) if parent_exchange_id else None
         if conversation_id is None:
-            conversation_id = str(uuid.uuid4())
+            conversation_id = parent.conversation_id if parent else str(uuid.uuid4())
         
         exchange_id = str(uuid.uuid4())
         
@@ -110,6 +182,11 @@ class MessageTracker:
         # Update agent last seen
         originator.last_seen = datetime.now().isoformat()
         originator.message_count += 1
+        if originator.message_count > self._most_active_count:
+            self._most_active_count = originator.message_count
+            self.message_stats["most_active_agent"] = originator.name
+        self.agent_stats.setdefault(originator_id, AgentStats()).sent += 1
+        self.agent_stats.setdefault(target_id, AgentStats()).received += 1
         
         exchange = MessageExchange(
             exchange_id=exchange_id,
@@ -122,30 +199,55 @@ class MessageTracker:
             response_time_ms=0.0,
             status="sent",
             conversation_id=conversation_id,
+            parent_exchange_id=parent_exchange_id if parent else None,
             metadata={
                 "start_time": time.time(),
                 "content_preview": content[:100] + "..." if len(content) > 100 else content
             }
         )
         
-        self.exchanges.append(exchange)
+        self._exchanges[exchange_id] = exchange
+        self.message_stats["total_exchanges"] += 1
         
         # Track conversation
         if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = []
+            self.conversations[conversation_id] = deque()
         self.conversations[conversation_id].append(exchange_id)
+        self.message_stats["longest_conversation"] = max(
+            self.message_stats["longest_conversation"], len(self.conversations[conversation_id]))
+        participants = self._conversation_agents.setdefault(conversation_id, set())
+        self._conversation_agents.move_to_end(conversation_id)
+        while len(self._conversation_agents) > self.max_exchanges:
+            self._conversation_agents.popitem(last=False)
+        for agent_id in (originator_id, target_id):
+            if agent_id not in participants:
+                participants.add(agent_id)
+                self.agent_stats[agent_id].conversations += 1
         
         # Log the exchange
-        self._log_exchange(exchange)
+        self._log_exchange(exchange, "start")
         
         logger.info(f"📤 Message exchange started: {originator.name} → {target.name} [{exchange_id[:8]}]")
         
+        while len(self._exchanges) > self.max_exchanges:
+            self._spill_oldest()
+        
         return exchange_id
     
+    @contextmanager
+    def handling(self, exchange_id: str) -> Iterator[str]:
+        """Record the exchanges started inside this block, such as those sent by its handler, as replies to this one"""
+        token = _current_exchange.set(exchange_id)
+        try:
+            yield exchange_id
+        finally:
+            _current_exchange.reset(token)
+    
     def complete_message_exchange(self, exchange_id: str, status: str = "processed", 
                                 response_content: str = None):
         """Mark a message exchange as completed"""
         exchange = self._find_exchange(exchange_id)
+        self._spilled_in_flight.pop(exchange_id, None)
         if not exchange:
             logger.warning(f"⚠️ Exchange not found: {exchange_id}")
             return
@@ -154,6 +256,7 @@ class MessageTracker:
         start_time = exchange.metadata.get("start_time", time.time())
         response_time = (time.time() - start_time) * 1000  # Convert to milliseconds
         
+        previous_status, previous_response_time = exchange.status, exchange.response_time_ms
         exchange.response_time_ms = response_time
         exchange.status = status
         
@@ -162,10 +265,10 @@ class MessageTracker:
             exchange.metadata["response_length"] = len(response_content)
         
         # Update statistics
-        self._update_statistics()
+        self._update_statistics(exchange, previous_status, previous_response_time)
         
         # Log completion
-        self._log_exchange(exchange)
+        self._log_exchange(exchange, "complete")
         
         logger.info(f"📥 Message exchange completed: {exchange.originator.name} → {exchange.target.name} "
                    f"[{exchange_id[:8]}] - {status} ({response_time:.2f}ms)")
@@ -174,15 +277,13 @@ class MessageTracker:
         """Get detailed activity summary for all agents"""
         summary = {}
         for agent_id, agent in self.agents.items():
-            agent_exchanges = [e for e in self.exchanges 
-                             if e.originator.id == agent_id or e.target.id == agent_id]
-            
+            stats = self.agent_stats.get(agent_id) or AgentStats()
             summary[agent_id] = {
                 "agent_info": asdict(agent),
-                "total_messages_sent": len([e for e in agent_exchanges if e.originator.id == agent_id]),
-                "total_messages_received": len([e for e in agent_exchanges if e.target.id == agent_id]),
-                "average_response_time": self._calculate_agent_avg_response_time(agent_id),
-                "conversation_count": len(set(e.conversation_id for e in agent_exchanges)),
+                "total_messages_sent": stats.sent,
+                "total_messages_received": stats.received,
+                "average_response_time": stats.average_response_time,
+                "conversation_count": stats.conversations,
                 "last_activity": agent.last_seen
             }
         
@@ -240,8 +341,7 @@ class MessageTracker:
         # Recent exchanges
         dashboard.append("📨 RECENT MESSAGE EXCHANGES")
         dashboard.append("-" * 40)
-        recent_exchanges = sorted(self.exchanges, key=lambda x: x.timestamp, reverse=True)[:10]
-        for exchange in recent_exchanges:
+        for exchange in self.recent_exchanges(10):
             status_emoji = "✅" if exchange.status == "processed" else "⏳" if exchange.status == "sent" else "❌"
             dashboard.append(f"{status_emoji} {exchange.originator.name} → {exchange.target.name}")
             dashboard.append(f"   📝 {exchange.message_type} | {exchange.content_length} chars | {exchange.response_time_ms:.2f}ms")
@@ -260,7 +360,7 @@ class MessageTracker:
             "statistics": self.message_stats,
             "agents": {aid: asdict(agent) for aid, agent in self.agents.items()},
             "exchanges": [asdict(exchange) for exchange in self.exchanges],
-            "conversations": self.conversations
+            "conversations": {cid: list(exchange_ids) for cid, exchange_ids in self.conversations.items()}
         }
         
         with open(filename, 'w', encoding='utf-8') as f:
@@ -269,64 +369,96 @@ class MessageTracker:
         logger.info(f"📁 Message log exported to: {filename}")
         return filename
     
+    def export_message_store(self, path: str = None) -> str:
+        """Save every logged exchange, including those spilled from memory, to the SQLite exchange store"""
+        from exchange_store import ExchangeStore, EXCHANGE_DB
+        path = path or EXCHANGE_DB
+        self.flush()
+        store = ExchangeStore(path)
+        try:
+            store.import_log(str(self.log_file))
+        finally:
+            store.close()
+        logger.info(f"📁 Message exchanges saved to: {path}")
+        return path
+    
     def _find_exchange(self, exchange_id: str) -> Optional[MessageExchange]:
-        """Find an exchange by ID"""
-        for exchange in self.exchanges:
-            if exchange.exchange_id == exchange_id:
-                return exchange
-        return None
+        """Find an exchange by ID, among those still in memory or spilled while in flight"""
+        return self._exchanges.get(exchange_id) or self._spilled_in_flight.get(exchange_id)
     
     def _calculate_agent_avg_response_time(self, agent_id: str) -> float:
         """Calculate average response time for an agent"""
-        agent_exchanges = [e for e in self.exchanges 
-                          if e.originator.id == agent_id and e.response_time_ms > 0]
-        if not agent_exchanges:
-            return 0.0
-        return sum(e.response_time_ms for e in agent_exchanges) / len(agent_exchanges)
+        stats = self.agent_stats.get(agent_id)
+        return stats.average_response_time if stats else 0.0
     
-    def _update_statistics(self):
-        """Update message statistics"""
-        self.message_stats["total_exchanges"] = len(self.exchanges)
-        self.message_stats["successful_exchanges"] = len([e for e in self.exchanges if e.status == "processed"])
-        self.message_stats["failed_exchanges"] = len([e for e in self.exchanges if e.status == "failed"])
-        
-        # Calculate average response time
-        completed_exchanges = [e for e in self.exchanges if e.response_time_ms > 0]
-        if completed_exchanges:
-            self.message_stats["average_response_time"] = sum(e.response_time_ms for e in completed_exchanges) / len(completed_exchanges)
-        
-        # Find most active agent
-        agent_activity = {}
-        for exchange in self.exchanges:
-            originator_id = exchange.originator.id
-            agent_activity[originator_id] = agent_activity.get(originator_id, 0) + 1
-        
-        if agent_activity:
-            most_active_id = max(agent_activity, key=agent_activity.get)
-            self.message_stats["most_active_agent"] = self.agents[most_active_id].name
-        
-        # Find longest conversation
-        if self.conversations:
-            self.message_stats["longest_conversation"] = max(len(exchanges) for exchanges in self.conversations.values())
+    def _update_statistics(self, exchange: MessageExchange, previous_status: str, previous_response_time: float):
+        """Update message statistics for one completed exchange"""
+        for state, key in (("processed", "successful_exchanges"), ("failed", "failed_exchanges")):
+            if previous_status == state:
+                self.message_stats[key] -= 1
+            if exchange.status == state:
+                self.message_stats[key] += 1
+        
+        # An exchange completed twice counts once, with its latest response time
+        stats = self.agent_stats[exchange.originator.id]
+        if previous_response_time > 0:
+            self._response_time_total -= previous_response_time
+            self._responses -= 1
+            stats.response_time_total -= previous_response_time
+            stats.responses -= 1
+        if exchange.response_time_ms > 0:
+            self._response_time_total += exchange.response_time_ms
+            self._responses += 1
+            stats.response_time_total += exchange.response_time_ms
+            stats.responses += 1
+            recent = self.message_stats["recent_response_time"] or exchange.response_time_ms
+            alpha = self.RESPONSE_TIME_EWMA_ALPHA
+            self.message_stats["recent_response_time"] = alpha * exchange.response_time_ms + (1 - alpha) * recent
+        if self._responses:
+            self.message_stats["average_response_time"] = self._response_time_total / self._responses
+    
+    def _spill_oldest(self):
+        """Move the oldest exchange out of memory and onto the end of the spill file"""
+        exchange_id, exchange = self._exchanges.popitem(last=False)
+        self._spill_writer.write(self._exchange_record(exchange))
+        self.message_stats["spilled_exchanges"] += 1
+        if exchange.status == "sent":
+            self._spilled_in_flight[exchange_id] = exchange
+        
+        # Exchanges are spilled in the order they started, so this is the oldest of its conversation;
+        # forget the conversation once none of its exchanges are left in memory
+        exchange_ids = self.conversations.get(exchange.conversation_id)
+        if exchange_ids is not None:
+            if exchange_ids and exchange_ids[0] == exchange_id:
+                exchange_ids.popleft()
+            if not exchange_ids:
+                del self.conversations[exchange.conversation_id]
     
-    def _log_exchange(self, exchange: MessageExchange):
-        """Log exchange to file"""
-        log_entry = {
+    def flush(self):
+        """Block until every exchange logged or spilled so far has been written"""
+        self._log_writer.flush()
+        self._spill_writer.flush()
+    
+    def _exchange_record(self, exchange: MessageExchange) -> Dict[str, Any]:
+        """A snapshot of the exchange for the log; AgentInfo is flat, so a copy of its fields is enough"""
+        return {
             "timestamp": exchange.timestamp,
             "exchange_id": exchange.exchange_id,
-            "originator": asdict(exchange.originator),
-            "target": asdict(exchange.target),
+            "originator": dict(vars(exchange.originator)),
+            "target": dict(vars(exchange.target)),
             "message_type": exchange.message_type,
             "content": exchange.content,
             "content_length": exchange.content_length,
             "response_time_ms": exchange.response_time_ms,
             "status": exchange.status,
             "conversation_id": exchange.conversation_id,
-            "metadata": exchange.metadata
+            "parent_exchange_id": exchange.parent_exchange_id,
+            "metadata": dict(exchange.metadata)
         }
-        
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+    
+    def _log_exchange(self, exchange: MessageExchange, event: str):
+        """Queue the exchange for the background log writer; exchange_log.read_exchanges merges the records"""
+        self._log_writer.write({"event": event, **self._exchange_record(exchange)})
 
 # Global message tracker instance
 message_tracker = MessageTracker()
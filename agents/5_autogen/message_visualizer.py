@@ -144,7 +144,7 @@ class MessageVisualizer:
                 # Display recent exchanges with visual effects
                 print("\n🎬 LIVE MESSAGE FLOW:")
                 print("-" * 40)
-                recent_exchanges = sorted(message_tracker.exchanges, key=lambda x: x.timestamp, reverse=True)[:5]
+                recent_exchanges = message_tracker.recent_exchanges(5)
                 for exchange in recent_exchanges:
                     status_emoji = "✅" if exchange.status == "processed" else "⏳" if exchange.status == "sent" else "❌"
                     print(f"{status_emoji} {exchange.originator.name} → {exchange.target.name} "
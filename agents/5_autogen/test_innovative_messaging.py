@@ -89,7 +89,7 @@ async def test_innovative_messaging():
     
     # Display recent message flows
     print("\n🎬 RECENT MESSAGE FLOWS")
-    recent_exchanges = sorted(message_tracker.exchanges, key=lambda x: x.timestamp, reverse=True)[:3]
+    recent_exchanges = message_tracker.recent_exchanges(3)
     for i, exchange in enumerate(recent_exchanges, 1):
         print(f"\n📨 MESSAGE FLOW #{i}:")
         message_visualizer.display_message_flow(exchange, show_content=True)
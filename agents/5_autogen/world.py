@@ -13,6 +13,8 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 HOW_MANY_AGENTS = 20
+# "distributed" spreads the agents over worker processes (see distributed_runtime.py); "local" keeps them in this process
+WORLD_RUNTIME = os.getenv("WORLD_RUNTIME", "distributed").strip().lower()
 
 class GrpcWorkerAgentRuntimeHost:
     """Simulated GRPC Worker Agent Runtime Host for demonstration"""
@@ -159,11 +161,31 @@ async def create_and_message(worker, creator_id, i: int):
     except Exception as e:
         logger.error(f"❌ Failed to create agent {i} due to exception: {e}")
 
+async def main_distributed():
+    """Create the agents across worker processes, one Creator per agent so that placement spreads them out"""
+    from distributed_runtime import DistributedRuntimeHost
+    
+    host = DistributedRuntimeHost()
+    await host.start()
+    try:
+        await host.register("Creator", "creator", "Creator", "Creator")
+        logger.info(f"🚀 Starting creation of {HOW_MANY_AGENTS} agents on {len(host.workers)} workers...")
+        coroutines = [create_and_message(host, messages.AgentId("Creator", str(i)), i) for i in range(1, HOW_MANY_AGENTS+1)]
+        await asyncio.gather(*coroutines)
+        logger.info("✅ All agents created successfully!")
+    finally:
+        await host.stop()
+        logger.info("🧹 Cleanup completed")
+
 async def main():
     """Main function to orchestrate agent creation"""
     logger.info("🌍 Starting World - Multi-Agent Creation System")
     logger.info(f"🎯 Target: Create {HOW_MANY_AGENTS} agents")
     
+    if WORLD_RUNTIME == "distributed":
+        await main_distributed()
+        return
+    
     # Create and start the distributed runtime host
     host = GrpcWorkerAgentRuntimeHost(address="localhost:50051")
     host.start() 
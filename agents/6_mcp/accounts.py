@@ -1,14 +1,127 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, PrivateAttr
+from contextlib import contextmanager
 import json
+import math
+import os
 from dotenv import load_dotenv
 from datetime import datetime
-from market import get_share_price
-from database import write_account, read_account, write_log
+from typing import Callable
+from market import get_share_price, get_share_prices
+import storage
+from database import (
+    write_account,
+    read_account,
+    write_log,
+    write_account_state,
+    read_account_state,
+    write_position,
+    write_positions,
+    read_positions,
+    read_names_without_cost_basis,
+    write_transaction,
+    read_transactions,
+    write_portfolio_value,
+    read_portfolio_series,
+    PORTFOLIO_MAX_POINTS,
+    delete_account_history,
+    read_trade_request,
+    write_trade_request,
+    migrate_json_accounts,
+)
 
 load_dotenv(override=True)
 
 INITIAL_BALANCE = 10_000.0
 SPREAD = 0.002
+# How many of the most recent transactions report() includes; the full history is available from list_transactions()
+REPORT_TRANSACTIONS = int(os.getenv("REPORT_TRANSACTIONS", "20"))
+
+# Where the time for transaction and portfolio value timestamps comes from; the backtester swaps in a simulated clock
+clock: Callable[[], datetime] = datetime.now
+
+# "normalized" keeps balance, holdings, transactions and portfolio values in their own tables and appends to them;
+# "json" is the original layout with the whole account serialized into a single row
+ACCOUNTS_STORAGE = os.getenv("ACCOUNTS_STORAGE", "normalized").strip().lower()
+NORMALIZED = ACCOUNTS_STORAGE != "json"
+
+
+
+class Position(BaseModel):
+    """
+    A running position in one symbol, using average cost: buys add to the cost basis,
+    and sells take out the average cost of the shares sold and realize the difference from the sale price.
+    """
+    quantity: int = 0
+    cost_basis: float = 0.0
+    realized_pnl: float = 0.0
+
+    def average_cost(self) -> float:
+        return self.cost_basis / self.quantity if self.quantity else 0.0
+
+    def apply(self, quantity: int, price: float):
+        """ Update the position for a trade of quantity shares (negative for a sell) at price """
+        if quantity > 0:
+            self.cost_basis += quantity * price
+        else:
+            sold_cost = self.average_cost() * -quantity
+            self.realized_pnl += -quantity * price - sold_cost
+            self.cost_basis -= sold_cost
+        self.quantity += quantity
+        if self.quantity == 0:
+            self.cost_basis = 0.0
+
+    def market_value(self, price: float) -> float:
+        return self.quantity * price
+
+    def unrealized_pnl(self, price: float) -> float:
+        return self.market_value(price) - self.cost_basis
+
+
+def positions_from_transactions(transactions: list) -> dict[str, Position]:
+    """ Replay a transaction history, oldest first, into positions """
+    positions = {}
+    for transaction in transactions:
+        if isinstance(transaction, dict):
+            transaction = Transaction(**transaction)
+        position = positions.setdefault(transaction.symbol, Position())
+        position.apply(transaction.quantity, transaction.price)
+    return positions
+
+
+def audit_positions(transactions: list) -> dict[str, Position]:
+    """
+    Recompute positions from the full transaction history with pandas and NumPy, for auditing the running totals.
+    Within each run of a symbol between times it is fully sold, the cost basis follows C[t] = f[t] * C[t-1] + b[t],
+    where a buy adds b = quantity * price and a sell scales by f = shares left / shares before.
+    That recurrence is solved without a loop as C = F * cumsum(b / F), with F the running product of f.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if not transactions:
+        return {}
+    df = pd.DataFrame([t if isinstance(t, dict) else t.model_dump() for t in transactions])
+    by_symbol = df.groupby("symbol", sort=False)
+    df["held"] = by_symbol["quantity"].cumsum()
+    df["held_before"] = df["held"] - df["quantity"]
+    closed = df["held"] == 0
+    df["run"] = closed.groupby(df["symbol"]).cumsum() - closed
+    is_sell = df["quantity"] < 0
+    factor = np.where(is_sell & ~closed, df["held"] / df["held_before"].where(df["held_before"] != 0, 1), 1.0)
+    bought = np.where(is_sell, 0.0, df["quantity"] * df["price"])
+    runs = [df["symbol"], df["run"]]
+    scale = np.exp(pd.Series(np.log(factor), index=df.index).groupby(runs).cumsum())
+    cost = scale * pd.Series(bought / scale, index=df.index).groupby(runs).cumsum()
+    df["cost"] = cost.where(~closed, 0.0)
+    cost_before = df.groupby("symbol", sort=False)["cost"].shift(fill_value=0.0)
+    df["realized"] = np.where(is_sell, -df["quantity"] * df["price"] - (cost_before - df["cost"]), 0.0)
+    last = df.groupby("symbol", sort=False).agg(
+        quantity=("held", "last"), cost_basis=("cost", "last"), realized_pnl=("realized", "sum")
+    )
+    return {
+        symbol: Position(quantity=int(row.quantity), cost_basis=float(row.cost_basis), realized_pnl=float(row.realized_pnl))
+        for symbol, row in last.iterrows()
+    }
 
 
 class Transaction(BaseModel):
@@ -25,16 +138,28 @@ class Transaction(BaseModel):
         return f"{abs(self.quantity)} shares of {self.symbol} at {self.price} each."
 
 
+if NORMALIZED:
+    migrate_json_accounts()
+    # Rebuild the positions of accounts stored before cost basis was tracked
+    for name in read_names_without_cost_basis():
+        positions = positions_from_transactions(read_transactions(name))
+        write_positions(name, {symbol: position.model_dump() for symbol, position in positions.items()})
+
+
 class Account(BaseModel):
     name: str
     balance: float
     strategy: str
     holdings: dict[str, int]
-    transactions: list[Transaction]
-    portfolio_value_time_series: list[tuple[str, float]]
+    positions: dict[str, Position] = Field(default_factory=dict)
+    transactions: list[Transaction] = Field(default_factory=list)
+    portfolio_value_time_series: list[tuple[str, float]] = Field(default_factory=list)
+    _history_loaded: bool = PrivateAttr(default=True)
 
     @classmethod
     def get(cls, name: str):
+        if NORMALIZED:
+            return cls.get_normalized(name)
         fields = read_account(name.lower())
         if not fields:
             fields = {
@@ -46,97 +171,196 @@ class Account(BaseModel):
                 "portfolio_value_time_series": []
             }
             write_account(name, fields)
+        if "positions" not in fields:
+            # Accounts saved before positions were tracked
+            fields["positions"] = positions_from_transactions(fields["transactions"])
         return cls(**fields)
-    
-    
+
+    @classmethod
+    def get_normalized(cls, name: str):
+        """ Load balance, strategy and positions only; the history is read on demand by load_history() """
+        state = read_account_state(name)
+        if not state:
+            state = {"balance": INITIAL_BALANCE, "strategy": ""}
+            write_account_state(name, state["balance"], state["strategy"])
+        positions = {symbol: Position(**position) for symbol, position in read_positions(name).items()}
+        holdings = {symbol: position.quantity for symbol, position in positions.items() if position.quantity}
+        account = cls(name=name.lower(), holdings=holdings, positions=positions, **state)
+        account._history_loaded = False
+        return account
+
+    def refresh(self):
+        """ Re-read the account from the database, discarding what is in memory """
+        latest = type(self).get(self.name)
+        for field in type(self).model_fields:
+            setattr(self, field, getattr(latest, field))
+        self._history_loaded = latest._history_loaded
+
+    @contextmanager
+    def atomic(self):
+        """
+        Change the account while holding the database write lock. The account is re-read once the lock is held,
+        so a change made meanwhile by another process (another MCP server, say) is built on rather than overwritten.
+        """
+        with storage.transaction(immediate=True):
+            self.refresh()
+            yield
+
+    def load_history(self):
+        """ Read the transactions and portfolio value time series if they have not been loaded yet """
+        if not self._history_loaded:
+            self.transactions = [Transaction(**t) for t in read_transactions(self.name)]
+            self.portfolio_value_time_series = read_portfolio_series(self.name)
+            self._history_loaded = True
+
     def save(self):
-        write_account(self.name.lower(), self.model_dump())
+        if NORMALIZED:
+            with storage.transaction():
+                write_account_state(self.name, self.balance, self.strategy)
+                write_positions(self.name, {symbol: p.model_dump() for symbol, p in self.positions.items()})
+        else:
+            write_account(self.name.lower(), self.model_dump())
+
+    def save_state(self):
+        """ Persist a change to the balance or strategy """
+        if NORMALIZED:
+            write_account_state(self.name, self.balance, self.strategy)
+        else:
+            self.save()
+
+    def save_trade(self, transaction: Transaction):
+        """ Apply a buy or sell to its position and persist the new balance, the position and the transaction """
+        position = self.positions.setdefault(transaction.symbol, Position())
+        position.apply(transaction.quantity, transaction.price)
+        if self._history_loaded:
+            self.transactions.append(transaction)
+        if NORMALIZED:
+            with storage.transaction():
+                write_account_state(self.name, self.balance, self.strategy)
+                write_position(self.name, transaction.symbol, position.model_dump())
+                write_transaction(self.name, transaction.model_dump())
+        else:
+            self.save()
 
     def reset(self, strategy: str):
         self.balance = INITIAL_BALANCE
         self.strategy = strategy
         self.holdings = {}
+        self.positions = {}
         self.transactions = []
         self.portfolio_value_time_series = []
-        self.save()
+        self._history_loaded = True
+        if NORMALIZED:
+            with storage.transaction():
+                delete_account_history(self.name)
+                self.save()
+        else:
+            self.save()
 
     def deposit(self, amount: float):
         """ Deposit funds into the account. """
         if amount <= 0:
             raise ValueError("Deposit amount must be positive.")
-        self.balance += amount
+        with self.atomic():
+            self.balance += amount
+            self.save_state()
         print(f"Deposited ${amount}. New balance: ${self.balance}")
-        self.save()
 
     def withdraw(self, amount: float):
         """ Withdraw funds from the account, ensuring it doesn't go negative. """
-        if amount > self.balance:
-            raise ValueError("Insufficient funds for withdrawal.")
-        self.balance -= amount
+        with self.atomic():
+            if amount > self.balance:
+                raise ValueError("Insufficient funds for withdrawal.")
+            self.balance -= amount
+            self.save_state()
         print(f"Withdrew ${amount}. New balance: ${self.balance}")
-        self.save()
 
-    def buy_shares(self, symbol: str, quantity: int, rationale: str) -> str:
-        """ Buy shares of a stock if sufficient funds are available. """
+    def is_repeated_request(self, idempotency_key: str | None) -> bool:
+        """ True if a trade with this idempotency key has already been made for this account """
+        return bool(idempotency_key) and read_trade_request(self.name, idempotency_key) is not None
+
+    def buy_shares(self, symbol: str, quantity: int, rationale: str, idempotency_key: str | None = None) -> str:
+        """ Buy shares of a stock if sufficient funds are available. A repeated idempotency_key is not bought twice. """
+        # Look up the price before taking the write lock, as it may need a network call
         price = get_share_price(symbol)
         buy_price = price * (1 + SPREAD)
         total_cost = buy_price * quantity
-        
-        if total_cost > self.balance:
-            raise ValueError("Insufficient funds to buy shares.")
-        elif price==0:
+        if price==0:
             raise ValueError(f"Unrecognized symbol {symbol}")
-        
-        # Update holdings
-        self.holdings[symbol] = self.holdings.get(symbol, 0) + quantity
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Record transaction
-        transaction = Transaction(symbol=symbol, quantity=quantity, price=buy_price, timestamp=timestamp, rationale=rationale)
-        self.transactions.append(transaction)
-        
-        # Update balance
-        self.balance -= total_cost
-        self.save()
+
+        with self.atomic():
+            repeated = self.is_repeated_request(idempotency_key)
+            if not repeated:
+                if total_cost > self.balance:
+                    raise ValueError("Insufficient funds to buy shares.")
+                # Update holdings
+                self.holdings[symbol] = self.holdings.get(symbol, 0) + quantity
+                timestamp = clock().strftime("%Y-%m-%d %H:%M:%S")
+                # Record transaction
+                transaction = Transaction(symbol=symbol, quantity=quantity, price=buy_price, timestamp=timestamp, rationale=rationale)
+                # Update balance
+                self.balance -= total_cost
+                self.save_trade(transaction)
+                if idempotency_key:
+                    write_trade_request(self.name, idempotency_key, transaction.model_dump())
+        if repeated:
+            return "Already completed, so not repeated. Latest details:\n" + self.report()
         write_log(self.name, "account", f"Bought {quantity} of {symbol}")
         return "Completed. Latest details:\n" + self.report()
 
-    def sell_shares(self, symbol: str, quantity: int, rationale: str) -> str:
-        """ Sell shares of a stock if the user has enough shares. """
-        if self.holdings.get(symbol, 0) < quantity:
-            raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
-        
+    def sell_shares(self, symbol: str, quantity: int, rationale: str, idempotency_key: str | None = None) -> str:
+        """ Sell shares of a stock if the user has enough shares. A repeated idempotency_key is not sold twice. """
+        # Look up the price before taking the write lock, as it may need a network call
         price = get_share_price(symbol)
         sell_price = price * (1 - SPREAD)
         total_proceeds = sell_price * quantity
-        
-        # Update holdings
-        self.holdings[symbol] -= quantity
-        
-        # If shares are completely sold, remove from holdings
-        if self.holdings[symbol] == 0:
-            del self.holdings[symbol]
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Record transaction
-        transaction = Transaction(symbol=symbol, quantity=-quantity, price=sell_price, timestamp=timestamp, rationale=rationale)  # negative quantity for sell
-        self.transactions.append(transaction)
-
-        # Update balance
-        self.balance += total_proceeds
-        self.save()
+
+        with self.atomic():
+            repeated = self.is_repeated_request(idempotency_key)
+            if not repeated:
+                if self.holdings.get(symbol, 0) < quantity:
+                    raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
+                # Update holdings
+                self.holdings[symbol] -= quantity
+                # If shares are completely sold, remove from holdings
+                if self.holdings[symbol] == 0:
+                    del self.holdings[symbol]
+                timestamp = clock().strftime("%Y-%m-%d %H:%M:%S")
+                # Record transaction
+                transaction = Transaction(symbol=symbol, quantity=-quantity, price=sell_price, timestamp=timestamp, rationale=rationale)  # negative quantity for sell
+                # Update balance
+                self.balance += total_proceeds
+                self.save_trade(transaction)
+                if idempotency_key:
+                    write_trade_request(self.name, idempotency_key, transaction.model_dump())
+        if repeated:
+            return "Already completed, so not repeated. Latest details:\n" + self.report()
         write_log(self.name, "account", f"Sold {quantity} of {symbol}")
         return "Completed. Latest details:\n" + self.report()
 
-    def calculate_portfolio_value(self):
+    def get_prices(self) -> dict[str, float]:
+        return get_share_prices(list(self.holdings))
+
+    def calculate_portfolio_value(self, prices: dict[str, float] | None = None):
         """ Calculate the total value of the user's portfolio. """
+        prices = self.get_prices() if prices is None else prices
         total_value = self.balance
         for symbol, quantity in self.holdings.items():
-            total_value += get_share_price(symbol) * quantity
+            total_value += prices[symbol] * quantity
         return total_value
 
+    def total_cost_basis(self) -> float:
+        return sum(position.cost_basis for position in self.positions.values())
+
+    def realized_profit_loss(self) -> float:
+        return sum(position.realized_pnl for position in self.positions.values())
+
     def calculate_profit_loss(self, portfolio_value: float):
-        """ Calculate profit or loss from the initial spend. """
-        initial_spend = sum(transaction.total() for transaction in self.transactions)
-        return portfolio_value - initial_spend - self.balance
+        """
+        Calculate profit or loss from the initial spend: the unrealized P&L of the shares held plus the realized P&L
+        of shares sold. Uses the running positions, so it doesn't depend on the number of past transactions.
+        """
+        return portfolio_value - self.balance - self.total_cost_basis() + self.realized_profit_loss()
 
     def get_holdings(self):
         """ Report the current holdings of the user. """
@@ -144,21 +368,95 @@ class Account(BaseModel):
 
     def get_profit_loss(self):
         """ Report the user's profit or loss at any point in time. """
-        return self.calculate_profit_loss()
+        return self.calculate_profit_loss(self.calculate_portfolio_value())
 
     def list_transactions(self):
         """ List all transactions made by the user. """
+        self.load_history()
         return [transaction.model_dump() for transaction in self.transactions]
+
+    def recent_transactions(self, limit: int = REPORT_TRANSACTIONS) -> list[dict]:
+        """ List the most recent transactions, oldest first, without reading the whole history. """
+        if self._history_loaded:
+            return [transaction.model_dump() for transaction in self.transactions[-limit:]] if limit else []
+        return read_transactions(self.name, limit)
+
+    def get_positions(self, prices: dict[str, float] | None = None) -> dict[str, dict]:
+        """ Report each open position with its cost basis, market value and P&L. """
+        prices = self.get_prices() if prices is None else prices
+        report = {}
+        for symbol, position in self.positions.items():
+            if position.quantity == 0:
+                continue
+            price = prices.get(symbol, 0.0)
+            report[symbol] = {
+                "quantity": position.quantity,
+                "average_cost": position.average_cost(),
+                "price": price,
+                "market_value": position.market_value(price),
+                "unrealized_profit_loss": position.unrealized_pnl(price),
+                "realized_profit_loss": position.realized_pnl,
+            }
+        return report
+
+    def audit(self, tolerance: float = 1e-6) -> dict[str, tuple[Position, Position]]:
+        """
+        Recompute the positions from the full transaction history and compare them with the running positions.
+        Returns the symbols that disagree, as (running, recomputed) pairs; an empty dict means the books agree.
+        """
+        self.load_history()
+        audited = audit_positions(self.transactions)
+        mismatches = {}
+        for symbol in set(self.positions) | set(audited):
+            running = self.positions.get(symbol, Position())
+            recomputed = audited.get(symbol, Position())
+            if (
+                running.quantity != recomputed.quantity
+                or abs(running.cost_basis - recomputed.cost_basis) > tolerance * max(1.0, abs(recomputed.cost_basis))
+                or abs(running.realized_pnl - recomputed.realized_pnl) > tolerance * max(1.0, abs(recomputed.realized_pnl))
+            ):
+                mismatches[symbol] = (running, recomputed)
+        return mismatches
     
+    def get_portfolio_value_time_series(
+        self, start: str | None = None, end: str | None = None, max_points: int = PORTFOLIO_MAX_POINTS
+    ) -> list[tuple[str, float]]:
+        """ Return at most max_points (datetime, value) points of the portfolio value, optionally between start and end. """
+        if NORMALIZED:
+            return read_portfolio_series(self.name, start, end, max_points)
+        points = [
+            point for point in self.portfolio_value_time_series
+            if (start is None or point[0] >= start) and (end is None or point[0] <= end)
+        ]
+        if len(points) > max_points:
+            step = math.ceil(len(points) / max_points)
+            points = points[::-1][::step][::-1]
+        return points
+
+    def record_portfolio_value(self, portfolio_value: float):
+        """ Append a point to the portfolio value time series. """
+        point = (clock().strftime("%Y-%m-%d %H:%M:%S"), portfolio_value)
+        if NORMALIZED:
+            if self._history_loaded:
+                self.portfolio_value_time_series.append(point)
+            write_portfolio_value(self.name, *point)
+        else:
+            with self.atomic():
+                self.portfolio_value_time_series.append(point)
+                self.save()
+
     def report(self) -> str:
-        """ Return a json string representing the account.  """
-        portfolio_value = self.calculate_portfolio_value()
-        self.portfolio_value_time_series.append((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), portfolio_value))
-        self.save()
+        """ Return a json string representing the account, with its positions and most recent transactions.  """
+        prices = self.get_prices()
+        portfolio_value = self.calculate_portfolio_value(prices)
+        self.record_portfolio_value(portfolio_value)
         pnl = self.calculate_profit_loss(portfolio_value)
-        data = self.model_dump()
+        data = self.model_dump(include={"name", "balance", "strategy", "holdings"})
+        data["positions"] = self.get_positions(prices)
+        data["transactions"] = self.recent_transactions()
         data["total_portfolio_value"] = portfolio_value
         data["total_profit_loss"] = pnl
+        data["realized_profit_loss"] = self.realized_profit_loss()
         write_log(self.name, "account", f"Retrieved account details")
         return json.dumps(data)
     
@@ -169,8 +467,9 @@ class Account(BaseModel):
     
     def change_strategy(self, strategy: str) -> str:
         """ At your discretion, if you choose to, call this to change your investment strategy for the future """
-        self.strategy = strategy
-        self.save()
+        with self.atomic():
+            self.strategy = strategy
+            self.save_state()
         write_log(self.name, "account", f"Changed strategy")
         return "Changed strategy"
 
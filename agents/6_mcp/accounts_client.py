@@ -1,39 +1,122 @@
+import asyncio
 import mcp
 from mcp.client.stdio import stdio_client
 from mcp import StdioServerParameters
+from mcp.types import ListToolsResult
 from agents import FunctionTool
+from inprocess_mcp import InProcessMCPServer
+from mcp_params import MCP_TRANSPORT
 import json
 
 params = StdioServerParameters(command="uv", args=["run", "accounts_server.py"], env=None)
 
 
+class InProcessSession:
+    """accounts_server imported into this process, answering the calls this module makes of a ClientSession"""
+
+    def __init__(self):
+        self.server = InProcessMCPServer("accounts_server")
+
+    async def list_tools(self) -> ListToolsResult:
+        return ListToolsResult(tools=await self.server.list_tools())
+
+    async def call_tool(self, name, arguments):
+        return await self.server.call_tool(name, arguments)
+
+    async def read_resource(self, uri):
+        return await self.server.read_resource(uri)
+
+
+class AccountsClient:
+    """
+    A single long-lived session with accounts_server, shared by every caller on the same event loop,
+    so that reading a resource no longer spawns a server process each time.
+    With MCP_TRANSPORT=inprocess there is no server process at all: the server is imported and called directly.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.session = None
+        self.task = None
+        self.stop = None
+        self.starting = None
+
+    async def hold(self, ready: asyncio.Future):
+        try:
+            if MCP_TRANSPORT == "inprocess":
+                session = InProcessSession()
+                async with session.server:
+                    ready.set_result(session)
+                    await self.stop.wait()
+                return
+            async with stdio_client(params) as streams:
+                async with mcp.ClientSession(*streams) as session:
+                    await session.initialize()
+                    ready.set_result(session)
+                    await self.stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            self.session = None
+
+    async def get_session(self) -> mcp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # A new event loop (for example a fresh asyncio.run) can't use a session from the old one
+            self.loop, self.session, self.task, self.starting = loop, None, None, None
+        if self.session and not self.task.done():
+            return self.session
+        if self.starting is None or self.starting.done():
+            self.stop = asyncio.Event()
+            self.starting = loop.create_future()
+            self.task = asyncio.create_task(self.hold(self.starting), name="accounts-client")
+        try:
+            self.session = await asyncio.shield(self.starting)
+        finally:
+            if self.starting.done() and self.starting.exception():
+                self.starting = None
+        return self.session
+
+    async def close(self):
+        if self.task and self.loop is asyncio.get_running_loop():
+            self.stop.set()
+            await self.task
+        self.loop, self.session, self.task, self.starting = None, None, None, None
+
+
+accounts_client = AccountsClient()
+
+
+async def close_accounts_client():
+    await accounts_client.close()
+
+
 async def list_accounts_tools():
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            tools_result = await session.list_tools()
-            return tools_result.tools
-        
+    session = await accounts_client.get_session()
+    tools_result = await session.list_tools()
+    return tools_result.tools
+
 async def call_accounts_tool(tool_name, tool_args):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.call_tool(tool_name, tool_args)
-            return result
-            
+    session = await accounts_client.get_session()
+    result = await session.call_tool(tool_name, tool_args)
+    return result
+
 async def read_accounts_resource(name):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.read_resource(f"accounts://accounts_server/{name}")
-            return result.contents[0].text
-        
+    session = await accounts_client.get_session()
+    result = await session.read_resource(f"accounts://accounts_server/{name}")
+    return result.contents[0].text
+
 async def read_strategy_resource(name):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.read_resource(f"accounts://strategy/{name}")
-            return result.contents[0].text
+    session = await accounts_client.get_session()
+    result = await session.read_resource(f"accounts://strategy/{name}")
+    return result.contents[0].text
+
+async def read_context_resource(name) -> dict:
+    """The account and strategy together, as {"account": ..., "strategy": ...}, in a single round trip"""
+    session = await accounts_client.get_session()
+    result = await session.read_resource(f"accounts://context/{name}")
+    return json.loads(result.contents[0].text)
 
 async def get_accounts_tools_openai():
     openai_tools = []
@@ -44,7 +127,7 @@ async def get_accounts_tools_openai():
             description=tool.description,
             params_json_schema=schema,
             on_invoke_tool=lambda ctx, args, toolname=tool.name: call_accounts_tool(toolname, json.loads(args))
-                
+
         )
         openai_tools.append(openai_tool)
-    return openai_tools
\ No newline at end of file
+    return openai_tools
@@ -1,3 +1,4 @@
+import json
 from mcp.server.fastmcp import FastMCP
 from accounts import Account
 
@@ -22,7 +23,7 @@ async def get_holdings(name: str) -> dict[str, int]:
     return Account.get(name).holdings
 
 @mcp.tool()
-async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> float:
+async def buy_shares(name: str, symbol: str, quantity: int, rationale: str, idempotency_key: str = "") -> float:
     """Buy shares of a stock.
 
     Args:
@@ -30,12 +31,13 @@ async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> f
         symbol: The symbol of the stock
         quantity: The quantity of shares to buy
         rationale: The rationale for the purchase and fit with the account's strategy
+        idempotency_key: Optional unique id for this purchase; if a call is retried with the same key, it is only made once
     """
-    return Account.get(name).buy_shares(symbol, quantity, rationale)
+    return Account.get(name).buy_shares(symbol, quantity, rationale, idempotency_key or None)
 
 
 @mcp.tool()
-async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) -> float:
+async def sell_shares(name: str, symbol: str, quantity: int, rationale: str, idempotency_key: str = "") -> float:
     """Sell shares of a stock.
 
     Args:
@@ -43,8 +45,9 @@ async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) ->
         symbol: The symbol of the stock
         quantity: The quantity of shares to sell
         rationale: The rationale for the sale and fit with the account's strategy
+        idempotency_key: Optional unique id for this sale; if a call is retried with the same key, it is only made once
     """
-    return Account.get(name).sell_shares(symbol, quantity, rationale)
+    return Account.get(name).sell_shares(symbol, quantity, rationale, idempotency_key or None)
 
 @mcp.tool()
 async def change_strategy(name: str, strategy: str) -> str:
@@ -66,5 +69,11 @@ async def read_strategy_resource(name: str) -> str:
     account = Account.get(name.lower())
     return account.get_strategy()
 
+@mcp.resource("accounts://context/{name}")
+async def read_context_resource(name: str) -> str:
+    """The account report and the strategy in one read, for the start of a trading run"""
+    account = Account.get(name.lower())
+    return json.dumps({"account": json.loads(account.report()), "strategy": account.get_strategy()})
+
 if __name__ == "__main__":
     mcp.run(transport='stdio')
\ No newline at end of file
@@ -3,8 +3,15 @@ from util import css, js, Color
 import pandas as pd
 from trading_floor import names, lastnames, short_model_names
 import plotly.express as px
+import asyncio
+import threading
+from collections import deque
 from accounts import Account
-from database import read_log
+from database import read_log_page, read_log_since
+from event_bus import EventBus
+
+LOG_LINES = 13
+TRANSACTION_ROWS = 100
 
 mapper = {
     "trace": Color.WHITE,
@@ -22,10 +29,39 @@ class Trader:
         self.lastname = lastname
         self.model_name = model_name
         self.account = Account.get(name)
+        self.log_lines = deque(maxlen=LOG_LINES)
+        self.last_log_id = None
+        self.logs_html = ""
+        self.logs_lock = threading.Lock()
+        self.rendered_version = None
+        self.rendered = None
+        self.rendered_value_key = None
+        self.rendered_value = None
+        self.render_lock = threading.Lock()
 
     def reload(self):
         self.account = Account.get(self.name)
 
+    def render(self, version: int, price_epoch: int) -> tuple:
+        """
+        The value, chart and tables for this account version. Renders are cached and shared by every
+        browser tab, so an account is only reloaded and re-drawn once per change; the value header is
+        also re-priced once per price epoch.
+        """
+        with self.render_lock:
+            if self.rendered_version != version:
+                self.reload()
+                self.rendered = (
+                    self.get_portfolio_value_chart(),
+                    self.get_holdings_df(),
+                    self.get_transactions_df(),
+                )
+                self.rendered_version = version
+            if self.rendered_value_key != (version, price_epoch):
+                self.rendered_value = self.get_portfolio_value()
+                self.rendered_value_key = (version, price_epoch)
+            return (self.rendered_value, *self.rendered)
+
     def get_title(self) -> str:
         return f"<div style='text-align: center;font-size:34px;'>{self.name}<span style='color:#ccc;font-size:24px;'> ({self.model_name}) - {self.lastname}</span></div>"
 
@@ -33,7 +69,7 @@ class Trader:
         return self.account.get_strategy()
 
     def get_portfolio_value_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(self.account.portfolio_value_time_series, columns=["datetime", "value"])
+        df = pd.DataFrame(self.account.get_portfolio_value_time_series(), columns=["datetime", "value"])
         df["datetime"] = pd.to_datetime(df["datetime"])
         return df
 
@@ -65,8 +101,8 @@ class Trader:
         return df
 
     def get_transactions_df(self) -> pd.DataFrame:
-        """Convert transactions to DataFrame for display"""
-        transactions = self.account.list_transactions()
+        """Convert the most recent transactions to DataFrame for display"""
+        transactions = self.account.recent_transactions(TRANSACTION_ROWS)
         if not transactions:
             return pd.DataFrame(columns=["Timestamp", "Symbol", "Quantity", "Price", "Rationale"])
 
@@ -80,22 +116,35 @@ class Trader:
         emoji = "⬆" if pnl >= 0 else "⬇"
         return f"<div style='text-align: center;background-color:{color};'><span style='font-size:32px'>${portfolio_value:,.0f}</span><span style='font-size:24px'>&nbsp;&nbsp;&nbsp;{emoji}&nbsp;${pnl:,.0f}</span></div>"
 
-    def get_logs(self, previous=None) -> str:
-        logs = read_log(self.name, last_n=13)
-        response = ""
-        for log in logs:
-            timestamp, type, message = log
+    def fetch_new_logs(self) -> None:
+        """Append only the log rows written since the last fetch, and re-render if there were any"""
+        logs = []
+        if self.last_log_id is not None:
+            logs = read_log_since(self.name, self.last_log_id, limit=LOG_LINES)
+        if self.last_log_id is None or len(logs) == LOG_LINES:
+            # First load, or we are a whole screen behind: just take the latest page
+            logs = read_log_page(self.name, limit=LOG_LINES)
+            self.log_lines.clear()
+        if not logs and self.last_log_id is not None:
+            return
+        for id, timestamp, type, message in logs:
             color = mapper.get(type, Color.WHITE).value
-            response += f"<span style='color:{color}'>{timestamp} : [{type}] {message}</span><br/>"
-        response = f"<div style='height:250px; overflow-y:auto;'>{response}</div>"
-        if response != previous:
-            return response
-        return gr.update()
+            self.log_lines.append(f"<span style='color:{color}'>{timestamp} : [{type}] {message}</span><br/>")
+            self.last_log_id = id
+        if self.last_log_id is None:
+            self.last_log_id = 0
+        self.logs_html = f"<div style='height:250px; overflow-y:auto;'>{''.join(self.log_lines)}</div>"
+
+    def get_logs(self) -> str:
+        with self.logs_lock:
+            self.fetch_new_logs()
+            return self.logs_html
 
 
 class TraderView:
-    def __init__(self, trader: Trader):
+    def __init__(self, trader: Trader, bus: EventBus):
         self.trader = trader
+        self.bus = bus
         self.portfolio_value = None
         self.chart = None
         self.holdings_table = None
@@ -105,16 +154,13 @@ class TraderView:
         with gr.Column():
             gr.HTML(self.trader.get_title())
             with gr.Row():
-                self.portfolio_value = gr.HTML(self.trader.get_portfolio_value)
+                self.portfolio_value = gr.HTML()
             with gr.Row():
-                self.chart = gr.Plot(
-                    self.trader.get_portfolio_value_chart, container=True, show_label=False
-                )
+                self.chart = gr.Plot(container=True, show_label=False)
             with gr.Row(variant="panel"):
-                self.log = gr.HTML(self.trader.get_logs)
+                self.log = gr.HTML()
             with gr.Row():
                 self.holdings_table = gr.Dataframe(
-                    value=self.trader.get_holdings_df,
                     label="Holdings",
                     headers=["Symbol", "Quantity"],
                     row_count=(5, "dynamic"),
@@ -124,7 +170,6 @@ class TraderView:
                 )
             with gr.Row():
                 self.transactions_table = gr.Dataframe(
-                    value=self.trader.get_transactions_df,
                     label="Recent Transactions",
                     headers=["Timestamp", "Symbol", "Quantity", "Price", "Rationale"],
                     row_count=(5, "dynamic"),
@@ -133,36 +178,34 @@ class TraderView:
                     elem_classes=["dataframe-fix"],
                 )
 
-        timer = gr.Timer(value=120)
-        timer.tick(
-            fn=self.refresh,
-            inputs=[],
-            outputs=[
-                self.portfolio_value,
-                self.chart,
-                self.holdings_table,
-                self.transactions_table,
-            ],
-            show_progress="hidden",
-            queue=False,
-        )
-        log_timer = gr.Timer(value=0.5)
-        log_timer.tick(
-            fn=self.trader.get_logs,
-            inputs=[self.log],
-            outputs=[self.log],
-            show_progress="hidden",
-            queue=False,
-        )
-
-    def refresh(self):
-        self.trader.reload()
-        return (
-            self.trader.get_portfolio_value(),
-            self.trader.get_portfolio_value_chart(),
-            self.trader.get_holdings_df(),
-            self.trader.get_transactions_df(),
-        )
+    def outputs(self) -> list:
+        return [self.portfolio_value, self.chart, self.holdings_table, self.transactions_table, self.log]
+
+    async def stream(self):
+        """
+        Push updates to one browser tab: everything on load, then only the parts that changed.
+        The account parts come from the shared render cache, and only the value header when just the prices
+        have moved on; the logs only when new rows have arrived.
+        """
+        sent_version = sent_log_id = sent_epoch = None
+        async for _ in self.bus.changes():
+            version, log_id = self.bus.get(self.trader.name)
+            epoch = self.bus.price_epoch
+            if version == sent_version and log_id == sent_log_id and epoch == sent_epoch:
+                continue
+            account_updates = [gr.update()] * 4
+            if version != sent_version or epoch != sent_epoch:
+                rendered = await asyncio.to_thread(self.trader.render, version, epoch)
+                if version != sent_version:
+                    account_updates = list(rendered)
+                else:
+                    account_updates[0] = rendered[0]
+                sent_version, sent_epoch = version, epoch
+            logs_update = gr.update()
+            if log_id != sent_log_id:
+                logs_update = await asyncio.to_thread(self.trader.get_logs)
+                sent_log_id = log_id
+            yield *account_updates, logs_update
 
 
 # Main UI construction
@@ -173,7 +216,8 @@ def create_ui():
         Trader(trader_name, lastname, model_name)
         for trader_name, lastname, model_name in zip(names, lastnames, short_model_names)
     ]
-    trader_views = [TraderView(trader) for trader in traders]
+    bus = EventBus(names)
+    trader_views = [TraderView(trader, bus) for trader in traders]
 
     with gr.Blocks(
         title="Traders", css=css, js=js, theme=gr.themes.Default(primary_hue="sky"), fill_width=True
@@ -181,6 +225,13 @@ def create_ui():
         with gr.Row():
             for trader_view in trader_views:
                 trader_view.make_ui()
+        for trader_view in trader_views:
+            ui.load(
+                trader_view.stream,
+                outputs=trader_view.outputs(),
+                show_progress="hidden",
+                concurrency_limit=None,
+            )
 
     return ui
 
@@ -0,0 +1,313 @@
+"""
+Offline backtest of the trading floor: replays historical prices from a CSV or Parquet file,
+and advances a simulated clock bar by bar as fast as the CPU allows. Each bar is one tick of the
+trading floor's TraderScheduler, running the real traders.Trader with its instructions and tools,
+but with a deterministic stand-in for the LLM. No Polygon or model API calls are made.
+
+What differs from a live trading floor: the trader's own MCP servers (accounts and market) run
+in-process, and the push and researcher servers are left out, since they reach the network;
+the stand-in model never calls them anyway.
+
+    uv run backtest.py prices.csv
+    uv run backtest.py --synthetic 50 --bars 500
+
+The price file needs a date (or timestamp) column, a symbol (or ticker) column and a close column;
+open, high and low are optional. Run from the command line, results go to their own database, BACKTEST_DB,
+never to accounts.db; the traders' accounts in it are reset at the start of each run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+import zlib
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+import pandas as pd
+from agents import set_tracing_disabled
+from agents.items import ModelResponse
+from agents.models.interface import Model
+from agents.usage import Usage
+from openai.types.responses import (
+    Response, ResponseCompletedEvent, ResponseFunctionToolCall, ResponseOutputMessage, ResponseOutputText,
+)
+
+BACKTEST_DB = os.getenv("BACKTEST_DB", "backtest.db")
+
+names = ["Warren", "George", "Ray", "Cathie"]
+lastnames = ["Patience", "Bold", "Systematic", "Crypto"]
+
+
+class ReplayPrices:
+    """Historical closes, one bar at a time; stands in for Polygon through market.price_provider"""
+
+    def __init__(self, history: pd.DataFrame):
+        history = history.rename(columns={"ticker": "symbol", "timestamp": "date"})
+        history["date"] = pd.to_datetime(history["date"])
+        history = history.sort_values(["date", "symbol"])
+        self.times = [when.to_pydatetime() for when in history["date"].unique()]
+        self.bars = [dict(zip(bar["symbol"], bar["close"].astype(float))) for _, bar in history.groupby("date", sort=True)]
+        self.symbols = sorted(history["symbol"].unique())
+        self.index = 0
+
+    @classmethod
+    def from_file(cls, path: str) -> "ReplayPrices":
+        if path.endswith(".parquet"):
+            return cls(pd.read_parquet(path))
+        return cls(pd.read_csv(path))
+
+    def __len__(self) -> int:
+        return len(self.bars)
+
+    def now(self) -> datetime:
+        """The simulated clock: the time of the current bar"""
+        return self.times[self.index]
+
+    def current(self) -> dict[str, float]:
+        return self.bars[self.index]
+
+    def previous(self) -> dict[str, float]:
+        return self.bars[max(self.index - 1, 0)]
+
+    def get_prices(self, symbols: list[str]) -> dict[str, float]:
+        bar = self.current()
+        return {symbol: bar[symbol] for symbol in symbols if symbol in bar}
+
+    def advance(self) -> bool:
+        if self.index + 1 >= len(self.bars):
+            return False
+        self.index += 1
+        return True
+
+
+def synthetic_history(symbols: int, bars: int, seed: int = 42) -> pd.DataFrame:
+    """Random-walk daily closes, for benchmarking without a price file"""
+    rng = random.Random(seed)
+    dates = pd.bdate_range("2024-01-02", periods=bars)
+    rows = []
+    for i in range(symbols):
+        symbol = f"SYM{i:03d}"
+        price = rng.uniform(10, 500)
+        for date in dates:
+            price = max(1.0, price * (1 + rng.gauss(0.0003, 0.02)))
+            rows.append((date, symbol, round(price, 2)))
+    return pd.DataFrame(rows, columns=["date", "symbol", "close"])
+
+
+def tool_call(name: str, arguments: dict, call_id: str) -> ResponseFunctionToolCall:
+    return ResponseFunctionToolCall(
+        id=call_id, call_id=call_id, name=name, arguments=json.dumps(arguments), type="function_call", status="completed"
+    )
+
+
+def message(text: str) -> ResponseOutputMessage:
+    return ResponseOutputMessage(
+        id="msg",
+        content=[ResponseOutputText(text=text, type="output_text", annotations=[])],
+        role="assistant",
+        status="completed",
+        type="message",
+    )
+
+
+class MomentumModel(Model):
+    """
+    A deterministic stand-in for the trader's LLM. On its first turn it calls the trading tools:
+    it sells holdings that fell by more than its threshold since the last bar and buys the strongest risers.
+    Once the tool results come back it ends the turn. Each trader gets its own threshold and position size,
+    derived from its name, so traders differ but every run of the same backtest is identical.
+    """
+
+    def __init__(self, name: str, prices: ReplayPrices):
+        self.name = name
+        self.prices = prices
+        rng = random.Random(zlib.crc32(name.encode()))
+        self.threshold = rng.uniform(0.0, 0.02)
+        self.picks = rng.randint(1, 3)
+        self.fraction = rng.uniform(0.1, 0.3)
+
+    def decide(self) -> list[tuple[str, dict]]:
+        from accounts import Account, SPREAD
+        account = Account.get(self.name)
+        current, previous = self.prices.current(), self.prices.previous()
+        change = {
+            symbol: current[symbol] / previous[symbol] - 1
+            for symbol in current
+            if previous.get(symbol) and current[symbol] > 0
+        }
+        calls = []
+        for symbol, quantity in sorted(account.holdings.items()):
+            if change.get(symbol, 0.0) < -self.threshold:
+                rationale = f"{symbol} fell {change[symbol]:.1%}"
+                calls.append(("sell_shares", {"symbol": symbol, "quantity": quantity, "rationale": rationale}))
+        risers = sorted((c, symbol) for symbol, c in change.items() if c > self.threshold)[-self.picks:]
+        budget = account.balance * self.fraction / max(len(risers), 1)
+        for c, symbol in reversed(risers):
+            quantity = int(budget / (current[symbol] * (1 + SPREAD)))
+            if quantity > 0:
+                rationale = f"{symbol} rose {c:.1%}"
+                calls.append(("buy_shares", {"symbol": symbol, "quantity": quantity, "rationale": rationale}))
+        return calls
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *, previous_response_id=None, prompt=None) -> ModelResponse:
+        if isinstance(input, list) and any(item.get("type") == "function_call_output" for item in input):
+            return ModelResponse(output=[message("Trades complete")], usage=Usage(), response_id=None)
+        calls = self.decide()
+        output = [
+            tool_call(tool, {"name": self.name, **arguments}, f"call_{self.prices.index}_{i}")
+            for i, (tool, arguments) in enumerate(calls)
+        ]
+        return ModelResponse(output=output or [message("No trades")], usage=Usage(), response_id=None)
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *, previous_response_id=None, prompt=None):
+        """The whole turn at once, as the single completed event that Runner.run_streamed builds its result from"""
+        result = await self.get_response(
+            system_instructions, input, model_settings, tools, output_schema, handoffs, tracing,
+            previous_response_id=previous_response_id, prompt=prompt,
+        )
+        response = Response(
+            id=f"backtest_{self.prices.index}", created_at=time.time(), model="backtest", object="response",
+            output=result.output, tool_choice="auto", tools=[], parallel_tool_calls=True,
+        )
+        yield ResponseCompletedEvent(response=response, sequence_number=0, type="response.completed")
+
+
+class Metrics:
+    def __init__(self):
+        self.run_seconds = []
+        self.wal_pages = 0
+        self.logical_bytes = 0
+
+    @staticmethod
+    def percentile(values: list[float], p: float) -> float:
+        if len(values) < 2:
+            return values[0] if values else 0.0
+        return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+    def summary(self, seconds: float, bars: int, trades: int, page_size: int) -> dict:
+        written = self.wal_pages * page_size
+        return {
+            "bars": bars,
+            "trades": trades,
+            "seconds": round(seconds, 3),
+            "bars_per_second": round(bars / seconds, 1) if seconds else 0.0,
+            "trades_per_second": round(trades / seconds, 1) if seconds else 0.0,
+            "db_bytes_written": written,
+            "db_pages_per_trade": round(self.wal_pages / trades, 2) if trades else 0.0,
+            # Every WAL byte (transactions, accounts, logs, rollups and snapshots) over the bytes of the trades alone
+            "wal_bytes_per_trade_byte": round(written / self.logical_bytes, 1) if self.logical_bytes else 0.0,
+            "trader_run_ms_p50": round(self.percentile(self.run_seconds, 50) * 1000, 3),
+            "trader_run_ms_p95": round(self.percentile(self.run_seconds, 95) * 1000, 3),
+        }
+
+
+def count_transactions(trader_names: list[str]) -> tuple[int, int]:
+    """The number of transactions the traders made, and the bytes of the data they hold"""
+    import storage
+    placeholders = ", ".join("?" * len(trader_names))
+    row = storage.execute(f'''
+        SELECT COUNT(*), TOTAL(LENGTH(name) + LENGTH(symbol) + LENGTH(timestamp) + LENGTH(rationale) + 16)
+        FROM transactions WHERE name IN ({placeholders})
+    ''', [name.lower() for name in trader_names]).fetchone()
+    return row[0], int(row[1])
+
+
+def checkpoint_pages() -> int:
+    """
+    Fold the WAL into the database and return how many pages had been written to it since the last call;
+    once the WAL has been fully checkpointed, the next write starts it again from the beginning
+    """
+    import storage
+    busy, log_pages, checkpointed = storage.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    return max(log_pages, 0)
+
+
+async def backtest(prices: ReplayPrices, traders: int, bars: int | None = None) -> dict:
+    """
+    Run the traders over the prices, one scheduler tick per bar, in whatever database storage points at;
+    main() points it at BACKTEST_DB before anything imports storage
+    """
+    import accounts
+    import accounts_client
+    import market
+    import storage
+    import traders as trading
+    from accounts import Account
+    from mcp_pool import MCPServerPool
+    from reset import reset_traders
+    from scheduler import TraderScheduler
+
+    set_tracing_disabled(True)
+    market.price_provider = prices.get_prices
+    accounts.clock = prices.now
+    accounts_client.MCP_TRANSPORT = "inprocess"
+    trading.trader_mcp_server_params = [{"module": "accounts_server"}, {"module": "market_server"}]
+    trading.researcher_mcp_server_params = lambda name: []
+    trader_names = (names + [f"Bot{i}" for i in range(len(names), traders)])[:traders]
+    models = {f"backtest/{name}": MomentumModel(name, prices) for name in trader_names}
+    trading.get_model = models.__getitem__
+
+    reset_traders()
+    for name in trader_names[len(names):]:
+        Account.get(name).reset("")
+    floor = [
+        trading.Trader(name, (lastnames + ["Bot"] * traders)[i], f"backtest/{name}")
+        for i, name in enumerate(trader_names)
+    ]
+    metrics = Metrics()
+    bars = min(bars or len(prices), len(prices))
+    async with MCPServerPool() as pool:
+
+        async def run_trader(trader):
+            start = time.perf_counter()
+            await trader.run(pool)
+            metrics.run_seconds.append(time.perf_counter() - start)
+
+        scheduler = TraderScheduler(
+            floor, run_trader=run_trader, interval_seconds=0, max_parallel=len(floor), timeout_seconds=60
+        )
+        checkpoint_pages()
+        start = time.perf_counter()
+        for _ in range(bars):
+            await scheduler.tick()
+            await asyncio.gather(*scheduler.running.values())
+            metrics.wal_pages += checkpoint_pages()
+            if not prices.advance():
+                break
+        seconds = time.perf_counter() - start
+    trades, metrics.logical_bytes = count_transactions(trader_names)
+    page_size = storage.execute("PRAGMA page_size").fetchone()[0]
+    return metrics.summary(seconds, bars, trades, page_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay historical prices through the trading floor")
+    parser.add_argument("prices", nargs="?", help="CSV or Parquet file of historical prices")
+    parser.add_argument("--synthetic", type=int, metavar="SYMBOLS", help="Use a random walk over this many symbols")
+    parser.add_argument("--bars", type=int, help="Stop after this many bars")
+    parser.add_argument("--traders", type=int, default=len(names), help="Number of traders")
+    args = parser.parse_args()
+    if args.prices:
+        replay = ReplayPrices.from_file(args.prices)
+    elif args.synthetic:
+        replay = ReplayPrices(synthetic_history(args.synthetic, args.bars or 250))
+    else:
+        parser.error("Give a price file or --synthetic")
+    # Set before storage is first imported, so the backtest never writes to accounts.db
+    os.environ["ACCOUNTS_DB"] = BACKTEST_DB
+    # traders builds its API clients when imported; the stand-in model never uses them
+    os.environ.setdefault("OPENAI_API_KEY", "backtest")
+    import storage
+    if storage.DB != BACKTEST_DB or os.path.abspath(BACKTEST_DB) == os.path.abspath("accounts.db"):
+        raise SystemExit(f"ACCOUNTS_DB is set to {storage.DB} in .env; the backtest only writes to {BACKTEST_DB}")
+    print(json.dumps(asyncio.run(backtest(replay, args.traders, args.bars)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
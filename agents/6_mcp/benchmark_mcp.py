@@ -0,0 +1,82 @@
+"""
+Compare the stdio and in-process transports for the project's own MCP servers:
+the time to start each server and list its tools, and the latency of individual tool calls.
+
+    uv run benchmark_mcp.py
+    uv run benchmark_mcp.py --calls 500
+
+Stdio servers are started with this Python interpreter rather than `uv run`, so the numbers measure
+the transport and not uv's environment check. The market server falls back to random prices when there
+is no POLYGON_API_KEY, so with no key set no external calls are made. The "benchmark" account is created
+in a temporary database, never in accounts.db.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = tempfile.mkdtemp(prefix="benchmark_mcp-")
+BENCHMARK_DB = os.path.join(BENCHMARK_DIR, "accounts.db")
+os.environ["ACCOUNTS_DB"] = BENCHMARK_DB
+
+import storage
+from inprocess_mcp import make_mcp_server
+
+calls_to_time = [
+    ("market_server", "lookup_share_price", {"symbol": "AAPL"}),
+    ("accounts_server", "get_balance", {"name": "benchmark"}),
+    ("accounts_server", "get_holdings", {"name": "benchmark"}),
+]
+
+
+def params_for(module: str, transport: str) -> dict:
+    if transport == "inprocess":
+        return {"module": module}
+    return {"command": sys.executable, "args": [f"{module}.py"], "env": {**os.environ, "FASTMCP_LOG_LEVEL": "WARNING"}}
+
+
+def summarize(seconds: list[float]) -> str:
+    ms = sorted(s * 1000 for s in seconds)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f"mean {statistics.mean(ms):8.3f} ms   p50 {statistics.median(ms):8.3f} ms   p95 {p95:8.3f} ms"
+
+
+async def benchmark(transport: str, calls: int) -> None:
+    print(f"\n{transport}")
+    for module in dict.fromkeys(module for module, _, _ in calls_to_time):
+        start = time.perf_counter()
+        async with make_mcp_server(params_for(module, transport)) as server:
+            await server.list_tools()
+            print(f"  {module:<42} start + list_tools {(time.perf_counter() - start) * 1000:10.1f} ms")
+            for call_module, tool, arguments in calls_to_time:
+                if call_module != module:
+                    continue
+                await server.call_tool(tool, arguments)
+                seconds = []
+                for _ in range(calls):
+                    start = time.perf_counter()
+                    await server.call_tool(tool, arguments)
+                    seconds.append(time.perf_counter() - start)
+                print(f"  {module + '.' + tool:<42} {summarize(seconds)}")
+
+
+async def main(calls: int) -> None:
+    for transport in ("stdio", "inprocess"):
+        await benchmark(transport, calls)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MCP transports")
+    parser.add_argument("--calls", type=int, default=200, help="Tool calls to time per tool")
+    args = parser.parse_args()
+    if storage.DB != BENCHMARK_DB:
+        raise SystemExit(f"ACCOUNTS_DB is set to {storage.DB} in .env; the benchmark only writes to a temporary database")
+    try:
+        asyncio.run(main(args.calls))
+    finally:
+        shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
@@ -1,17 +1,31 @@
-import sqlite3
 import json
-from datetime import datetime
+import math
+import os
+from datetime import datetime as dt, timedelta
 from dotenv import load_dotenv
+from storage import execute, executemany, transaction
 
 load_dotenv(override=True)
 
-DB = "accounts.db"
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "7"))
+LOG_ARCHIVE = os.getenv("LOG_ARCHIVE", "true").strip().lower() == "true"
+LOG_PRUNE_BATCH = 5000
 
+# Portfolio values are kept raw for a day, then as minute, hour and day OHLC rollups; None means kept forever
+PORTFOLIO_TIERS = [
+    ("raw", timedelta(hours=float(os.getenv("PORTFOLIO_RAW_RETENTION_HOURS", "24")))),
+    ("minute", timedelta(days=float(os.getenv("PORTFOLIO_MINUTE_RETENTION_DAYS", "7")))),
+    ("hour", timedelta(days=float(os.getenv("PORTFOLIO_HOUR_RETENTION_DAYS", "90")))),
+    ("day", None),
+]
+# How many characters of a 'YYYY-MM-DD HH:MM:SS' timestamp identify its bucket at each resolution
+ROLLUP_PREFIX = {"minute": 16, "hour": 13, "day": 10}
+PORTFOLIO_MAX_POINTS = int(os.getenv("PORTFOLIO_MAX_POINTS", "500"))
 
-with sqlite3.connect(DB) as conn:
-    cursor = conn.cursor()
-    cursor.execute('CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, account TEXT)')
-    cursor.execute('''
+
+with transaction() as conn:
+    conn.execute('CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, account TEXT)')
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
@@ -20,82 +34,699 @@ with sqlite3.connect(DB) as conn:
             message TEXT
         )
     ''')
-    cursor.execute('CREATE TABLE IF NOT EXISTS market (date TEXT PRIMARY KEY, data TEXT)')
-    conn.commit()
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_name_id ON logs (name, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS logs_archive (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            datetime DATETIME,
+            type TEXT,
+            message TEXT
+        )
+    ''')
+    # End of day closes, one row per trading date and ticker, so a lookup reads only the rows it needs;
+    # market_snapshots records which trading date the snapshot fetched on each day holds
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_prices (
+            date TEXT NOT NULL,
+            ticker TEXT NOT NULL,
+            close REAL NOT NULL,
+            PRIMARY KEY (date, ticker)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_market_prices_ticker ON market_prices (ticker, date, close)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_snapshots (
+            day TEXT PRIMARY KEY,
+            date TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_cache (
+            symbol TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # A lease per symbol being fetched upstream, so that a miss in one process waits for another's fetch
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_fetches (
+            symbol TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS account_state (
+            name TEXT PRIMARY KEY,
+            balance REAL NOT NULL,
+            strategy TEXT NOT NULL DEFAULT ''
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS holdings (
+            name TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            cost_basis REAL,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, symbol)
+        ) WITHOUT ROWID
+    ''')
+    # Holdings tables created before positions were tracked; a NULL cost_basis marks rows to be rebuilt
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(holdings)')]
+    if 'cost_basis' not in columns:
+        conn.execute('ALTER TABLE holdings ADD COLUMN cost_basis REAL')
+        conn.execute('ALTER TABLE holdings ADD COLUMN realized_pnl REAL NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            rationale TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_name ON transactions (name, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_values (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            datetime TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_values_name ON portfolio_values (name, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_rollups (
+            name TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, resolution, bucket)
+        ) WITHOUT ROWID
+    ''')
+    # Trades already made, by the idempotency key the caller gave, so that a retried tool call isn't repeated
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS trade_requests (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            trade TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    ''')
+    # Trader run metrics, aggregated: totals and latency histogram buckets per (trader, kind, label)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metric_totals (
+            name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            label TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            input_tokens INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            cost REAL NOT NULL,
+            PRIMARY KEY (name, kind, label)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metric_buckets (
+            name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            label TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, kind, label, bucket)
+        ) WITHOUT ROWID
+    ''')
+    # A version per account, bumped by trigger in the same transaction as any change to the account,
+    # so that readers in other processes (the dashboard) can tell cheaply whether an account has changed
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS account_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    for table in ('accounts', 'account_state', 'holdings', 'transactions', 'portfolio_values'):
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO account_versions (name, version) VALUES ({row}.name, 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1;
+                END
+            ''')
 
 def write_account(name, account_dict):
     json_data = json.dumps(account_dict)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO accounts (name, account)
-            VALUES (?, ?)
-            ON CONFLICT(name) DO UPDATE SET account=excluded.account
-        ''', (name.lower(), json_data))
-        conn.commit()
+    execute('''
+        INSERT INTO accounts (name, account)
+        VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET account=excluded.account
+    ''', (name.lower(), json_data))
 
 def read_account(name):
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT account FROM accounts WHERE name = ?', (name.lower(),))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
-    
+    row = execute('SELECT account FROM accounts WHERE name = ?', (name.lower(),)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def write_account_state(name: str, balance: float, strategy: str):
+    execute('''
+        INSERT INTO account_state (name, balance, strategy)
+        VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET balance=excluded.balance, strategy=excluded.strategy
+    ''', (name.lower(), balance, strategy))
+
+def read_account_state(name: str) -> dict | None:
+    row = execute('SELECT balance, strategy FROM account_state WHERE name = ?', (name.lower(),)).fetchone()
+    return {"balance": row[0], "strategy": row[1]} if row else None
+
+def write_holdings(name: str, holdings: dict[str, int]):
+    """Replace the holdings with bare quantities; cost basis is left unknown (NULL) to be rebuilt from transactions"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM holdings WHERE name = ?', (name.lower(),))
+        conn.executemany(
+            'INSERT INTO holdings (name, symbol, quantity) VALUES (?, ?, ?)',
+            [(name.lower(), symbol, quantity) for symbol, quantity in holdings.items() if quantity],
+        )
+
+def read_holdings(name: str) -> dict[str, int]:
+    rows = execute('SELECT symbol, quantity FROM holdings WHERE name = ? AND quantity != 0', (name.lower(),)).fetchall()
+    return dict(rows)
+
+def write_position(name: str, symbol: str, position: dict):
+    """
+    Upsert one position: {quantity, cost_basis, realized_pnl}.
+    A closed position is kept while it carries realized P&L, so that the P&L survives selling out.
+    """
+    if position["quantity"] == 0 and position["realized_pnl"] == 0:
+        execute('DELETE FROM holdings WHERE name = ? AND symbol = ?', (name.lower(), symbol))
+    else:
+        execute('''
+            INSERT INTO holdings (name, symbol, quantity, cost_basis, realized_pnl)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name, symbol) DO UPDATE SET
+                quantity=excluded.quantity, cost_basis=excluded.cost_basis, realized_pnl=excluded.realized_pnl
+        ''', (name.lower(), symbol, position["quantity"], position["cost_basis"], position["realized_pnl"]))
+
+def write_positions(name: str, positions: dict[str, dict]):
+    with transaction():
+        execute('DELETE FROM holdings WHERE name = ?', (name.lower(),))
+        for symbol, position in positions.items():
+            write_position(name, symbol, position)
+
+def read_positions(name: str) -> dict[str, dict]:
+    rows = execute(
+        'SELECT symbol, quantity, cost_basis, realized_pnl FROM holdings WHERE name = ?', (name.lower(),)
+    ).fetchall()
+    return {
+        symbol: {"quantity": quantity, "cost_basis": cost_basis or 0.0, "realized_pnl": realized_pnl}
+        for symbol, quantity, cost_basis, realized_pnl in rows
+    }
+
+def read_names_without_cost_basis() -> list[str]:
+    """Accounts whose positions predate cost basis tracking and need rebuilding from their transactions"""
+    rows = execute('''
+        SELECT name FROM holdings WHERE cost_basis IS NULL
+        UNION
+        SELECT DISTINCT name FROM transactions WHERE name NOT IN (SELECT name FROM holdings)
+    ''').fetchall()
+    return [row[0] for row in rows]
+
+def write_transaction(name: str, transaction: dict):
+    execute('''
+        INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (name.lower(), transaction["symbol"], transaction["quantity"], transaction["price"],
+          transaction["timestamp"], transaction["rationale"]))
+
+def read_transactions(name: str, limit: int | None = None) -> list[dict]:
+    """All transactions in order, or only the most recent `limit` of them"""
+    rows = execute('''
+        SELECT symbol, quantity, price, timestamp, rationale FROM transactions
+        WHERE name = ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), -1 if limit is None else limit)).fetchall()
+    rows.reverse()
+    return [
+        {"symbol": symbol, "quantity": quantity, "price": price, "timestamp": timestamp, "rationale": rationale}
+        for symbol, quantity, price, timestamp, rationale in rows
+    ]
+
+def write_trade_request(name: str, key: str, trade: dict):
+    execute('INSERT INTO trade_requests (name, key, trade) VALUES (?, ?, ?)', (name.lower(), key, json.dumps(trade)))
+
+def read_trade_request(name: str, key: str) -> dict | None:
+    row = execute('SELECT trade FROM trade_requests WHERE name = ? AND key = ?', (name.lower(), key)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def rollup_bucket(datetime: str, resolution: str) -> str:
+    """The start of the minute, hour or day that a 'YYYY-MM-DD HH:MM:SS' timestamp falls in"""
+    length = ROLLUP_PREFIX[resolution]
+    return datetime[:length] + "0000-00-00 00:00:00"[length:]
+
+def write_portfolio_value(name: str, datetime: str, value: float):
+    """Record a raw point and fold it into the open, high, low and close of its minute, hour and day"""
+    with transaction() as conn:
+        conn.execute('INSERT INTO portfolio_values (name, datetime, value) VALUES (?, ?, ?)', (name.lower(), datetime, value))
+        conn.executemany('''
+            INSERT INTO portfolio_rollups (name, resolution, bucket, open, high, low, close, count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT(name, resolution, bucket) DO UPDATE SET
+                high = max(high, excluded.high), low = min(low, excluded.low), close = excluded.close, count = count + 1
+        ''', [
+            (name.lower(), resolution, rollup_bucket(datetime, resolution), value, value, value, value)
+            for resolution in ROLLUP_PREFIX
+        ])
+
+def rebuild_portfolio_rollups(name: str):
+    """Recompute an account's rollups from its raw points, for points written without them"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM portfolio_rollups WHERE name = ?', (name.lower(),))
+        for resolution, length in ROLLUP_PREFIX.items():
+            conn.execute('''
+                INSERT INTO portfolio_rollups (name, resolution, bucket, open, high, low, close, count)
+                SELECT name, ?, bucket,
+                    MAX(CASE WHEN first = 1 THEN value END), MAX(value), MIN(value),
+                    MAX(CASE WHEN last = 1 THEN value END), COUNT(*)
+                FROM (
+                    SELECT name, value, substr(datetime, 1, ?) || ? AS bucket,
+                        ROW_NUMBER() OVER (PARTITION BY substr(datetime, 1, ?) ORDER BY id) AS first,
+                        ROW_NUMBER() OVER (PARTITION BY substr(datetime, 1, ?) ORDER BY id DESC) AS last
+                    FROM portfolio_values WHERE name = ?
+                )
+                GROUP BY name, bucket
+            ''', (resolution, length, "0000-00-00 00:00:00"[length:], length, length, name.lower()))
+
+def read_portfolio_values(name: str) -> list[tuple[str, float]]:
+    """All the raw points still retained; for charts use read_portfolio_series"""
+    rows = execute(
+        'SELECT datetime, value FROM portfolio_values WHERE name = ? ORDER BY id', (name.lower(),)
+    ).fetchall()
+    return [tuple(row) for row in rows]
+
+def read_latest_portfolio_time(name: str) -> str | None:
+    row = execute(
+        'SELECT datetime FROM portfolio_values WHERE name = ? ORDER BY id DESC LIMIT 1', (name.lower(),)
+    ).fetchone()
+    return row[0] if row else None
+
+def read_portfolio_series(
+    name: str, start: str | None = None, end: str | None = None, max_points: int = PORTFOLIO_MAX_POINTS
+) -> list[tuple[str, float]]:
+    """
+    The portfolio value between start and end ('YYYY-MM-DD HH:MM:SS', both optional), as at most max_points
+    (datetime, value) points. The finest tier that still covers the window and fits in max_points is used:
+    raw points, then the close of each minute, hour or day. Only if even the daily closes are too many are they thinned.
+    """
+    name = name.lower()
+    latest = read_latest_portfolio_time(name)
+    if latest is None:
+        return []
+    end = end or latest
+    if start is None:
+        start = execute('''
+            SELECT MIN(bucket) FROM portfolio_rollups WHERE name = ? AND resolution = 'day'
+        ''', (name,)).fetchone()[0] or latest
+    # Retention is measured back from the account's latest point, not the wall clock, so replayed history keeps its tiers
+    latest_time = dt.strptime(latest, "%Y-%m-%d %H:%M:%S")
+    for resolution, retention in PORTFOLIO_TIERS:
+        if retention is not None and start < (latest_time - retention).strftime("%Y-%m-%d %H:%M:%S"):
+            continue
+        if resolution == "raw":
+            where = 'FROM portfolio_values WHERE name = ? AND datetime BETWEEN ? AND ?'
+            params = (name, start, end)
+            select = f'SELECT datetime, value {where} ORDER BY id'
+        else:
+            where = 'FROM portfolio_rollups WHERE name = ? AND resolution = ? AND bucket BETWEEN ? AND ?'
+            params = (name, resolution, rollup_bucket(start, resolution), end)
+            select = f'SELECT bucket, close {where} ORDER BY bucket'
+        count = execute(f'SELECT COUNT(*) {where}', params).fetchone()[0]
+        if count <= max_points or retention is None:
+            rows = [tuple(row) for row in execute(select, params).fetchall()]
+            if len(rows) > max_points:
+                step = math.ceil(len(rows) / max_points)
+                rows = rows[::-1][::step][::-1]
+            return rows
+    return []
+
+def prune_portfolio_values() -> int:
+    """
+    Drop raw points and rollups that are past their tier's retention, measured back from each account's latest point.
+
+    Returns:
+        int: The number of rows removed
+    """
+    removed = 0
+    names = [row[0] for row in execute('SELECT DISTINCT name FROM portfolio_rollups WHERE resolution = ?', ('day',))]
+    for name in names:
+        latest = read_latest_portfolio_time(name)
+        if latest is None:
+            continue
+        latest_time = dt.strptime(latest, "%Y-%m-%d %H:%M:%S")
+        with transaction(immediate=True) as conn:
+            for resolution, retention in PORTFOLIO_TIERS:
+                if retention is None:
+                    continue
+                cutoff = (latest_time - retention).strftime("%Y-%m-%d %H:%M:%S")
+                if resolution == "raw":
+                    cursor = conn.execute('DELETE FROM portfolio_values WHERE name = ? AND datetime < ?', (name, cutoff))
+                else:
+                    cursor = conn.execute('''
+                        DELETE FROM portfolio_rollups WHERE name = ? AND resolution = ? AND bucket < ?
+                    ''', (name, resolution, rollup_bucket(cutoff, resolution)))
+                removed += cursor.rowcount
+    return removed
+
+def delete_account_history(name: str):
+    with transaction() as conn:
+        for table in ("holdings", "transactions", "portfolio_values", "portfolio_rollups"):
+            conn.execute(f'DELETE FROM {table} WHERE name = ?', (name.lower(),))
+
+def migrate_json_accounts() -> int:
+    """
+    One-shot migration of the JSON blobs in the accounts table into the normalized tables.
+    Only accounts that have no account_state row yet are migrated, so it is safe to call repeatedly.
+
+    Returns:
+        int: The number of accounts migrated
+    """
+    rows = execute('''
+        SELECT name, account FROM accounts
+        WHERE name NOT IN (SELECT name FROM account_state)
+    ''').fetchall()
+    migrated = 0
+    for name, account_json in rows:
+        account = json.loads(account_json)
+        with transaction(immediate=True):
+            if read_account_state(name):
+                continue  # Another process got there first
+            migrated += 1
+            write_account_state(name, account["balance"], account.get("strategy", ""))
+            write_holdings(name, account.get("holdings", {}))
+            executemany('''
+                INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (name, t["symbol"], t["quantity"], t["price"], t["timestamp"], t["rationale"])
+                for t in account.get("transactions", [])
+            ])
+            executemany(
+                'INSERT INTO portfolio_values (name, datetime, value) VALUES (?, ?, ?)',
+                [(name, when, value) for when, value in account.get("portfolio_value_time_series", [])],
+            )
+            rebuild_portfolio_rollups(name)
+    return migrated
+
+def read_account_versions(names: list[str]) -> dict[str, int]:
+    """The current version of each account; 0 for an account that has never been written"""
+    placeholders = ', '.join('?' * len(names))
+    rows = execute(
+        f'SELECT name, version FROM account_versions WHERE name IN ({placeholders})', [name.lower() for name in names]
+    ).fetchall()
+    return {name.lower(): 0 for name in names} | dict(rows)
+
 def write_log(name: str, type: str, message: str):
     """
     Write a log entry to the logs table.
-    
+
     Args:
         name (str): The name associated with the log
         type (str): The type of log entry
         message (str): The log message
     """
-    now = datetime.now().isoformat()
-    
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO logs (name, datetime, type, message)
-            VALUES (?, datetime('now'), ?, ?)
-        ''', (name.lower(), type, message))
-        conn.commit()
+    execute('''
+        INSERT INTO logs (name, datetime, type, message)
+        VALUES (?, datetime('now'), ?, ?)
+    ''', (name.lower(), type, message))
+
+def write_logs(entries: list[tuple[str, str, str, str]]):
+    """
+    Write a batch of log entries in a single transaction.
+
+    Args:
+        entries (list): Tuples of (name, datetime, type, message); datetime is UTC 'YYYY-MM-DD HH:MM:SS'
+    """
+    executemany('''
+        INSERT INTO logs (name, datetime, type, message)
+        VALUES (?, ?, ?, ?)
+    ''', [(name.lower(), when, type, message) for name, when, type, message in entries])
 
 def read_log(name: str, last_n=10):
     """
     Read the most recent log entries for a given name.
-    
+
     Args:
         name (str): The name to retrieve logs for
         last_n (int): Number of most recent entries to retrieve
-        
+
     Returns:
         list: A list of tuples containing (datetime, type, message)
     """
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT datetime, type, message FROM logs 
-            WHERE name = ? 
-            ORDER BY datetime DESC
-            LIMIT ?
-        ''', (name.lower(), last_n))
-        
-        return reversed(cursor.fetchall())
-
-def write_market(date: str, data: dict) -> None:
-    data_json = json.dumps(data)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO market (date, data)
-            VALUES (?, ?)
-            ON CONFLICT(date) DO UPDATE SET data=excluded.data
-        ''', (date, data_json))
-        conn.commit()
-
-def read_market(date: str) -> dict | None:
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT data FROM market WHERE date = ?', (date,))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
\ No newline at end of file
+    rows = execute('''
+        SELECT datetime, type, message FROM logs
+        WHERE name = ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), last_n)).fetchall()
+    return reversed(rows)
+
+def read_log_page(name: str, before_id: int | None = None, limit: int = 50):
+    """
+    Read a page of log entries for a given name, newest page first.
+
+    Args:
+        name (str): The name to retrieve logs for
+        before_id (int): Only return entries older than this id; None for the latest page
+        limit (int): Maximum number of entries to return
+
+    Returns:
+        list: Tuples of (id, datetime, type, message) in ascending id order;
+        pass the first id as before_id to fetch the previous page
+    """
+    rows = execute('''
+        SELECT id, datetime, type, message FROM logs
+        WHERE name = ? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), before_id if before_id is not None else 2**63 - 1, limit)).fetchall()
+    return rows[::-1]
+
+def read_log_since(name: str, last_id: int, limit: int = 100):
+    """
+    Read the log entries for a given name that were written after last_id.
+
+    Args:
+        name (str): The name to retrieve logs for
+        last_id (int): The id of the last entry already seen
+        limit (int): Maximum number of entries to return
+
+    Returns:
+        list: Tuples of (id, datetime, type, message) in ascending id order
+    """
+    return execute('''
+        SELECT id, datetime, type, message FROM logs
+        WHERE name = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (name.lower(), last_id, limit)).fetchall()
+
+def read_last_log_id(name: str) -> int:
+    row = execute('SELECT MAX(id) FROM logs WHERE name = ?', (name.lower(),)).fetchone()
+    return row[0] or 0
+
+def prune_logs(retention_days: int = LOG_RETENTION_DAYS, archive: bool = LOG_ARCHIVE) -> int:
+    """
+    Apply the rolling retention policy: log entries older than retention_days are moved to
+    logs_archive (or deleted if archive is False). Work is done in small batches so that
+    writers are never locked out for long.
+
+    Returns:
+        int: The number of entries removed from the logs table
+    """
+    cutoff = f"-{retention_days} days"
+    # ids grow with time, so everything before the first recent entry is old; this scan stops at that entry
+    row = execute('''
+        SELECT id FROM logs WHERE datetime >= datetime('now', ?) ORDER BY id LIMIT 1
+    ''', (cutoff,)).fetchone()
+    if row:
+        boundary = row[0]
+    else:
+        boundary = (execute('SELECT MAX(id) FROM logs').fetchone()[0] or 0) + 1
+    removed = 0
+    while True:
+        with transaction(immediate=True) as conn:
+            upper = conn.execute(
+                'SELECT MAX(id) FROM (SELECT id FROM logs WHERE id < ? ORDER BY id LIMIT ?)',
+                (boundary, LOG_PRUNE_BATCH),
+            ).fetchone()[0]
+            if upper is None:
+                return removed
+            if archive:
+                conn.execute('''
+                    INSERT OR IGNORE INTO logs_archive (id, name, datetime, type, message)
+                    SELECT id, name, datetime, type, message FROM logs WHERE id <= ?
+                ''', (upper,))
+            removed += conn.execute('DELETE FROM logs WHERE id <= ?', (upper,)).rowcount
+
+def write_market_snapshot(day: str, date: str, closes: dict[str, float]) -> None:
+    """
+    Store an end of day snapshot of the whole market.
+
+    Args:
+        day (str): The day the snapshot was fetched, 'YYYY-MM-DD'
+        date (str): The trading date whose closes it holds, 'YYYY-MM-DD'
+        closes (dict): Ticker to closing price
+    """
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO market_prices (date, ticker, close)
+            VALUES (?, ?, ?)
+            ON CONFLICT(date, ticker) DO UPDATE SET close=excluded.close
+        ''', [(date, ticker, close) for ticker, close in closes.items() if close is not None])
+        conn.execute('''
+            INSERT INTO market_snapshots (day, date) VALUES (?, ?)
+            ON CONFLICT(day) DO UPDATE SET date=excluded.date
+        ''', (day, date))
+
+def read_market_snapshot_date(day: str) -> str | None:
+    """The trading date of the snapshot fetched on this day, or None if none has been"""
+    row = execute('SELECT date FROM market_snapshots WHERE day = ?', (day,)).fetchone()
+    return row[0] if row else None
+
+def read_closes(date: str, tickers: list[str]) -> dict[str, float]:
+    """Return {ticker: close} on a trading date, for the tickers that have one"""
+    placeholders = ",".join("?" * len(tickers))
+    rows = execute(f'''
+        SELECT ticker, close FROM market_prices
+        WHERE date = ? AND ticker IN ({placeholders})
+    ''', (date, *tickers)).fetchall()
+    return dict(rows)
+
+def read_close_history(tickers: list[str] | None = None, start: str | None = None, end: str | None = None) -> list[tuple[str, str, float]]:
+    """
+    Return (date, ticker, close) rows between two trading dates, inclusive, ordered by date then ticker.
+    Either date may be None for no bound; with no tickers, every ticker is returned.
+    """
+    conditions, params = ["date >= ?", "date <= ?"], [start or "", end or "9999"]
+    if tickers:
+        conditions.append(f"ticker IN ({','.join('?' * len(tickers))})")
+        params += tickers
+    return execute(f'''
+        SELECT date, ticker, close FROM market_prices
+        WHERE {' AND '.join(conditions)}
+        ORDER BY date, ticker
+    ''', params).fetchall()
+
+def write_cached_prices(prices: dict[str, float], expires_at: float) -> None:
+    executemany('''
+        INSERT INTO price_cache (symbol, price, expires_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(symbol) DO UPDATE SET price=excluded.price, expires_at=excluded.expires_at
+    ''', [(symbol, price, expires_at) for symbol, price in prices.items()])
+
+def read_cached_prices(symbols: list[str], now: float) -> dict[str, tuple[float, float]]:
+    """Return {symbol: (price, expires_at)} for the symbols that have an unexpired cached price"""
+    placeholders = ",".join("?" * len(symbols))
+    rows = execute(f'''
+        SELECT symbol, price, expires_at FROM price_cache
+        WHERE symbol IN ({placeholders}) AND expires_at > ?
+    ''', (*symbols, now)).fetchall()
+    return {symbol: (price, expires_at) for symbol, price, expires_at in rows}
+
+def claim_price_fetches(symbols: list[str], owner: str, now: float, lease_seconds: float) -> list[str]:
+    """
+    Take the fetch lease for each symbol that has neither an unexpired cached price nor a live lease
+    held by another owner, in one immediate transaction; returns the symbols claimed.
+    """
+    placeholders = ",".join("?" * len(symbols))
+    with transaction(immediate=True) as conn:
+        taken = {symbol for (symbol,) in conn.execute(f'''
+            SELECT symbol FROM price_cache WHERE symbol IN ({placeholders}) AND expires_at > ?
+            UNION
+            SELECT symbol FROM price_fetches WHERE symbol IN ({placeholders}) AND expires_at > ? AND owner != ?
+        ''', (*symbols, now, *symbols, now, owner))}
+        claimed = [symbol for symbol in symbols if symbol not in taken]
+        conn.executemany('''
+            INSERT INTO price_fetches (symbol, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(symbol) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+        ''', [(symbol, owner, now + lease_seconds) for symbol in claimed])
+    return claimed
+
+def release_price_fetches(symbols: list[str], owner: str) -> None:
+    executemany('DELETE FROM price_fetches WHERE symbol = ? AND owner = ?', [(symbol, owner) for symbol in symbols])
+
+def read_price_fetches(symbols: list[str], now: float) -> set[str]:
+    """The symbols that another process is fetching right now"""
+    placeholders = ",".join("?" * len(symbols))
+    rows = execute(f'''
+        SELECT symbol FROM price_fetches WHERE symbol IN ({placeholders}) AND expires_at > ?
+    ''', (*symbols, now)).fetchall()
+    return {symbol for (symbol,) in rows}
+
+
+def write_metrics(totals: list[tuple], buckets: list[tuple]) -> None:
+    """
+    Add to the aggregated metrics in a single transaction.
+
+    Args:
+        totals (list): Tuples of (name, kind, label, count, seconds, input_tokens, output_tokens, cost)
+        buckets (list): Tuples of (name, kind, label, bucket, count)
+    """
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO metric_totals (name, kind, label, count, seconds, input_tokens, output_tokens, cost)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name, kind, label) DO UPDATE SET
+                count = count + excluded.count,
+                seconds = seconds + excluded.seconds,
+                input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                cost = cost + excluded.cost
+        ''', totals)
+        conn.executemany('''
+            INSERT INTO metric_buckets (name, kind, label, bucket, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name, kind, label, bucket) DO UPDATE SET count = count + excluded.count
+        ''', buckets)
+
+def read_metrics() -> tuple[list[tuple], list[tuple]]:
+    """Return all metric totals and histogram buckets, in the same shape as write_metrics takes them"""
+    totals = execute('''
+        SELECT name, kind, label, count, seconds, input_tokens, output_tokens, cost
+        FROM metric_totals ORDER BY name, kind, label
+    ''').fetchall()
+    buckets = execute('SELECT name, kind, label, bucket, count FROM metric_buckets').fetchall()
+    return totals, buckets
+
+def delete_metrics() -> None:
+    with transaction() as conn:
+        conn.execute('DELETE FROM metric_totals')
+        conn.execute('DELETE FROM metric_buckets')
+
+
+# Portfolio values recorded before rollups existed
+for (name,) in execute('''
+    SELECT DISTINCT name FROM portfolio_values
+    WHERE name NOT IN (SELECT name FROM portfolio_rollups WHERE resolution = 'day')
+''').fetchall():
+    rebuild_portfolio_rollups(name)
+
+# Market snapshots stored as one JSON blob per day, before market_prices existed. The trading date
+# each blob held was not recorded, so its closes are kept under the day it was fetched.
+def has_legacy_market() -> bool:
+    return execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'market'").fetchone() is not None
+
+if has_legacy_market():
+    with transaction(immediate=True) as conn:
+        if has_legacy_market():
+            for day, data in conn.execute('SELECT date, data FROM market').fetchall():
+                write_market_snapshot(day, day, json.loads(data))
+            conn.execute('DROP TABLE market')
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from database import read_account_versions, read_last_log_id
+from storage import execute
+
+load_dotenv(override=True)
+
+EVENT_POLL_SECONDS = float(os.getenv("EVENT_POLL_SECONDS", "0.05"))
+# How often portfolio values are re-priced even when no account has changed, as the old 120s timer did
+PRICE_REFRESH_SECONDS = float(os.getenv("PRICE_REFRESH_SECONDS", "120"))
+
+
+class EventBus:
+    """
+    Tells the dashboard when a trader's account or logs change, so the UI is pushed updates instead of polling.
+
+    The accounts are changed by other processes (the MCP servers and the trading floor), so a single watcher
+    thread checks SQLite's PRAGMA data_version, which only changes when another connection commits and
+    costs no I/O to read. Only then does it read the account versions and latest log ids for the watched names,
+    and wake every subscriber whose state has moved on. However many browser tabs are open, an idle database
+    costs one data_version check per EVENT_POLL_SECONDS.
+
+    Prices move without any account changing, so subscribers are also woken each time the price epoch,
+    a PRICE_REFRESH_SECONDS time bucket, rolls over.
+    """
+
+    def __init__(self, names: list[str], interval: float = EVENT_POLL_SECONDS):
+        self.names = [name.lower() for name in names]
+        self.interval = interval
+        self.state: dict[str, tuple[int, int]] = {}
+        self.price_epoch = self.current_price_epoch()
+        self.subscribers: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.poll()
+                self.thread = threading.Thread(target=self._run, name="event-bus", daemon=True)
+                self.thread.start()
+
+    def poll(self) -> bool:
+        """Read each account's version and latest log id; returns True if anything changed"""
+        versions = read_account_versions(self.names)
+        state = {name: (versions[name], read_last_log_id(name)) for name in self.names}
+        changed = state != self.state
+        self.state = state
+        return changed
+
+    @staticmethod
+    def current_price_epoch() -> int:
+        return int(time.time() // PRICE_REFRESH_SECONDS)
+
+    def publish(self) -> None:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, event in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # The subscriber's event loop has closed
+
+    def _run(self) -> None:
+        data_version = None
+        while True:
+            try:
+                current = execute("PRAGMA data_version").fetchone()[0]
+                if current != data_version:
+                    data_version = current
+                    if self.poll():
+                        self.publish()
+            except Exception as e:
+                print(f"Event bus could not read the database: {e}")
+            epoch = self.current_price_epoch()
+            if epoch != self.price_epoch:
+                self.price_epoch = epoch
+                self.publish()
+            time.sleep(self.interval)
+
+    def get(self, name: str) -> tuple[int, int]:
+        """The (account version, latest log id) last seen for this name"""
+        return self.state.get(name.lower(), (0, 0))
+
+    async def changes(self):
+        """Yield once straight away, then again after every change, for as long as the caller keeps iterating"""
+        self.start()
+        event = asyncio.Event()
+        subscriber = (asyncio.get_running_loop(), event)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        try:
+            while True:
+                yield
+                await event.wait()
+                event.clear()
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
@@ -0,0 +1,89 @@
+import base64
+import importlib
+from contextlib import AsyncExitStack
+from typing import Any
+from agents.mcp import MCPServer, MCPServerStdio
+from mcp.types import (
+    BlobResourceContents, CallToolResult, ReadResourceResult, TextContent, TextResourceContents, Tool as MCPTool,
+)
+
+CLIENT_SESSION_TIMEOUT_SECONDS = 120
+
+
+class InProcessMCPServer(MCPServer):
+    """
+    One of the project's own FastMCP servers, imported and called directly in the trader's event loop.
+    The agent sees the same tools and schemas as over stdio, but there is no subprocess to start and
+    no JSON-RPC round trip per call. The server shares the trader's process, so it is not isolated:
+    a tool that blocks, blocks the trader too.
+    """
+
+    def __init__(self, module: str):
+        """
+        Args:
+            module: The module that defines the FastMCP app as `mcp`, such as "accounts_server"
+        """
+        self.module = module
+        self.mcp = None
+        self.exit_stack = AsyncExitStack()
+
+    @property
+    def name(self) -> str:
+        return f"inprocess: {self.module}"
+
+    async def connect(self):
+        self.mcp = importlib.import_module(self.module).mcp
+        # Run the server's lifespan, if it has one, as the stdio transport would
+        if self.mcp.settings.lifespan:
+            await self.exit_stack.enter_async_context(self.mcp.settings.lifespan(self.mcp))
+
+    async def cleanup(self):
+        await self.exit_stack.aclose()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.cleanup()
+
+    async def list_tools(self) -> list[MCPTool]:
+        return await self.mcp.list_tools()
+
+    async def call_tool(self, tool_name: str, arguments: dict[str, Any] | None) -> CallToolResult:
+        try:
+            content = await self.mcp.call_tool(tool_name, arguments or {})
+            return CallToolResult(content=list(content), isError=False)
+        except Exception as e:
+            # The same result the MCP server returns to a stdio client when a tool raises
+            return CallToolResult(content=[TextContent(type="text", text=str(e))], isError=True)
+
+    async def read_resource(self, uri: str) -> ReadResourceResult:
+        """Read one of the server's resources, in the same shape a ClientSession returns"""
+        contents = []
+        for item in await self.mcp.read_resource(uri):
+            if isinstance(item.content, bytes):
+                blob = base64.b64encode(item.content).decode()
+                contents.append(BlobResourceContents(uri=uri, blob=blob, mimeType=item.mime_type))
+            else:
+                contents.append(TextResourceContents(uri=uri, text=item.content, mimeType=item.mime_type))
+        return ReadResourceResult(contents=contents)
+
+
+def server_name(params: dict) -> str:
+    """Name a stdio server after the script or package it runs, rather than the launcher (uv, uvx or npx)"""
+    args = params.get("args") or [params["command"]]
+    return f"stdio: {args[-1]}"
+
+
+def make_mcp_server(params: dict) -> MCPServer:
+    """Create the server for an entry in mcp_params: in-process for {"module": ...}, otherwise a stdio subprocess"""
+    if "module" in params:
+        return InProcessMCPServer(params["module"])
+    # A server's tools don't change while it runs, so they are listed once per server rather than on every agent turn
+    return MCPServerStdio(
+        params,
+        client_session_timeout_seconds=CLIENT_SESSION_TIMEOUT_SECONDS,
+        cache_tools_list=True,
+        name=server_name(params),
+    )
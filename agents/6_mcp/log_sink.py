@@ -0,0 +1,98 @@
+import atexit
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from database import write_logs
+
+load_dotenv(override=True)
+
+LOG_FLUSH_BATCH = int(os.getenv("LOG_FLUSH_BATCH", "50"))
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "1.0"))
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", "10000"))
+
+
+class LogSink:
+    """
+    Buffers log entries in memory and writes them to the logs table in batches from a background thread,
+    so that callers on the event loop never wait on SQLite.
+    A batch is written once LOG_FLUSH_BATCH entries are waiting or LOG_FLUSH_SECONDS have passed.
+    If the buffer fills up (the database is unavailable for a long time), the oldest entries are dropped.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = LOG_FLUSH_BATCH,
+        interval: float = LOG_FLUSH_SECONDS,
+        capacity: int = LOG_BUFFER_SIZE,
+    ):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.buffer = deque(maxlen=capacity)
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.flushed = threading.Condition(self.condition)
+        self.pending = 0
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self.thread.start()
+
+    def write(self, name: str, type: str, message: str) -> None:
+        when = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append((name, when, type, message))
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    def _take(self) -> list:
+        batch = list(self.buffer)
+        self.buffer.clear()
+        self.pending = len(batch)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                if not self.stopping and len(self.buffer) < self.batch_size:
+                    self.condition.wait(self.interval)
+                batch = self._take()
+                stopping = self.stopping
+            if batch:
+                try:
+                    write_logs(batch)
+                except Exception as e:
+                    print(f"Unable to write {len(batch)} log entries: {e}")
+            with self.condition:
+                self.pending = 0
+                self.flushed.notify_all()
+                if stopping and not self.buffer:
+                    return
+
+    def force_flush(self, timeout: float = 10.0) -> None:
+        """Block until everything written so far has reached the database."""
+        with self.condition:
+            self.condition.notify()
+            self.flushed.wait_for(lambda: not self.buffer and not self.pending, timeout)
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+
+_sink: LogSink | None = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink() -> LogSink:
+    """The process-wide sink, started on first use and drained at interpreter exit."""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = LogSink()
+            atexit.register(_sink.shutdown)
+        return _sink
@@ -1,11 +1,15 @@
 from polygon import RESTClient
 from dotenv import load_dotenv
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 import random
-from database import write_market, read_market
+from database import write_market_snapshot, read_market_snapshot_date, read_closes
+from price_cache import PriceCache
+from market_calendar import next_close
 from functools import lru_cache
 from datetime import timezone
+from typing import Callable
 
 load_dotenv(override=True)
 
@@ -15,56 +19,122 @@ polygon_plan = os.getenv("POLYGON_PLAN")
 is_paid_polygon = polygon_plan == "paid"
 is_realtime_polygon = polygon_plan == "realtime"
 
+PRICE_TTL_DELAYED_SECONDS = int(os.getenv("PRICE_TTL_DELAYED_SECONDS", "60"))
+PRICE_TTL_REALTIME_SECONDS = int(os.getenv("PRICE_TTL_REALTIME_SECONDS", "5"))
+
+# When set (by the backtester), prices come from this function instead of Polygon: symbols -> {symbol: price}
+price_provider: Callable[[list[str]], dict[str, float]] | None = None
+
+
+@lru_cache(maxsize=1)
+def get_client() -> RESTClient:
+    """One client per process, so that its HTTP connection pool is reused across lookups"""
+    return RESTClient(polygon_api_key)
+
 
 def is_market_open() -> bool:
-    client = RESTClient(polygon_api_key)
-    market_status = client.get_market_status()
+    """Ask Polygon whether the market is open right now; market_calendar answers this without a request"""
+    market_status = get_client().get_market_status()
     return market_status.market == "open"
 
 
-def get_all_share_prices_polygon_eod() -> dict[str, float]:
-    """With much thanks to student Reema R. for fixing the timezone issue with this!"""
-    client = RESTClient(polygon_api_key)
+def get_all_share_prices_polygon_eod() -> tuple[str, dict[str, float]]:
+    """
+    The trading date of the last close, and every ticker's close on it.
+    With much thanks to student Reema R. for fixing the timezone issue with this!
+    """
+    client = get_client()
 
     probe = client.get_previous_close_agg("SPY")[0]
     last_close = datetime.fromtimestamp(probe.timestamp / 1000, tz=timezone.utc).date()
 
     results = client.get_grouped_daily_aggs(last_close, adjusted=True, include_otc=False)
-    return {result.ticker: result.close for result in results}
+    return last_close.strftime("%Y-%m-%d"), {result.ticker: result.close for result in results}
 
 
 @lru_cache(maxsize=2)
-def get_market_for_prior_date(today):
-    market_data = read_market(today)
-    if not market_data:
-        market_data = get_all_share_prices_polygon_eod()
-        write_market(today, market_data)
-    return market_data
+def get_market_date(today) -> str:
+    """The trading date held by the snapshot for this day, fetching and storing the snapshot the first time"""
+    date = read_market_snapshot_date(today)
+    if not date:
+        date, market_data = get_all_share_prices_polygon_eod()
+        write_market_snapshot(today, date, market_data)
+    return date
 
 
 def get_share_price_polygon_eod(symbol) -> float:
-    today = datetime.now().date().strftime("%Y-%m-%d")
-    market_data = get_market_for_prior_date(today)
-    return market_data.get(symbol, 0.0)
+    return fetch_share_prices_polygon_eod([symbol]).get(symbol, 0.0)
 
 
 def get_share_price_polygon_min(symbol) -> float:
-    client = RESTClient(polygon_api_key)
-    result = client.get_snapshot_ticker("stocks", symbol)
+    result = get_client().get_snapshot_ticker("stocks", symbol)
     return result.min.close or result.prev_day.close
 
 
+def get_share_prices_polygon_min(symbols: list[str]) -> dict[str, float]:
+    """One snapshot request for all the symbols, rather than one per symbol"""
+    results = get_client().get_snapshot_all("stocks", tickers=symbols)
+    prices = {symbol: 0.0 for symbol in symbols}
+    for result in results:
+        minute_close = result.min.close if result.min else None
+        prices[result.ticker] = minute_close or result.prev_day.close
+    return prices
+
+
+def price_expiry() -> float:
+    """
+    When a price fetched now goes stale: a few seconds for realtime, a minute for the 15 min delayed plan,
+    and for end of day prices the next close (or the next local midnight, when the daily snapshot is re-keyed)
+    """
+    if is_realtime_polygon:
+        return time.time() + PRICE_TTL_REALTIME_SECONDS
+    if is_paid_polygon:
+        return time.time() + PRICE_TTL_DELAYED_SECONDS
+    tomorrow = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return min(next_close().timestamp(), tomorrow.timestamp())
+
+
+price_cache = PriceCache(price_expiry)
+
+
+def fetch_share_prices_polygon_eod(symbols: list[str]) -> dict[str, float]:
+    """Reads just these symbols from the day's end of day snapshot"""
+    today = datetime.now().date().strftime("%Y-%m-%d")
+    return read_closes(get_market_date(today), symbols)
+
+
 def get_share_price_polygon(symbol) -> float:
+    return get_share_prices_polygon([symbol])[symbol]
+
+
+def get_share_prices_polygon(symbols: list[str]) -> dict[str, float]:
     if is_paid_polygon:
-        return get_share_price_polygon_min(symbol)
+        return price_cache.get_many(symbols, get_share_prices_polygon_min)
     else:
-        return get_share_price_polygon_eod(symbol)
+        return price_cache.get_many(symbols, fetch_share_prices_polygon_eod)
 
 
 def get_share_price(symbol) -> float:
+    if price_provider:
+        return price_provider([symbol]).get(symbol, 0.0)
     if polygon_api_key:
         try:
             return get_share_price_polygon(symbol)
         except Exception as e:
             print(f"Was not able to use the polygon API due to {e}; using a random number")
     return float(random.randint(1, 100))
+
+
+def get_share_prices(symbols: list[str]) -> dict[str, float]:
+    """Look up several share prices with a single round trip; returns a dict of symbol to price"""
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return {}
+    if price_provider:
+        return {symbol: 0.0 for symbol in symbols} | price_provider(symbols)
+    if polygon_api_key:
+        try:
+            return get_share_prices_polygon(symbols)
+        except Exception as e:
+            print(f"Was not able to use the polygon API due to {e}; using random numbers")
+    return {symbol: float(random.randint(1, 100)) for symbol in symbols}
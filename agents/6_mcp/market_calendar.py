@@ -0,0 +1,166 @@
+"""
+The NYSE trading calendar, worked out locally: weekends, exchange holidays and 1pm early closes.
+Answers whether the market is open, and when it next opens or closes, without calling Polygon.
+
+Closures that no rule can predict (such as a national day of mourning) are learned by reconcile(),
+which asks the API whether the market really is open until it gets a settled answer for the day.
+"""
+
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Callable
+from zoneinfo import ZoneInfo
+
+NEW_YORK = ZoneInfo("America/New_York")
+
+REGULAR_OPEN = time(9, 30)
+REGULAR_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+
+# How long to wait before asking the API again, after an error or a first "closed" answer
+RECHECK_AFTER = timedelta(minutes=5)
+
+# Trading days the API has reported closed, the last day the API settled, the earliest time to ask again,
+# and the day the API has said "closed" once but not yet confirmed it
+closed_days: set[date] = set()
+last_reconciled: date | None = None
+next_check: datetime | None = None
+suspected_closed: date | None = None
+
+
+def easter(year: int) -> date:
+    """Easter Sunday in the Gregorian calendar (the anonymous Gregorian algorithm)"""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return date(year, month, day)
+
+
+def nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """The nth (1-based) weekday of a month, or the last one when n is -1; Monday is 0"""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(day: date) -> date:
+    """A holiday on a Saturday is observed the Friday before, and on a Sunday the Monday after"""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=8)
+def holidays(year: int) -> frozenset[date]:
+    days = {
+        nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        easter(year) - timedelta(days=2),  # Good Friday
+        nth_weekday(year, 5, 0, -1),  # Memorial Day
+        observed(date(year, 7, 4)),  # Independence Day
+        nth_weekday(year, 9, 0, 1),  # Labor Day
+        nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        observed(date(year, 12, 25)),  # Christmas
+    }
+    # New Year's Day on a Saturday is not observed on the Friday before, which ends the previous year
+    if date(year, 1, 1).weekday() != 5:
+        days.add(observed(date(year, 1, 1)))
+    if year >= 2022:
+        days.add(observed(date(year, 6, 19)))  # Juneteenth
+    return frozenset(days)
+
+
+@lru_cache(maxsize=8)
+def early_closes(year: int) -> frozenset[date]:
+    days = {nth_weekday(year, 11, 3, 4) + timedelta(days=1)}  # The day after Thanksgiving
+    if date(year, 7, 4).weekday() in (1, 2, 3, 4):
+        days.add(date(year, 7, 3))
+    if date(year, 12, 24).weekday() < 5 and date(year, 12, 24) not in holidays(year):
+        days.add(date(year, 12, 24))
+    return frozenset(days)
+
+
+def is_trading_day(day: date) -> bool:
+    return day.weekday() < 5 and day not in holidays(day.year) and day not in closed_days
+
+
+def session(day: date) -> tuple[datetime, datetime] | None:
+    """The open and close of the regular session on a day, in New York time, or None if the market is closed"""
+    if not is_trading_day(day):
+        return None
+    close = EARLY_CLOSE if day in early_closes(day.year) else REGULAR_CLOSE
+    return (
+        datetime.combine(day, REGULAR_OPEN, tzinfo=NEW_YORK),
+        datetime.combine(day, close, tzinfo=NEW_YORK),
+    )
+
+
+def is_market_open(now: datetime | None = None) -> bool:
+    now = (now or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+    hours = session(now.date())
+    return hours is not None and hours[0] <= now < hours[1]
+
+
+def next_open(now: datetime | None = None) -> datetime:
+    """When the market next opens; `now` itself if it is open now"""
+    now = (now or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+    day = now.date()
+    while True:
+        hours = session(day)
+        if hours and now < hours[1]:
+            return max(hours[0], now)
+        day += timedelta(days=1)
+
+
+def next_close(now: datetime | None = None) -> datetime:
+    """When the market next closes, counting today's close if it is still to come"""
+    now = (now or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+    day = now.date()
+    while True:
+        hours = session(day)
+        if hours and now < hours[1]:
+            return hours[1]
+        day += timedelta(days=1)
+
+
+def seconds_until_open(now: datetime | None = None) -> float:
+    now = (now or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+    return (next_open(now) - now).total_seconds()
+
+
+def reconcile(api_is_open: Callable[[], bool], now: datetime | None = None) -> None:
+    """
+    While the calendar says the market is open, ask the API whether it really is, until the day is settled.
+    Right at the open the API can briefly report the market closed, so a day is only treated as closed after
+    two "closed" answers at least RECHECK_AFTER apart; a failed check is retried after RECHECK_AFTER too.
+    """
+    global last_reconciled, next_check, suspected_closed
+    now = (now or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+    today = now.date()
+    if last_reconciled == today or not is_market_open(now) or (next_check and now < next_check):
+        return
+    next_check = now + RECHECK_AFTER
+    try:
+        is_open = api_is_open()
+    except Exception as e:
+        print(f"Was not able to check the market status due to {e}; using the calendar and retrying later")
+        return
+    if is_open:
+        last_reconciled = today
+    elif suspected_closed == today:
+        print(f"The market is unexpectedly closed on {today}")
+        closed_days.add(today)
+        last_reconciled = today
+    else:
+        suspected_closed = today
@@ -7,6 +7,17 @@ load_dotenv(override=True)
 brave_env = {"BRAVE_API_KEY": os.getenv("BRAVE_API_KEY")}
 polygon_api_key = os.getenv("POLYGON_API_KEY")
 
+# How the project's own FastMCP servers are run: "stdio" starts each as a subprocess, isolated from the trader;
+# "inprocess" imports them and calls their tools directly in the trader's event loop
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "stdio").strip().lower()
+
+
+def own_server(module: str) -> dict:
+    if MCP_TRANSPORT == "inprocess":
+        return {"module": module}
+    return {"command": "uv", "args": ["run", f"{module}.py"]}
+
+
 # The MCP server for the Trader to read Market Data
 
 if is_paid_polygon or is_realtime_polygon:
@@ -16,14 +27,14 @@ if is_paid_polygon or is_realtime_polygon:
         "env": {"POLYGON_API_KEY": polygon_api_key},
     }
 else:
-    market_mcp = {"command": "uv", "args": ["run", "market_server.py"]}
+    market_mcp = own_server("market_server")
 
 
 # The full set of MCP servers for the trader: Accounts, Push Notification and the Market
 
 trader_mcp_server_params = [
-    {"command": "uv", "args": ["run", "accounts_server.py"]},
-    {"command": "uv", "args": ["run", "push_server.py"]},
+    own_server("accounts_server"),
+    own_server("push_server"),
     market_mcp,
 ]
 
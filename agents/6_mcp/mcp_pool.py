@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+from agents.mcp import MCPServer
+from inprocess_mcp import make_mcp_server
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_TIMEOUT_SECONDS = 10
+CLOSE_TIMEOUT_SECONDS = 10
+
+
+class PooledServer:
+    """
+    One long-lived MCP server. The server is entered and exited from its own task, because the stdio
+    transport must be closed from the same task that opened it, while the server itself is shared by
+    every trader's task.
+    """
+
+    def __init__(self, params: dict):
+        self.params = params
+        self.server = make_mcp_server(params)
+        self.ready = asyncio.get_running_loop().create_future()
+        self.stop = asyncio.Event()
+        self.last_used = asyncio.get_running_loop().time()
+        self.task = asyncio.create_task(self.hold(), name=f"mcp-{self.server.name}")
+
+    async def hold(self):
+        try:
+            async with self.server:
+                self.ready.set_result(self.server)
+                await self.stop.wait()
+        except Exception as e:
+            if not self.ready.done():
+                self.ready.set_exception(e)
+            else:
+                logger.warning(f"MCP server {self.server.name} stopped: {e}")
+
+    async def wait_ready(self) -> MCPServer:
+        return await asyncio.shield(self.ready)
+
+    async def is_healthy(self) -> bool:
+        if self.task.done() or not self.ready.done() or self.ready.exception():
+            return False
+        if getattr(self.server, "session", None) is None:
+            return True  # An in-process server has no connection that could fail
+        try:
+            await asyncio.wait_for(self.server.session.send_ping(), HEALTH_CHECK_TIMEOUT_SECONDS)
+            return True
+        except Exception:
+            return False
+
+    async def close(self):
+        self.stop.set()
+        try:
+            await asyncio.wait_for(self.task, CLOSE_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"MCP server {self.server.name} did not close cleanly: {e}")
+
+
+class MCPServerPool:
+    """
+    MCP servers that are started once and shared across traders and across trading cycles,
+    instead of being spawned for every run. Servers are keyed by their params, so stateful servers
+    whose params differ per trader (such as the per-trader memory database) get one instance per trader.
+    A server that has not been asked for in idle_seconds is closed by check_health, and started again
+    the next time it is needed; with no idle_seconds, servers stay up until the pool closes.
+    """
+
+    def __init__(self, idle_seconds: float | None = None):
+        self.servers: dict[str, PooledServer] = {}
+        self.idle_seconds = idle_seconds
+
+    @staticmethod
+    def key(params: dict) -> str:
+        return json.dumps(params, sort_keys=True, default=str)
+
+    async def get(self, params: dict) -> MCPServer:
+        """Return the connected server for these params, starting it on first use or after it has stopped"""
+        key = self.key(params)
+        pooled = self.servers.get(key)
+        if pooled is not None and pooled.task.done():
+            logger.warning(f"Restarting stopped MCP server {pooled.server.name}")
+            del self.servers[key]
+            pooled = None
+        if pooled is None:
+            pooled = PooledServer(params)
+            self.servers[key] = pooled
+        pooled.last_used = asyncio.get_running_loop().time()
+        try:
+            return await pooled.wait_ready()
+        except Exception:
+            if self.servers.get(key) is pooled:
+                del self.servers[key]
+            raise
+
+    async def get_all(self, params_list: list[dict]) -> list[MCPServer]:
+        return list(await asyncio.gather(*[self.get(params) for params in params_list]))
+
+    async def check_health(self) -> None:
+        """
+        Close servers that have been idle for longer than idle_seconds, then ping the rest and drop any
+        that don't answer; either kind is restarted the next time it is needed. Call this between runs,
+        while no trader is using a server.
+        """
+        if self.idle_seconds is not None:
+            now = asyncio.get_running_loop().time()
+            idle = [(key, pooled) for key, pooled in self.servers.items() if now - pooled.last_used > self.idle_seconds]
+            for key, pooled in idle:
+                logger.info(f"Closing idle MCP server {pooled.server.name}")
+                del self.servers[key]
+            await asyncio.gather(*[pooled.close() for _, pooled in idle])
+        pooled_servers = list(self.servers.items())
+        healthy = await asyncio.gather(*[pooled.is_healthy() for _, pooled in pooled_servers])
+        for (key, pooled), ok in zip(pooled_servers, healthy):
+            if not ok and pooled.ready.done():
+                logger.warning(f"Restarting unhealthy MCP server {pooled.server.name}")
+                if self.servers.get(key) is pooled:
+                    del self.servers[key]
+                await pooled.close()
+
+    async def close(self) -> None:
+        pooled_servers = list(self.servers.values())
+        self.servers.clear()
+        await asyncio.gather(*[pooled.close() for pooled in pooled_servers])
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,314 @@
+"""
+Where each trading cycle spends its time: a trace processor that aggregates span durations, token usage and
+cost for every trader run, and a CLI to report them as p50/p95/p99 per trader, model, MCP server and tool.
+
+    uv run metrics.py                 # print a table
+    uv run metrics.py --serve 9464    # serve Prometheus text at http://localhost:9464/metrics
+    uv run metrics.py --reset         # clear the aggregated metrics
+
+The trading floor records into the accounts database, so the report can be run from another process at any time.
+Durations are kept as histograms, not raw samples, so the store stays the same size however long the floor runs.
+"""
+
+import argparse
+import atexit
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from agents import TracingProcessor, Trace, Span
+from agents.tracing import get_current_trace
+from dotenv import load_dotenv
+from database import write_metrics, read_metrics, delete_metrics
+from tracers import get_trader_name
+
+load_dotenv(override=True)
+
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Each histogram bucket is 5% wider than the last, so a percentile is within about 2.5% of the true value
+BUCKET_GROWTH = 1.05
+MIN_SECONDS = 1e-6
+QUANTILES = (0.5, 0.95, 0.99)
+
+# USD per million input and output tokens; models that aren't listed are counted at no cost
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "deepseek-chat": (0.27, 1.10),
+    "gemini-2.5-flash": (0.15, 0.60),
+    "grok-3-mini": (0.30, 0.50),
+}
+
+
+def model_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    # Providers report dated versions such as gpt-4o-mini-2024-07-18, and OpenRouter adds a vendor prefix
+    model = model.split("/")[-1]
+    for known in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(known):
+            input_price, output_price = MODEL_PRICES[known]
+            return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+    return 0.0
+
+
+def bucket_of(seconds: float) -> int:
+    return math.floor(math.log(max(seconds, MIN_SECONDS), BUCKET_GROWTH))
+
+
+def bucket_seconds(bucket: int) -> float:
+    """The midpoint of a bucket, on a log scale"""
+    return BUCKET_GROWTH ** (bucket + 0.5)
+
+
+class Series:
+    """The aggregated metrics for one (trader, kind, label)"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.buckets: dict[int, int] = {}
+
+    def add(self, seconds: float, input_tokens: int = 0, output_tokens: int = 0, cost: float = 0.0) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost += cost
+        bucket = bucket_of(seconds)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return bucket_seconds(bucket)
+        return bucket_seconds(max(self.buckets))
+
+
+class MetricsRecorder:
+    """
+    Collects metrics in memory and adds them to the database from a background thread every
+    METRICS_FLUSH_SECONDS, so that span callbacks on the event loop never wait on SQLite.
+    """
+
+    def __init__(self, interval: float = METRICS_FLUSH_SECONDS):
+        self.interval = interval
+        self.pending: dict[tuple[str, str, str], Series] = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self.thread.start()
+
+    def record(self, name: str, kind: str, label: str, seconds: float, input_tokens: int = 0, output_tokens: int = 0, cost: float = 0.0) -> None:
+        with self.lock:
+            series = self.pending.setdefault((name, kind, label), Series())
+            series.add(seconds, input_tokens, output_tokens, cost)
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        totals = [
+            (*key, series.count, series.seconds, series.input_tokens, series.output_tokens, series.cost)
+            for key, series in pending.items()
+        ]
+        buckets = [(*key, bucket, count) for key, series in pending.items() for bucket, count in series.buckets.items()]
+        try:
+            write_metrics(totals, buckets)
+        except Exception as e:
+            print(f"Unable to write metrics: {e}")
+
+    def _run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            self.flush()
+
+    def shutdown(self) -> None:
+        self.stopping.set()
+        self.flush()
+
+
+_recorder: MetricsRecorder | None = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> MetricsRecorder:
+    """The process-wide recorder, started on first use and flushed at interpreter exit"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = MetricsRecorder()
+            atexit.register(_recorder.shutdown)
+        return _recorder
+
+
+def record_wait(label: str, seconds: float, name: str | None = None) -> None:
+    """Record time spent queueing; without a name, it is charged to the trader whose trace is current"""
+    if name is None:
+        trace = get_current_trace()
+        name = get_trader_name(trace.trace_id) if trace else None
+    if name:
+        get_recorder().record(name, "queue", label, seconds)
+
+
+def span_seconds(span: Span) -> float:
+    if not span.started_at or not span.ended_at:
+        return 0.0
+    return (datetime.fromisoformat(span.ended_at) - datetime.fromisoformat(span.started_at)).total_seconds()
+
+
+class MetricsTracer(TracingProcessor):
+    """
+    Records, for each trader: the duration of the whole cycle, of each agent, LLM call, tool call and MCP tool
+    listing, with token counts and cost for LLM calls. Tool calls are labelled with the MCP server that served them.
+    """
+
+    def __init__(self):
+        self.recorder = get_recorder()
+        self.trace_starts: dict[str, float] = {}
+
+    def on_trace_start(self, trace: Trace) -> None:
+        if get_trader_name(trace.trace_id):
+            self.trace_starts[trace.trace_id] = time.monotonic()
+
+    def on_trace_end(self, trace: Trace) -> None:
+        start = self.trace_starts.pop(trace.trace_id, None)
+        name = get_trader_name(trace.trace_id)
+        if name and start is not None:
+            self.recorder.record(name, "cycle", trace.name.rsplit("-", 1)[-1], time.monotonic() - start)
+
+    def on_span_start(self, span: Span) -> None:
+        pass
+
+    def on_span_end(self, span: Span) -> None:
+        name = get_trader_name(span.trace_id)
+        data = span.span_data
+        if not name or not data:
+            return
+        seconds = span_seconds(span)
+        if data.type == "generation":
+            usage = data.usage or {}
+            self.record_llm(name, data.model or "unknown", seconds, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+        elif data.type == "response":
+            response = data.response
+            usage = response.usage if response else None
+            model = response.model if response else "unknown"
+            self.record_llm(name, model, seconds, usage.input_tokens if usage else 0, usage.output_tokens if usage else 0)
+        elif data.type == "function":
+            server = (data.mcp_data or {}).get("server")
+            self.recorder.record(name, "tool", f"{server}/{data.name}" if server else data.name, seconds)
+        elif data.type == "mcp_tools":
+            self.recorder.record(name, "list_tools", data.server or "unknown", seconds)
+        else:
+            self.recorder.record(name, data.type, getattr(data, "name", None) or data.type, seconds)
+
+    def record_llm(self, name: str, model: str, seconds: float, input_tokens: int, output_tokens: int) -> None:
+        cost = model_cost(model, input_tokens, output_tokens)
+        self.recorder.record(name, "llm", model, seconds, input_tokens, output_tokens, cost)
+
+    def force_flush(self) -> None:
+        self.recorder.flush()
+
+    def shutdown(self) -> None:
+        self.recorder.shutdown()
+
+
+def load_series() -> dict[tuple[str, str, str], Series]:
+    totals, buckets = read_metrics()
+    series = {}
+    for name, kind, label, count, seconds, input_tokens, output_tokens, cost in totals:
+        s = series[(name, kind, label)] = Series()
+        s.count, s.seconds, s.input_tokens, s.output_tokens, s.cost = count, seconds, input_tokens, output_tokens, cost
+    for name, kind, label, bucket, count in buckets:
+        if (name, kind, label) in series:
+            series[(name, kind, label)].buckets[bucket] = count
+    return series
+
+
+def format_seconds(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def render_table(series: dict[tuple[str, str, str], Series]) -> str:
+    header = f"{'trader':<10} {'kind':<11} {'label':<44} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'tokens':>10} {'cost $':>9}"
+    lines = [header, "-" * len(header)]
+    for (name, kind, label), s in sorted(series.items()):
+        p50, p95, p99 = (format_seconds(s.quantile(q)) for q in QUANTILES)
+        tokens = f"{s.input_tokens + s.output_tokens:>10}" if kind == "llm" else f"{'':>10}"
+        cost = f"{s.cost:>9.4f}" if kind == "llm" else f"{'':>9}"
+        lines.append(f"{name:<10} {kind:<11} {label[:44]:<44} {s.count:>7} {p50:>9} {p95:>9} {p99:>9} {tokens} {cost}")
+    return "\n".join(lines)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(series: dict[tuple[str, str, str], Series]) -> str:
+    lines = [
+        "# HELP trader_span_seconds Duration of trader cycles, agents, LLM calls, tool calls and queue waits",
+        "# TYPE trader_span_seconds summary",
+    ]
+    for (name, kind, label), s in sorted(series.items()):
+        labels = f'trader="{escape(name)}",kind="{escape(kind)}",label="{escape(label)}"'
+        for q in QUANTILES:
+            lines.append(f'trader_span_seconds{{{labels},quantile="{q}"}} {s.quantile(q):.6f}')
+        lines.append(f"trader_span_seconds_sum{{{labels}}} {s.seconds:.6f}")
+        lines.append(f"trader_span_seconds_count{{{labels}}} {s.count}")
+    llm = sorted((key, s) for key, s in series.items() if key[1] == "llm")
+    lines += ["# HELP trader_tokens_total LLM tokens used", "# TYPE trader_tokens_total counter"]
+    for (name, _, model), s in llm:
+        for direction, tokens in (("input", s.input_tokens), ("output", s.output_tokens)):
+            lines.append(f'trader_tokens_total{{trader="{escape(name)}",model="{escape(model)}",direction="{direction}"}} {tokens}')
+    lines += ["# HELP trader_cost_usd_total Estimated LLM cost", "# TYPE trader_cost_usd_total counter"]
+    for (name, _, model), s in llm:
+        lines.append(f'trader_cost_usd_total{{trader="{escape(name)}",model="{escape(model)}"}} {s.cost:.6f}')
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus(load_series()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = METRICS_PORT) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", port), PrometheusHandler)
+    print(f"Serving trader metrics at http://127.0.0.1:{port}/metrics")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report where trader runs spend their time")
+    parser.add_argument("--serve", type=int, nargs="?", const=METRICS_PORT, metavar="PORT", help="Serve Prometheus text")
+    parser.add_argument("--prometheus", action="store_true", help="Print Prometheus text instead of a table")
+    parser.add_argument("--reset", action="store_true", help="Clear the aggregated metrics")
+    args = parser.parse_args()
+    if args.reset:
+        delete_metrics()
+    elif args.serve:
+        serve(args.serve)
+    elif args.prometheus:
+        print(render_prometheus(load_series()), end="")
+    else:
+        print(render_table(load_series()))
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import random
+from concurrent.futures import Future
+from datetime import datetime
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+pushover_user = os.getenv("PUSHOVER_USER")
+pushover_token = os.getenv("PUSHOVER_TOKEN")
+pushover_url = "https://api.pushover.net/1/messages.json"
+
+# "pushover" sends for real; "file" appends each notification to PUSH_FILE instead, for testing
+PUSH_BACKEND = os.getenv("PUSH_BACKEND", "pushover").strip().lower()
+PUSH_FILE = os.getenv("PUSH_FILE", "notifications.jsonl")
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "100"))
+PUSH_COALESCE_SECONDS = float(os.getenv("PUSH_COALESCE_SECONDS", "2"))
+PUSH_MAX_RETRIES = 5
+PUSH_TIMEOUT_SECONDS = 10
+PUSHOVER_MAX_LENGTH = 1024
+
+
+class PushoverBackend:
+    """Sends through one pooled HTTP client, so the TLS connection to Pushover is kept alive between messages"""
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            timeout=PUSH_TIMEOUT_SECONDS, limits=httpx.Limits(max_connections=2, max_keepalive_connections=2)
+        )
+
+    async def send(self, message: str) -> None:
+        payload = {"user": pushover_user, "token": pushover_token, "message": message}
+        response = await self.client.post(pushover_url, data=payload)
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class FileBackend:
+    """Appends each notification as a JSON line, for running without Pushover"""
+
+    def __init__(self, path: str = PUSH_FILE):
+        self.path = path
+
+    async def send(self, message: str) -> None:
+        line = json.dumps({"datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "message": message})
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def close(self) -> None:
+        pass
+
+
+def make_backend():
+    return FileBackend() if PUSH_BACKEND == "file" else PushoverBackend()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, OSError))
+
+
+class NotificationDispatcher:
+    """
+    Queues notifications and sends them from a background task, so a caller never waits on Pushover.
+
+    Messages that arrive within PUSH_COALESCE_SECONDS of each other are joined into one notification.
+    Failed sends are retried with exponential backoff. The queue is bounded; when it is full, the oldest
+    message is dropped to make room. Each message comes with a Future that says what became of it:
+    True once sent, or the error if it failed or was dropped.
+    """
+
+    def __init__(self, backend=None, queue_size: int = PUSH_QUEUE_SIZE, coalesce_seconds: float = PUSH_COALESCE_SECONDS):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.coalesce_seconds = coalesce_seconds
+        self.queue = None
+        self.task = None
+        self.dropped = 0
+
+    def notify(self, message: str) -> Future:
+        """Queue a message and return at once; must be called from the event loop"""
+        if self.task is None or self.task.done():
+            self.backend = self.backend or make_backend()
+            self.queue = self.queue or asyncio.Queue(self.queue_size)
+            self.task = asyncio.get_running_loop().create_task(self._run(), name="notifications")
+        if self.queue.full():
+            _, dropped = self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+            dropped.set_exception(RuntimeError("Dropped because the notification queue was full"))
+        delivered = Future()
+        self.queue.put_nowait((message, delivered))
+        return delivered
+
+    async def _next_batch(self) -> list[tuple[str, Future]]:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.coalesce_seconds
+        while True:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return batch
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                return batch
+
+    @staticmethod
+    def combine(batch: list[str]) -> list[str]:
+        """Join a batch into as few notifications as fit within Pushover's message length"""
+        messages = []
+        for text in batch:
+            text = text[:PUSHOVER_MAX_LENGTH]
+            if messages and len(messages[-1]) + 1 + len(text) <= PUSHOVER_MAX_LENGTH:
+                messages[-1] += "\n" + text
+            else:
+                messages.append(text)
+        return messages
+
+    async def _send(self, message: str) -> Exception | None:
+        """Send with retries; returns the error if it could not be sent"""
+        for attempt in range(PUSH_MAX_RETRIES + 1):
+            try:
+                await self.backend.send(message)
+                return None
+            except Exception as e:
+                if attempt == PUSH_MAX_RETRIES or not is_retryable(e):
+                    print(f"Unable to send notification: {e}")
+                    return e
+                await asyncio.sleep(min(2**attempt, 30) * random.uniform(0.5, 1.5))
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            error = None
+            try:
+                for message in self.combine([message for message, _ in batch]):
+                    error = await self._send(message) or error
+            except asyncio.CancelledError:
+                error = RuntimeError("The notification dispatcher was closed")
+                raise
+            finally:
+                for _, delivered in batch:
+                    if error is None:
+                        delivered.set_result(True)
+                    else:
+                        delivered.set_exception(error)
+                    self.queue.task_done()
+
+    async def flush(self, timeout: float = PUSH_TIMEOUT_SECONDS) -> None:
+        """Wait until everything queued so far has been sent, or has failed"""
+        if self.queue is not None and self.task is not None and not self.task.done():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.backend is not None:
+            await self.backend.close()
+            self.backend = None
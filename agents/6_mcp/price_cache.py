@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+from database import (
+    claim_price_fetches, read_cached_prices, read_price_fetches, release_price_fetches, write_cached_prices,
+)
+
+# How long a process may hold the lease on fetching a symbol, and how often others check for its result
+FETCH_LEASE_SECONDS = 30.0
+FETCH_POLL_SECONDS = 0.05
+
+
+class PriceCache:
+    """
+    A TTL cache for share prices with two tiers: an in-process dict, and the price_cache table
+    that every process (trading floor, MCP servers, dashboard) can read one symbol at a time.
+
+    Concurrent misses for the same symbol are coalesced: the first caller fetches, and any other
+    thread asking for that symbol meanwhile waits for the same result instead of making its own request.
+    Across processes, the fetching process holds a lease in the price_fetches table; another process that
+    misses waits for the price to appear in price_cache, and fetches itself only if the lease lapses.
+    """
+
+    def __init__(self, expires_at: Callable[[], float]):
+        """
+        Args:
+            expires_at: Returns the epoch time at which a price fetched now should expire
+        """
+        self.expires_at = expires_at
+        self.prices: dict[str, tuple[float, float]] = {}
+        self.in_flight: dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, symbols: list[str], fetch: Callable[[list[str]], dict[str, float]]) -> dict[str, float]:
+        """
+        Return prices for the symbols, calling fetch(missing_symbols) at most once for whatever is not cached.
+        fetch may return more symbols than it was asked for; the extras are cached too.
+        """
+        now = time.time()
+        found = {}
+        missing = []
+        for symbol in symbols:
+            cached = self.prices.get(symbol)
+            if cached and cached[1] > now:
+                found[symbol] = cached[0]
+            else:
+                missing.append(symbol)
+        if not missing:
+            return found
+
+        from_disk = read_cached_prices(missing, now)
+        for symbol, (price, expires_at) in from_disk.items():
+            self.prices[symbol] = (price, expires_at)
+            found[symbol] = price
+        missing = [symbol for symbol in missing if symbol not in from_disk]
+        if not missing:
+            return found
+
+        waiting = {}
+        mine = []
+        future = Future()
+        with self.lock:
+            for symbol in missing:
+                if symbol in self.in_flight:
+                    waiting[symbol] = self.in_flight[symbol]
+                else:
+                    self.in_flight[symbol] = future
+                    mine.append(symbol)
+
+        if mine:
+            try:
+                fetched = self._fetch_shared(mine, fetch)
+                future.set_result(fetched)
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self.lock:
+                    for symbol in mine:
+                        self.in_flight.pop(symbol, None)
+            for symbol in mine:
+                found[symbol] = fetched[symbol]
+
+        for symbol, other in waiting.items():
+            found[symbol] = other.result().get(symbol, 0.0)
+        return found
+
+    def _fetch(self, symbols: list[str], fetch: Callable[[list[str]], dict[str, float]]) -> dict[str, float]:
+        # Symbols the source doesn't know are cached as 0.0 too, so they don't keep missing
+        fetched = {symbol: 0.0 for symbol in symbols} | fetch(symbols)
+        expires_at = self.expires_at()
+        write_cached_prices(fetched, expires_at)
+        for symbol, price in fetched.items():
+            self.prices[symbol] = (price, expires_at)
+        return fetched
+
+    def _fetch_shared(self, symbols: list[str], fetch: Callable[[list[str]], dict[str, float]]) -> dict[str, float]:
+        """Fetch the symbols this process holds the lease for, and wait for other processes' fetches of the rest"""
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        claimed = claim_price_fetches(symbols, owner, time.time(), FETCH_LEASE_SECONDS)
+        fetched = {}
+        if claimed:
+            try:
+                fetched = self._fetch(claimed, fetch)
+            finally:
+                release_price_fetches(claimed, owner)
+        waiting = [symbol for symbol in symbols if symbol not in fetched]
+        while waiting:
+            now = time.time()
+            for symbol, (price, expires_at) in read_cached_prices(waiting, now).items():
+                self.prices[symbol] = (price, expires_at)
+                fetched[symbol] = price
+            waiting = [symbol for symbol in waiting if symbol not in fetched]
+            if not waiting:
+                break
+            abandoned = [symbol for symbol in waiting if symbol not in read_price_fetches(waiting, now)]
+            if abandoned:
+                # The other process failed or gave up without caching a price
+                fetched |= self._fetch(abandoned, fetch)
+                waiting = [symbol for symbol in waiting if symbol not in fetched]
+            if waiting:
+                time.sleep(FETCH_POLL_SECONDS)
+        return fetched
+
+    def clear(self) -> None:
+        self.prices.clear()
@@ -1,17 +1,21 @@
-import os
-from dotenv import load_dotenv
-import requests
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from mcp.server.fastmcp import FastMCP
+from notifications import NotificationDispatcher
 
-load_dotenv(override=True)
+dispatcher = NotificationDispatcher()
 
-pushover_user = os.getenv("PUSHOVER_USER")
-pushover_token = os.getenv("PUSHOVER_TOKEN")
-pushover_url = "https://api.pushover.net/1/messages.json"
 
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    try:
+        yield
+    finally:
+        # Send whatever is still queued before the server exits
+        await dispatcher.close()
 
-mcp = FastMCP("push_server")
+
+mcp = FastMCP("push_server", lifespan=lifespan)
 
 
 class PushModelArgs(BaseModel):
@@ -19,12 +23,11 @@ class PushModelArgs(BaseModel):
 
 
 @mcp.tool()
-def push(args: PushModelArgs):
+async def push(args: PushModelArgs):
     """Send a push notification with this brief message"""
     print(f"Push: {args.message}")
-    payload = {"user": pushover_user, "token": pushover_token, "message": args.message}
-    requests.post(pushover_url, data=payload)
-    return "Push notification sent"
+    dispatcher.notify(args.message)
+    return "Push notification queued"
 
 
 if __name__ == "__main__":
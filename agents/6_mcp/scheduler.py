@@ -0,0 +1,133 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable
+from metrics import record_wait
+
+
+class TokenBucket:
+    """
+    A token bucket for one model provider: requests take a token, tokens refill at a steady rate,
+    and a short burst of up to `burst` requests is allowed. Callers wait, rather than fail, when it is empty.
+    Only used from the trading floor's event loop, so no locking is needed.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int | None = None):
+        self.rate = requests_per_minute / 60
+        self.capacity = burst or max(1, int(requests_per_minute // 10))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """Take a token, waiting for one if necessary; returns the seconds spent waiting"""
+        start = time.monotonic()
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return time.monotonic() - start
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TraderScheduler:
+    """
+    Runs traders on a fixed-rate tick that does not drift with how long the traders take.
+    Each tick starts every trader that is not still running from an earlier tick, after a random jitter,
+    with at most max_parallel traders running at once and each run cut off after timeout seconds.
+    """
+
+    def __init__(
+        self,
+        traders: list,
+        run_trader: Callable[[object], Awaitable[None]],
+        interval_seconds: float,
+        max_parallel: int,
+        timeout_seconds: float,
+        jitter_seconds: float = 0,
+        should_run: Callable[[], Awaitable[bool]] | None = None,
+        between_runs: Callable[[], Awaitable[None]] | None = None,
+        seconds_until_open: Callable[[], float] | None = None,
+    ):
+        """
+        Args:
+            traders: The traders to schedule; each needs a unique name
+            run_trader: Coroutine function that runs one trader for one cycle
+            interval_seconds: Time between ticks
+            max_parallel: Maximum number of traders running at the same time
+            timeout_seconds: A trader run that takes longer than this is cancelled
+            jitter_seconds: Each run starts after a random delay of up to this many seconds
+            should_run: Checked at each tick; if it returns False, the tick is skipped
+            between_runs: Housekeeping called at a tick when no trader is running
+            seconds_until_open: How long until the traders may next run; the scheduler sleeps until then
+                instead of waking at every tick while the market is closed
+        """
+        self.traders = traders
+        self.run_trader = run_trader
+        self.interval = interval_seconds
+        self.semaphore = asyncio.Semaphore(max_parallel)
+        self.timeout = timeout_seconds
+        self.jitter = jitter_seconds
+        self.should_run = should_run
+        self.between_runs = between_runs
+        self.seconds_until_open = seconds_until_open
+        self.running: dict[str, asyncio.Task] = {}
+
+    def is_idle(self) -> bool:
+        return all(task.done() for task in self.running.values())
+
+    async def run_one(self, trader) -> None:
+        await asyncio.sleep(random.uniform(0, self.jitter))
+        queued = time.monotonic()
+        async with self.semaphore:
+            record_wait("scheduler", time.monotonic() - queued, trader.name.lower())
+            try:
+                await asyncio.wait_for(self.run_trader(trader), self.timeout)
+            except asyncio.TimeoutError:
+                print(f"Trader {trader.name} timed out after {self.timeout:.0f} seconds")
+            except Exception as e:
+                print(f"Error running trader {trader.name}: {e}")
+
+    async def tick(self) -> None:
+        if self.is_idle() and self.between_runs:
+            await self.between_runs()
+        if self.should_run and not await self.should_run():
+            print("Market is closed, skipping run")
+            return
+        for trader in self.traders:
+            task = self.running.get(trader.name)
+            if task and not task.done():
+                print(f"Trader {trader.name} is still running from the last cycle, skipping")
+                continue
+            self.running[trader.name] = asyncio.create_task(self.run_one(trader), name=f"trader-{trader.name}")
+
+    async def run_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        try:
+            while True:
+                if self.seconds_until_open and self.is_idle():
+                    delay = self.seconds_until_open()
+                    if delay > 0:
+                        print(f"Market is closed, sleeping {delay / 3600:.1f} hours until it opens")
+                        await asyncio.sleep(delay)
+                        next_tick = loop.time()
+                await self.tick()
+                next_tick += self.interval
+                now = loop.time()
+                if next_tick <= now:
+                    # We fell behind by a whole interval or more; skip the missed ticks instead of bursting
+                    next_tick += ((now - next_tick) // self.interval + 1) * self.interval
+                await asyncio.sleep(next_tick - now)
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        tasks = [task for task in self.running.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
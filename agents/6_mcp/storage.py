@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+DB = os.getenv("ACCOUNTS_DB", "accounts.db")
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to every new connection; journal_mode=WAL is persistent in the file but is cheap to re-assert
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={MMAP_SIZE}",
+    f"PRAGMA cache_size=-{CACHE_SIZE_KB}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+]
+
+_local = threading.local()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # isolation_level=None puts the connection in autocommit mode: single statements commit on their own,
+    # and multi-statement writes are grouped explicitly with transaction() below
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection(path: str = DB) -> sqlite3.Connection:
+    """
+    Return the connection for this thread, opening it on first use.
+
+    Connections are cached per thread (and per process, so a forked child never reuses its parent's handle);
+    sqlite3 keeps a prepared-statement cache on each connection, so repeated queries skip re-parsing.
+    """
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+    conn = _local.connections.get(path)
+    if conn is None:
+        conn = _connect(path)
+        _local.connections[path] = conn
+    return conn
+
+
+def close_connection(path: str = DB) -> None:
+    """Close this thread's cached connection, if any."""
+    if getattr(_local, "pid", None) != os.getpid():
+        return
+    conn = _local.connections.pop(path, None)
+    if conn is not None:
+        conn.close()
+
+
+@contextmanager
+def transaction(immediate: bool = False, path: str = DB):
+    """
+    Group several statements into one transaction and a single commit.
+
+    Use immediate=True for read-modify-write sequences: it takes the write lock up front so that
+    concurrent writers queue on busy_timeout instead of failing at commit time.
+    Nested use joins the outer transaction.
+    """
+    conn = get_connection(path)
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+def execute(sql: str, params=(), path: str = DB) -> sqlite3.Cursor:
+    return get_connection(path).execute(sql, params)
+
+
+def executemany(sql: str, seq_of_params, path: str = DB) -> sqlite3.Cursor:
+    with transaction(path=path) as conn:
+        return conn.executemany(sql, seq_of_params)
+
+
+def checkpoint(path: str = DB) -> None:
+    """Fold the WAL back into the main database file; useful before copying accounts.db around."""
+    get_connection(path).execute("PRAGMA wal_checkpoint(TRUNCATE)")
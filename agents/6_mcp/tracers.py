@@ -1,39 +1,59 @@
-from agents import TracingProcessor, Trace, Span
-from database import write_log
+from contextlib import contextmanager
+from agents import TracingProcessor, Trace, Span, trace
+from log_sink import get_log_sink
 import secrets
-import string
 
-ALPHANUM = string.ascii_lowercase + string.digits 
+# The trader each live trace belongs to, so span callbacks find the name with a dict lookup
+_trace_names: dict[str, str] = {}
+
 
 def make_trace_id(tag: str) -> str:
     """
-    Return a string of the form 'trace_<tag><random>',
-    where the total length after 'trace_' is 32 chars.
+    Return a new trace id of the form 'trace_<32 random hex chars>', and remember that it belongs to `tag`.
+    The id must be released with release_trace_id once the trace has ended.
     """
-    tag += "0"
-    pad_len = 32 - len(tag)
-    random_suffix = ''.join(secrets.choice(ALPHANUM) for _ in range(pad_len))
-    return f"trace_{tag}{random_suffix}"
+    trace_id = f"trace_{secrets.token_hex(16)}"
+    _trace_names[trace_id] = tag
+    return trace_id
+
+
+def release_trace_id(trace_id: str) -> None:
+    _trace_names.pop(trace_id, None)
+
+
+def get_trader_name(trace_id: str) -> str | None:
+    """The trader a trace id was made for, or None for other traces"""
+    return _trace_names.get(trace_id)
+
+
+@contextmanager
+def trader_trace(trace_name: str, tag: str):
+    """Trace a trader's run; the tag is recorded for the tracers here and as metadata for the trace viewer"""
+    trace_id = make_trace_id(tag)
+    try:
+        with trace(trace_name, trace_id=trace_id, metadata={"trader": tag}):
+            yield trace_id
+    finally:
+        release_trace_id(trace_id)
+
 
 class LogTracer(TracingProcessor):
 
+    def __init__(self):
+        self.sink = get_log_sink()
+
     def get_name(self, trace_or_span: Trace | Span) -> str | None:
-        trace_id = trace_or_span.trace_id
-        name = trace_id.split("_")[1]
-        if '0' in name:
-            return name.split("0")[0]
-        else:
-            return None
+        return get_trader_name(trace_or_span.trace_id)
 
     def on_trace_start(self, trace) -> None:
         name = self.get_name(trace)
         if name:
-            write_log(name, "trace", f"Started: {trace.name}")
+            self.sink.write(name, "trace", f"Started: {trace.name}")
 
     def on_trace_end(self, trace) -> None:
         name = self.get_name(trace)
         if name:
-            write_log(name, "trace", f"Ended: {trace.name}")
+            self.sink.write(name, "trace", f"Ended: {trace.name}")
 
     def on_span_start(self, span) -> None:
         name = self.get_name(span)
@@ -49,7 +69,7 @@ class LogTracer(TracingProcessor):
                     message += f" {span.span_data.server}"
             if span.error:
                 message += f" {span.error}"
-            write_log(name, type, message)
+            self.sink.write(name, type, message)
 
     def on_span_end(self, span) -> None:
         name = self.get_name(span)
@@ -66,10 +86,10 @@ class LogTracer(TracingProcessor):
                     message += f" {span.span_data.server}"
             if span.error:
                 message += f" {span.error}"
-            write_log(name, type, message)
+            self.sink.write(name, type, message)
 
     def force_flush(self) -> None:
-        pass
+        self.sink.force_flush()
 
     def shutdown(self) -> None:
-        pass
\ No newline at end of file
+        self.sink.shutdown()
\ No newline at end of file
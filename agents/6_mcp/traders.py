@@ -1,12 +1,13 @@
 from contextlib import AsyncExitStack
-from accounts_client import read_accounts_resource, read_strategy_resource
-from tracers import make_trace_id
-from agents import Agent, Tool, Runner, OpenAIChatCompletionsModel, trace
-from openai import AsyncOpenAI
+import asyncio
+from accounts_client import read_context_resource
+from tracers import trader_trace
+from agents import Agent, Tool, Runner, OpenAIChatCompletionsModel, OpenAIResponsesModel
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 import os
 import json
-from agents.mcp import MCPServerStdio
+from inprocess_mcp import make_mcp_server
 from templates import (
     researcher_instructions,
     trader_instructions,
@@ -15,6 +16,9 @@ from templates import (
     research_tool,
 )
 from mcp_params import trader_mcp_server_params, researcher_mcp_server_params
+from mcp_pool import MCPServerPool
+from scheduler import TokenBucket
+from metrics import record_wait
 
 load_dotenv(override=True)
 
@@ -30,29 +34,77 @@ OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
 MAX_TURNS = 30
 
-openrouter_client = AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=openrouter_api_key)
-deepseek_client = AsyncOpenAI(base_url=DEEPSEEK_BASE_URL, api_key=deepseek_api_key)
-grok_client = AsyncOpenAI(base_url=GROK_BASE_URL, api_key=grok_api_key)
-gemini_client = AsyncOpenAI(base_url=GEMINI_BASE_URL, api_key=google_api_key)
+# Each provider has its own quota, so each gets its own token bucket; every request to the provider takes a token
+PROVIDER_REQUESTS_PER_MINUTE = {
+    "openai": float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500")),
+    "openrouter": float(os.getenv("OPENROUTER_REQUESTS_PER_MINUTE", "60")),
+    "deepseek": float(os.getenv("DEEPSEEK_REQUESTS_PER_MINUTE", "60")),
+    "grok": float(os.getenv("GROK_REQUESTS_PER_MINUTE", "60")),
+    "gemini": float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "15")),
+}
+rate_limits = {provider: TokenBucket(rpm) for provider, rpm in PROVIDER_REQUESTS_PER_MINUTE.items()}
 
 
-def get_model(model_name: str):
+def rate_limited_http_client(provider: str):
+    bucket = rate_limits[provider]
+
+    async def wait_for_token(request):
+        record_wait(f"rate_limit:{provider}", await bucket.acquire())
+
+    return DefaultAsyncHttpxClient(event_hooks={"request": [wait_for_token]})
+
+
+openai_client = AsyncOpenAI(http_client=rate_limited_http_client("openai"))
+openrouter_client = AsyncOpenAI(
+    base_url=OPENROUTER_BASE_URL, api_key=openrouter_api_key, http_client=rate_limited_http_client("openrouter")
+)
+deepseek_client = AsyncOpenAI(
+    base_url=DEEPSEEK_BASE_URL, api_key=deepseek_api_key, http_client=rate_limited_http_client("deepseek")
+)
+grok_client = AsyncOpenAI(base_url=GROK_BASE_URL, api_key=grok_api_key, http_client=rate_limited_http_client("grok"))
+gemini_client = AsyncOpenAI(
+    base_url=GEMINI_BASE_URL, api_key=google_api_key, http_client=rate_limited_http_client("gemini")
+)
+
+
+def get_provider(model_name: str) -> str:
     if "/" in model_name:
-        return OpenAIChatCompletionsModel(model=model_name, openai_client=openrouter_client)
+        return "openrouter"
     elif "deepseek" in model_name:
-        return OpenAIChatCompletionsModel(model=model_name, openai_client=deepseek_client)
+        return "deepseek"
     elif "grok" in model_name:
-        return OpenAIChatCompletionsModel(model=model_name, openai_client=grok_client)
+        return "grok"
     elif "gemini" in model_name:
+        return "gemini"
+    else:
+        return "openai"
+
+
+def get_model(model_name: str):
+    provider = get_provider(model_name)
+    if provider == "openrouter":
+        return OpenAIChatCompletionsModel(model=model_name, openai_client=openrouter_client)
+    elif provider == "deepseek":
+        return OpenAIChatCompletionsModel(model=model_name, openai_client=deepseek_client)
+    elif provider == "grok":
+        return OpenAIChatCompletionsModel(model=model_name, openai_client=grok_client)
+    elif provider == "gemini":
         return OpenAIChatCompletionsModel(model=model_name, openai_client=gemini_client)
     else:
-        return model_name
+        return OpenAIResponsesModel(model=model_name, openai_client=openai_client)
+
+
+def server_version(server) -> str | None:
+    """The version a stdio MCP server reported when it connected"""
+    initialized = getattr(server, "server_initialize_result", None)
+    return initialized.serverInfo.version if initialized else None
 
 
 async def get_researcher(mcp_servers, model_name) -> Agent:
     researcher = Agent(
         name="Researcher",
-        instructions=researcher_instructions(),
+        # Called on each run, so that a cached agent still sees the current datetime
+        instructions=lambda context, agent: researcher_instructions(),
         model=get_model(model_name),
         mcp_servers=mcp_servers,
     )
@@ -69,6 +121,7 @@ class Trader:
         self.name = name
         self.lastname = lastname
         self.agent = None
+        self.agent_key = None
         self.model_name = model_name
         self.do_trade = True
 
@@ -83,49 +136,63 @@ class Trader:
         )
         return self.agent
 
-    async def get_account_report(self) -> str:
-        account = await read_accounts_resource(self.name)
-        account_json = json.loads(account)
-        account_json.pop("portfolio_value_time_series", None)
-        return json.dumps(account_json)
+    async def get_agent(self, trader_mcp_servers, researcher_mcp_servers) -> Agent:
+        """
+        The trader agent and its researcher tool, built once and reused across runs. They are rebuilt when the model
+        or any MCP server changes: a server the pool restarted is a new server, and may report a new version.
+        """
+        servers = trader_mcp_servers + researcher_mcp_servers
+        key = (self.model_name, *[(server, server_version(server)) for server in servers])
+        if self.agent is None or key != self.agent_key:
+            self.agent = await self.create_agent(trader_mcp_servers, researcher_mcp_servers)
+            self.agent_key = key
+        return self.agent
+
+    async def get_account_report(self) -> tuple[str, str]:
+        """The account report and strategy, fetched together"""
+        context = await read_context_resource(self.name)
+        context["account"].pop("portfolio_value_time_series", None)
+        return json.dumps(context["account"]), context["strategy"]
 
     async def run_agent(self, trader_mcp_servers, researcher_mcp_servers):
-        self.agent = await self.create_agent(trader_mcp_servers, researcher_mcp_servers)
-        account = await self.get_account_report()
-        strategy = await read_strategy_resource(self.name)
+        agent = await self.get_agent(trader_mcp_servers, researcher_mcp_servers)
+        account, strategy = await self.get_account_report()
         message = (
             trade_message(self.name, strategy, account)
             if self.do_trade
             else rebalance_message(self.name, strategy, account)
         )
-        await Runner.run(self.agent, message, max_turns=MAX_TURNS)
-
-    async def run_with_mcp_servers(self):
+        await Runner.run(agent, message, max_turns=MAX_TURNS)
+
+    async def run_with_mcp_servers(self, pool: MCPServerPool | None = None):
+        if pool:
+            trader_mcp_servers, researcher_mcp_servers = await asyncio.gather(
+                pool.get_all(trader_mcp_server_params),
+                pool.get_all(researcher_mcp_server_params(self.name)),
+            )
+            await self.run_agent(trader_mcp_servers, researcher_mcp_servers)
+            return
         async with AsyncExitStack() as stack:
             trader_mcp_servers = [
-                await stack.enter_async_context(
-                    MCPServerStdio(params, client_session_timeout_seconds=120)
-                )
+                await stack.enter_async_context(make_mcp_server(params))
                 for params in trader_mcp_server_params
             ]
             async with AsyncExitStack() as stack:
                 researcher_mcp_servers = [
-                    await stack.enter_async_context(
-                        MCPServerStdio(params, client_session_timeout_seconds=120)
-                    )
+                    await stack.enter_async_context(make_mcp_server(params))
                     for params in researcher_mcp_server_params(self.name)
                 ]
                 await self.run_agent(trader_mcp_servers, researcher_mcp_servers)
 
-    async def run_with_trace(self):
+    async def run_with_trace(self, pool: MCPServerPool | None = None):
         trace_name = f"{self.name}-trading" if self.do_trade else f"{self.name}-rebalancing"
-        trace_id = make_trace_id(f"{self.name.lower()}")
-        with trace(trace_name, trace_id=trace_id):
-            await self.run_with_mcp_servers()
+        with trader_trace(trace_name, self.name.lower()):
+            await self.run_with_mcp_servers(pool)
 
-    async def run(self):
+    async def run(self, pool: MCPServerPool | None = None):
+        """Run one trading cycle; with a pool, MCP servers are reused rather than spawned for this run"""
         try:
-            await self.run_with_trace()
+            await self.run_with_trace(pool)
         except Exception as e:
             print(f"Error running trader {self.name}: {e}")
         self.do_trade = not self.do_trade
@@ -2,8 +2,14 @@ from traders import Trader
 from typing import List
 import asyncio
 from tracers import LogTracer
+from metrics import MetricsTracer
+from mcp_pool import MCPServerPool
+from accounts_client import close_accounts_client
 from agents import add_trace_processor
-from market import is_market_open
+from market import is_market_open, polygon_api_key
+from market_calendar import reconcile, is_market_open as is_open_by_calendar, seconds_until_open
+from database import prune_logs, prune_portfolio_values
+from scheduler import TraderScheduler
 from dotenv import load_dotenv
 import os
 
@@ -14,6 +20,11 @@ RUN_EVEN_WHEN_MARKET_IS_CLOSED = (
     os.getenv("RUN_EVEN_WHEN_MARKET_IS_CLOSED", "false").strip().lower() == "true"
 )
 USE_MANY_MODELS = os.getenv("USE_MANY_MODELS", "false").strip().lower() == "true"
+MAX_PARALLEL_TRADERS = int(os.getenv("MAX_PARALLEL_TRADERS", "4"))
+TRADER_TIMEOUT_MINUTES = float(os.getenv("TRADER_TIMEOUT_MINUTES", str(RUN_EVERY_N_MINUTES)))
+START_JITTER_SECONDS = float(os.getenv("START_JITTER_SECONDS", "30"))
+# MCP servers unused for this long are closed between runs, such as overnight, and restarted when next needed
+MCP_IDLE_MINUTES = float(os.getenv("MCP_IDLE_MINUTES", str(2 * RUN_EVERY_N_MINUTES)))
 
 names = ["Warren", "George", "Ray", "Cathie"]
 lastnames = ["Patience", "Bold", "Systematic", "Crypto"]
@@ -38,15 +49,41 @@ def create_traders() -> List[Trader]:
     return traders
 
 
+async def should_run() -> bool:
+    """Answered by the local calendar, which is checked against Polygon each day until Polygon gives a settled answer"""
+    if RUN_EVEN_WHEN_MARKET_IS_CLOSED:
+        return True
+    if polygon_api_key:
+        await asyncio.to_thread(reconcile, is_market_open)
+    return is_open_by_calendar()
+
+
 async def run_every_n_minutes():
     add_trace_processor(LogTracer())
+    add_trace_processor(MetricsTracer())
     traders = create_traders()
-    while True:
-        if RUN_EVEN_WHEN_MARKET_IS_CLOSED or is_market_open():
-            await asyncio.gather(*[trader.run() for trader in traders])
-        else:
-            print("Market is closed, skipping run")
-        await asyncio.sleep(RUN_EVERY_N_MINUTES * 60)
+    async with MCPServerPool(idle_seconds=MCP_IDLE_MINUTES * 60) as pool:
+
+        async def between_runs():
+            await pool.check_health()
+            await asyncio.to_thread(prune_logs)
+            await asyncio.to_thread(prune_portfolio_values)
+
+        scheduler = TraderScheduler(
+            traders,
+            run_trader=lambda trader: trader.run(pool),
+            interval_seconds=RUN_EVERY_N_MINUTES * 60,
+            max_parallel=MAX_PARALLEL_TRADERS,
+            timeout_seconds=TRADER_TIMEOUT_MINUTES * 60,
+            jitter_seconds=START_JITTER_SECONDS,
+            should_run=should_run,
+            between_runs=between_runs,
+            seconds_until_open=None if RUN_EVEN_WHEN_MARKET_IS_CLOSED else seconds_until_open,
+        )
+        try:
+            await scheduler.run_forever()
+        finally:
+            await close_accounts_client()
 
 
 if __name__ == "__main__":